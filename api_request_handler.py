@@ -2,12 +2,24 @@ import os
 import threading
 import time
 
-import requests
 from requests_oauthlib import OAuth1
 
+import http_client
+import metrics
+from single_flight import SingleFlight
+
 # Global variables
-TOKEN_CACHE = {"token": None, "expires_at": 0}
-TOKEN_LOCK = threading.Lock()  # Prevent race conditions when updating Token
+TOKEN_CACHE = {"token": None, "expires_at": 0, "refresh_at": 0}
+TOKEN_LOCK = threading.Lock()  # Only held while fetching a new Token; readers of a valid Token never take it
+
+# 在 Token 到期前多久於背景先換新 (秒)；有效期較短時改為有效期的一半
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+TOKEN_PREFETCH_RETRY = 15  # 背景換新失敗後的重試間隔 (秒)
+# versions/latest 回應的微快取 (秒)，0 表示停用
+LATEST_VERSION_CACHE_TTL = float(os.getenv("LATEST_VERSION_CACHE_TTL", "5"))
+
+_prefetch_thread = None
+_prefetch_lock = threading.Lock()
 
 
 def load_credentials(file_path="credential.properties"):
@@ -58,27 +70,48 @@ CLIENT_SECRET = CREDENTIALS.get("here.access.key.secret")
 def get_oauth_token():
     """
     Obtain OAuth2 Token, ensuring it is shared within its validity period.
+    A valid Token is returned without locking; it is renewed in the background before it expires.
     """
-    global TOKEN_CACHE
-
     # Ensure credentials are valid before attempting token request
     if credentials_result["status"] == "error":
         raise Exception(f"Cannot retrieve Token: {credentials_result['message']}")
 
-    with TOKEN_LOCK:
-        # Return cached Token if still valid
-        if TOKEN_CACHE["token"] and time.time() < TOKEN_CACHE["expires_at"]:
-            return TOKEN_CACHE["token"]
+    cache = TOKEN_CACHE
+    if cache["token"] and time.time() < cache["expires_at"]:
+        metrics.cache_result("token", True)
+        return cache["token"]
+    metrics.cache_result("token", False)
+    return refresh_token()
+
+
+def refresh_token(rejected=None, prefetch=False):
+    """
+    Request a new Token, unless another thread already did while this one waited for TOKEN_LOCK.
+    ``rejected`` is a Token upstream answered 401 for: it is replaced even if it has not expired yet.
+    ``prefetch`` renews a Token that is valid but past its refresh time.
+    """
+    global TOKEN_CACHE
+
+    with metrics.stage("token"), TOKEN_LOCK:
+        token = TOKEN_CACHE["token"]
+        now = time.time()
+        if token and token != rejected and now < TOKEN_CACHE["expires_at"] and \
+                (not prefetch or now < TOKEN_CACHE["refresh_at"]):
+            return token
 
         # Request a new Token
         oauth = OAuth1(client_key=CLIENT_ID, client_secret=CLIENT_SECRET, signature_type='auth_header')
-        response = requests.post(OAUTH2_URL, data={"grant_type": "client_credentials"},
+        response = http_client.post(OAUTH2_URL, data={"grant_type": "client_credentials"},
                                  auth=oauth, headers={"Content-Type": "application/x-www-form-urlencoded"})
 
         if response.status_code == 200:
             data = response.json()
-            TOKEN_CACHE["token"] = data["access_token"]
-            TOKEN_CACHE["expires_at"] = time.time() + data.get("expires_in", 3600)  # Default 1-hour expiration
+            lifetime = data.get("expires_in", 3600)  # Default 1-hour expiration
+            fetched_at = time.time()
+            # 整個 dict 一次替換，讀取端不會看到新舊混合的 Token 與到期時間
+            TOKEN_CACHE = {"token": data["access_token"], "expires_at": fetched_at + lifetime,
+                           "refresh_at": fetched_at + lifetime - min(TOKEN_REFRESH_MARGIN, lifetime / 2)}
+            start_token_prefetch()
             return TOKEN_CACHE["token"]
         elif response.status_code == 401:
             raise Exception("Invalid credentials: Authentication failed (401 Unauthorized). Please check API keys.")
@@ -86,6 +119,28 @@ def get_oauth_token():
             raise Exception(f"OAuth2 Token request failed: {response.text}")
 
 
+def start_token_prefetch():
+    """
+    Start the daemon thread that renews the Token at its refresh time, so requests never wait for a Token.
+    """
+    global _prefetch_thread
+    with _prefetch_lock:
+        if _prefetch_thread is not None and _prefetch_thread.is_alive():
+            return
+        _prefetch_thread = threading.Thread(target=_prefetch_loop, name="token-prefetch", daemon=True)
+        _prefetch_thread.start()
+
+
+def _prefetch_loop():
+    while True:
+        time.sleep(max(TOKEN_CACHE["refresh_at"] - time.time(), 0))
+        try:
+            refresh_token(prefetch=True)
+        except Exception as e:
+            print(f"[WARN] Background Token refresh failed: {e}")
+            time.sleep(TOKEN_PREFETCH_RETRY)
+
+
 def validate_credentials():
     """
     Validate the credentials by attempting to retrieve a Token.
@@ -104,27 +159,59 @@ def validate_credentials():
         raise Exception(f"[ERROR] {str(e)}")
 
 
-def request_with_token_refresh(url, method="GET", retry=True):
+# 相同 URL 同時進行的 GET 共用一次上游呼叫
+UPSTREAM_GETS = SingleFlight("upstream_get")
+_latest_responses = {}  # url -> (expires, response)
+_latest_lock = threading.Lock()
+
+
+def request_with_token_refresh(url, method="GET", retry=True, **kwargs):
     """
-    Perform an API request, refreshing Token on 401 Unauthorized.
+    Perform an API request through the pooled HTTP client, refreshing Token on 401 Unauthorized.
+    Extra keyword arguments (e.g. stream=True) are passed to the HTTP client.
+
+    Buffered GETs go through UPSTREAM_GETS, so identical concurrent requests share one upstream call and one
+    response object (read-only for callers); versions/latest answers are also reused for LATEST_VERSION_CACHE_TTL.
     """
+    if method != "GET" or kwargs.get("stream"):
+        return _request_with_token(url, method, retry, **kwargs)
+
+    latest = LATEST_VERSION_CACHE_TTL > 0 and http_client.endpoint_label(url) == "versions_latest"
+    if latest:
+        cached = _latest_responses.get(url)
+        hit = cached is not None and time.monotonic() < cached[0]
+        metrics.cache_result("latest_version", hit)
+        if hit:
+            return cached[1]
+
+    def fetch():
+        response = _request_with_token(url, method, retry, **kwargs)
+        if latest and response.status_code == 200:
+            with _latest_lock:
+                _latest_responses[url] = (time.monotonic() + LATEST_VERSION_CACHE_TTL, response)
+        return response
+
+    return UPSTREAM_GETS.do((url, repr(sorted(kwargs.items()))), fetch)
+
 
+def _request_with_token(url, method, retry, **kwargs):
     def make_request(token):
         headers = {"Authorization": f"Bearer {token}"}
         if method == "GET":
-            return requests.get(url, headers=headers)
+            return http_client.get(url, headers=headers, **kwargs)
         elif method == "POST":
-            return requests.post(url, headers=headers)
+            return http_client.post(url, headers=headers, **kwargs)
         else:
             raise ValueError("Unsupported HTTP method")
 
     token = get_oauth_token()
     response = make_request(token)
 
-    # If Token expired (401), refresh it and retry once
+    # If Token was rejected (401), replace exactly that Token and retry once
     if response.status_code == 401 and retry:
-        print("[WARN] Token expired, refreshing and retrying...")
-        token = get_oauth_token()  # Obtain new Token
+        print("[WARN] Token rejected, refreshing and retrying...")
+        response.close()
+        token = refresh_token(rejected=token)  # 其他執行緒已換新時直接沿用
         response = make_request(token)  # Retry request with new Token
 
     return response
@@ -1,22 +1,199 @@
+import gzip
+import hmac
+import json
 import os
+import time
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 
 import api_request_handler
-from opensearch_version_query_service import get_opensearch_hmc_dvn_worker, get_latest_catalog_version
-from rmob_version_query_service import fetch_pbf_and_cache, get_rmob_dvn_query_worker, get_hmc_dvn_query_worker
+import metrics
+import request_profiler
+import rmob_version_query_service
+import upstream_guard
+import version_tracker
+from opensearch_version_query_service import get_opensearch_hmc_dvn_worker, filter_opensearch_versions_by_hrn, \
+    CATALOG_HRN as OPENSEARCH_CATALOG_HRN
+from compatibility_matrix import matrix_for
+from response_cache import cached_json_response, make_etag, on_snapshot_published
+from rmob_version_query_service import get_rmob_dvn_query_worker, get_hmc_dvn_query_worker, batch_query_worker, \
+    resolve_hmc_version, changes_since
 
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "supersecretkey")  # 保護 session
 
-# 環境變數設定的 debug token
+# 環境變數設定的 debug token；維持預設值時不開放 profiling
 DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "changeme")
+DEBUG_ENABLED = DEBUG_TOKEN not in ("", "changeme")
+DEBUG_TOKEN_HEADER = "X-Debug-Token"
 
 
+# 單次 /batch 允許的查詢數上限
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "10000"))
+
+# 由快照回答的端點：回應附上快照年齡，過舊時標示 stale
+SNAPSHOT_ENDPOINTS = {"get_rmob_dvn", "get_hmc_dvn", "batch", "matrix", "changes", "get_opensearch_dependencies"}
+
 # 環境變數控制是否啟用 Debug API
 # DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() == "true"
 
 
+def snapshot_version():
+    snapshot = rmob_version_query_service.current_snapshot
+    return snapshot.version if snapshot is not None else None
+
+
+def is_debug_request():
+    supplied = request.headers.get(DEBUG_TOKEN_HEADER)
+    return DEBUG_ENABLED and supplied is not None and hmac.compare_digest(supplied, DEBUG_TOKEN)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if request.endpoint != "debug_profile" and is_debug_request():
+        g.request_profile = request_profiler.RequestProfile()
+
+
+@app.after_request
+def attach_request_profile(response):
+    """
+    For requests carrying the debug token, return {"response": <normal body>, "debug_profile": {...}} instead of
+    the body (status and other headers unchanged). 304 responses only get the X-Debug-Wall-Ms header.
+    """
+    profile = g.pop("request_profile", None)
+    if profile is None:
+        return response
+    report = profile.finish()
+    response.headers["X-Debug-Wall-Ms"] = str(report["wall_ms"])
+    if response.status_code == 304 or response.direct_passthrough:
+        return response
+
+    body = response.get_data()
+    if response.headers.get("Content-Encoding") == "gzip":
+        body = gzip.decompress(body)
+        del response.headers["Content-Encoding"]
+    try:
+        original = json.loads(body)
+    except ValueError:
+        original = body.decode("utf-8", "replace")
+    response.set_data(json.dumps({"response": original, "debug_profile": report}))
+    response.mimetype = "application/json"
+    response.headers.pop("ETag", None)  # 包裝後的內容不再對應原本的 ETag
+    return response
+
+
+@app.teardown_request
+def stop_request_profile(error=None):
+    # after_request 未執行 (例如回應前就出錯) 時仍要停止 profiler
+    profile = g.pop("request_profile", None)
+    if profile is not None:
+        profile.finish()
+
+
+@app.after_request
+def mark_snapshot_staleness(response):
+    """
+    X-Snapshot-Age-Seconds on snapshot-backed responses; past SNAPSHOT_MAX_STALENESS (e.g. upstream circuit open)
+    also X-Snapshot-Stale and a Warning: 110 header.
+    """
+    if request.endpoint not in SNAPSHOT_ENDPOINTS:
+        return response
+    age = version_tracker.staleness()
+    if age is not None:
+        response.headers["X-Snapshot-Age-Seconds"] = str(int(age))
+        if age > version_tracker.MAX_STALENESS:
+            response.headers["X-Snapshot-Stale"] = "true"
+            response.headers["Warning"] = '110 - "Response is Stale"'
+    return response
+
+
+@app.errorhandler(upstream_guard.UpstreamUnavailable)
+def upstream_unavailable(error):
+    response = jsonify({"error": f"Upstream unavailable: {error}", "retry_after_seconds": round(error.retry_after, 1)})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(max(1, int(error.retry_after + 0.5)))
+    return response
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.endpoint or "unmatched"
+        metrics.observe("http_request_duration_seconds", time.perf_counter() - started, endpoint=endpoint)
+        metrics.inc("http_requests_total", endpoint=endpoint, status=str(response.status_code))
+    return response
+
+
+# 新快照發佈前只丟掉受影響的快取回應
+rmob_version_query_service.add_snapshot_listener(on_snapshot_published)
+
+metrics.register_collector("snapshot_version", "gauge", "Version of the compatibility snapshot being served",
+                           snapshot_version)
+metrics.register_collector("snapshot_age_seconds", "gauge",
+                           "Seconds since the snapshot was last confirmed against upstream", version_tracker.staleness)
+metrics.register_collector(
+    "refresh_last_duration_seconds", "gauge", "Duration of the last snapshot refresh round",
+    lambda: version_tracker.REFRESH_STATUS["last_duration_ms"] / 1000
+    if version_tracker.REFRESH_STATUS["last_duration_ms"] is not None else None)
+metrics.register_collector(
+    "upstream_circuit_state", "gauge", "Circuit breaker state per upstream host (0 closed, 1 half-open, 2 open)",
+    lambda: [({"host": host}, upstream_guard.STATE_VALUES[guard["state"]])
+             for host, guard in upstream_guard.status().items()])
+metrics.register_collector(
+    "upstream_concurrency_limit", "gauge", "Current adaptive concurrency limit per upstream host",
+    lambda: [({"host": host}, guard["concurrency_limit"]) for host, guard in upstream_guard.status().items()])
+metrics.register_collector(
+    "latest_catalog_version", "gauge", "Latest known version of each tracked catalog",
+    lambda: [({"catalog": hrn}, version) for hrn, version in
+             sorted(rmob_version_query_service.latest_catalog_versions.items())])
+
+
+def load_compat_version(value):
+    """
+    Validate an optional compat_version argument and make sure its snapshot is loaded.
+    Returns (compat_version, None) or (None, error response).
+    """
+    if value is None or value == "":
+        return None, None
+    try:
+        compat_version = int(value)
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": f"Invalid compat_version: {value}"}), 400)
+    try:
+        rmob_version_query_service.get_snapshot(compat_version)
+    except upstream_guard.UpstreamUnavailable:
+        raise  # 上游斷路：交給 503 + Retry-After handler，而不是回 404
+    except rmob_version_query_service.VersionNotFound as e:
+        return None, (jsonify({"error": f"Compatibility version {compat_version} is not available: {e}"}), 404)
+    except Exception as e:
+        # 上游 5xx、逾時等載入失敗不代表版本不存在
+        return None, (jsonify({"error": f"Failed to load compatibility version {compat_version}: {e}"}), 502)
+    return compat_version, None
+
+
+def parse_int_args(*names):
+    """
+    Optional integer query arguments. Returns ({name: int or None}, None) or (None, 400 response) for a malformed
+    value, instead of letting type=int drop it silently.
+    """
+    values = {}
+    for name in names:
+        value = request.args.get(name, type=str)
+        try:
+            values[name] = int(value) if value else None
+        except ValueError:
+            return None, (jsonify({"error": f"Invalid {name}: {value}"}), 400)
+    return values, None
+
+
+def timed_query(stage, worker, *args, **kwargs):
+    # 在請求層級計時 (僅 cache miss)，查詢 worker 本身不做任何量測
+    with metrics.stage(stage):
+        return worker(*args, **kwargs)
+
+
 @app.route("/get_rmob_dvn", methods=["GET"])
 def get_rmob_dvn():
     hmc_dvn = request.args.get("hmc_dvn", type=str)
@@ -24,8 +201,15 @@ def get_rmob_dvn():
     if hmc_dvn is None:
         return jsonify({"error": "Missing required parameter: hmc_dvn"}), 400
 
-    fetch_pbf_and_cache()  # 確保快取已更新
-    return jsonify(get_rmob_dvn_query_worker(hmc_dvn, region))
+    version_tracker.ensure_snapshot()  # 只讀取目前快照，過舊時才同步更新
+    compat_version, error = load_compat_version(request.args.get("compat_version", type=str))
+    if error:
+        return error
+    hmc_version = resolve_hmc_version(hmc_dvn)  # latest 先轉成版本號再當 cache key
+    key = ("get_rmob_dvn", hmc_version, region.upper() if region else None, compat_version)
+    return cached_json_response(key, snapshot_version(),
+                                lambda: timed_query("query_rmob_dvn", get_rmob_dvn_query_worker, hmc_version, region,
+                                                    compat_version=compat_version))
 
 
 @app.route("/get_hmc_dvn", methods=["GET"])
@@ -36,8 +220,97 @@ def get_hmc_dvn():
     if not rmob_dvn:
         return jsonify({"error": "Missing required parameter: rmob_dvn"}), 400
 
-    fetch_pbf_and_cache()
-    return jsonify(get_hmc_dvn_query_worker(rmob_dvn, region))
+    version_tracker.ensure_snapshot()
+    compat_version, error = load_compat_version(request.args.get("compat_version", type=str))
+    if error:
+        return error
+    key = ("get_hmc_dvn", rmob_dvn, region.upper() if region is not None else None, compat_version)
+    return cached_json_response(key, snapshot_version(),
+                                lambda: timed_query("query_hmc_dvn", get_hmc_dvn_query_worker, rmob_dvn, region,
+                                                    compat_version=compat_version))
+
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    payload = request.get_json(silent=True)
+    queries = payload.get("queries") if isinstance(payload, dict) else payload
+    if not isinstance(queries, list):
+        return jsonify({"error": "Request body must be a JSON list of queries or {\"queries\": [...]}"}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"Too many queries: {len(queries)} > {BATCH_MAX_QUERIES}"}), 400
+
+    version_tracker.ensure_snapshot()
+    compat_version, error = load_compat_version(payload.get("compat_version") if isinstance(payload, dict) else None)
+    if error:
+        return error
+    with metrics.stage("query_batch"):
+        return jsonify(batch_query_worker(queries, compat_version))
+
+
+@app.route("/matrix", methods=["GET"])
+def matrix():
+    """
+    Stream the merged RMOB DVN <-> catalog version ranges of the snapshot as NDJSON (default) or CSV, optionally
+    filtered by region, catalog_type, hrn and a min_version / max_version range.
+    """
+    output_format = request.args.get("format", default="ndjson").lower()
+    if output_format not in ("ndjson", "csv"):
+        return jsonify({"error": f"Invalid format: {output_format} (ndjson or csv)"}), 400
+    filters = {"region": request.args.get("region", type=str),
+               "catalog_type": request.args.get("catalog_type", type=str),
+               "hrn": request.args.get("hrn", type=str)}
+    bounds, error = parse_int_args("min_version", "max_version")
+    if error:
+        return error
+    filters.update(bounds)
+
+    version_tracker.ensure_snapshot()
+    compat_version, error = load_compat_version(request.args.get("compat_version", type=str))
+    if error:
+        return error
+    snapshot = rmob_version_query_service.get_snapshot(compat_version)
+    if snapshot is None:
+        return jsonify({"error": "Data is not available yet. Try again later."}), 503
+
+    etag = make_etag(snapshot.version, ("matrix", output_format, tuple(sorted(filters.items()))))
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        # 以產生器逐段輸出，整份結果不會同時存在記憶體
+        matrix_data = matrix_for(snapshot)
+        rows = matrix_data.select(**filters)
+        if output_format == "csv":
+            response = Response(matrix_data.csv(rows), mimetype="text/csv")
+        else:
+            response = Response(matrix_data.ndjson(rows), mimetype="application/x-ndjson")
+    response.set_etag(etag)
+    response.headers["X-Compat-Version"] = str(snapshot.version)
+    return response
+
+
+@app.route("/changes", methods=["GET"])
+def changes():
+    """
+    Entries added, removed or changed in the compatibility partition since the given version, as a list of diffs
+    to apply in order.
+    """
+    since = request.args.get("since", type=str)
+    if not since:
+        return jsonify({"error": "Missing required parameter: since"}), 400
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({"error": f"Invalid since: {since}"}), 400
+
+    version_tracker.ensure_snapshot()
+    try:
+        return cached_json_response(("changes", since), snapshot_version(), lambda: changes_since(since))
+    except upstream_guard.UpstreamUnavailable:
+        raise  # 與 load_compat_version 相同：斷路時回 503 + Retry-After
+    except rmob_version_query_service.VersionNotFound as e:
+        return jsonify({"error": f"Changes since compatibility version {since} are not available: {e}"}), 404
+    except Exception as e:
+        return jsonify({"error": f"Failed to load compatibility version {since}: {e}"}), 502
 
 
 @app.route("/get_opensearch_dependencies", methods=["GET"])
@@ -45,29 +318,90 @@ def get_opensearch_dependencies():
     opensearch_version = request.args.get("opensearch_version", type=str)
     target_hrn = request.args.get("target_hrn", type=str)
 
-    fetch_pbf_and_cache()  # 確保快取已更新
+    version_tracker.ensure_snapshot()
 
     if not opensearch_version:
-        opensearch_version = get_latest_catalog_version(api_request_handler.get_oauth_token())
+        opensearch_version = version_tracker.get_latest_version(OPENSEARCH_CATALOG_HRN)
     else:
         try:
             opensearch_version = int(opensearch_version)
         except ValueError:
             if opensearch_version == "latest":
-                opensearch_version = get_latest_catalog_version(api_request_handler.get_oauth_token())
+                opensearch_version = version_tracker.get_latest_version(OPENSEARCH_CATALOG_HRN)
     if not target_hrn:
         return jsonify({"error": "Missing required parameter: target_hrn"}), 400
 
-    return jsonify(get_opensearch_hmc_dvn_worker(opensearch_version, target_hrn))
+    # OpenSearch 與相容性 catalog 各自發佈版本：
+    # key 帶上目前已知的 OpenSearch 最新版本，null 結果不快取
+    key = ("get_opensearch_dependencies", opensearch_version, target_hrn,
+           rmob_version_query_service.latest_catalog_versions.get(OPENSEARCH_CATALOG_HRN))
+    return cached_json_response(key, snapshot_version(),
+                                lambda: get_opensearch_hmc_dvn_worker(opensearch_version, target_hrn),
+                                cache_empty=False)
+
+
+@app.route("/get_opensearch_versions", methods=["GET"])
+def get_opensearch_versions():
+    target_hrn = request.args.get("target_hrn", type=str)
+    if not target_hrn:
+        return jsonify({"error": "Missing required parameter: target_hrn"}), 400
+    bounds, error = parse_int_args("min_version", "max_version")
+    if error:
+        return error
+    min_version, max_version = bounds["min_version"], bounds["max_version"]
+
+    return jsonify({"target_hrn": target_hrn, "min_version": min_version, "max_version": max_version,
+                    "opensearch_versions": filter_opensearch_versions_by_hrn(target_hrn, min_version, max_version)})
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({"status": "ok", "message": "Healthy"}), 200
+    refresh_status = version_tracker.status()
+    age = refresh_status["snapshot_age_seconds"]
+    if age is None:
+        return jsonify({"status": "starting", "message": "Snapshot not loaded yet", "refresh": refresh_status}), 200
+    if age > version_tracker.MAX_STALENESS:
+        return jsonify({"status": "stale", "message": "Snapshot exceeds max staleness", "refresh": refresh_status}), 200
+    if upstream_guard.any_open():
+        return jsonify({"status": "degraded", "message": "Upstream circuit open, serving the last good snapshot",
+                        "refresh": refresh_status}), 200
+    return jsonify({"status": "ok", "message": "Healthy", "refresh": refresh_status}), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Prometheus text format. Each gunicorn worker keeps its own registry, so a scrape reflects one worker.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    """
+    Sample the stacks of all request and background threads of this worker for ``seconds`` (max 60) and return
+    collapsed stacks (``frame;frame;... count`` per line) for flamegraph.pl / speedscope.
+    Requires the X-Debug-Token header.
+    """
+    if not is_debug_request():
+        return jsonify({"error": "Forbidden: valid X-Debug-Token header required"}), 403
+    seconds = request.args.get("seconds", default=10, type=float)
+    interval_ms = request.args.get("interval_ms", default=5, type=float)
+    include_idle = request.args.get("include_idle", default="false").lower() == "true"
+
+    counts, rounds = request_profiler.sample_stacks(seconds, interval_ms, include_idle)
+    response = Response(request_profiler.collapsed_text(counts), mimetype="text/plain")
+    response.headers["X-Sampling-Rounds"] = str(rounds)
+    response.headers["X-Worker-Pid"] = str(os.getpid())
+    return response
+
+
+# 背景輪詢 catalog 版本並更新快照 (gunicorn 每個 worker 各自啟動)
+version_tracker.start()
 
 
 if __name__ == "__main__":
     # Ensure credentials are valid before starting API
     api_request_handler.validate_credentials()
-    fetch_pbf_and_cache()  # 啟動時更新快取
+    version_tracker.ensure_snapshot()  # 啟動時更新快取
     app.run(host="0.0.0.0", port=10000, debug=True)
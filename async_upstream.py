@@ -0,0 +1,77 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import api_request_handler
+import opensearch_version_query_service
+import rmob_version_query_service
+import shared_snapshot
+
+# 同時進行的上游呼叫數上限
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "8"))
+
+# HTTP 呼叫仍走 http_client 的連線池 (blocking)，由 asyncio 在 thread pool 上排程並行
+_executor = ThreadPoolExecutor(max_workers=UPSTREAM_CONCURRENCY + 4, thread_name_prefix="upstream")
+
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def gather_limited(func, args_list, limit=UPSTREAM_CONCURRENCY):
+    """
+    Run func(*args) for every args tuple concurrently, at most ``limit`` at a time. Results keep the input order.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(args):
+        async with semaphore:
+            return await run_blocking(func, *args)
+
+    return await asyncio.gather(*(run(args) for args in args_list))
+
+
+def fetch_all(func, args_list, limit=UPSTREAM_CONCURRENCY):
+    """
+    Blocking entry point for gather_limited, for callers that are not running an event loop.
+    """
+    return asyncio.run(gather_limited(func, args_list, limit))
+
+
+async def _refresh_compatibility(token):
+    compat_version = await run_blocking(rmob_version_query_service.get_latest_catalog_version,
+                                        rmob_version_query_service.RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN, token)
+    # 版本確定後馬上開始 layer → data handle → blob，不等其他 catalog
+    await run_blocking(rmob_version_query_service.fetch_pbf_and_cache, compat_version)
+    return compat_version
+
+
+async def _refresh_opensearch(token):
+    opensearch_version = await run_blocking(opensearch_version_query_service.get_latest_catalog_version, token)
+    # shared mode 的 leader 一律維護索引並發佈給 follower；否則只在已有人查詢過時才更新
+    if opensearch_version_query_service.DEPENDENCY_INDEX.indexed_until is not None or shared_snapshot.SHARED_MODE:
+        await run_blocking(opensearch_version_query_service.update_dependency_index, opensearch_version)
+    return opensearch_version
+
+
+async def refresh_all():
+    """
+    One refresh round: the compatibility chain, the rib-2 latest lookup and the OpenSearch lookup (plus its
+    dependency index pages) run concurrently, so the round takes about as long as the slowest of them.
+    A failing catalog does not cancel the others. Returns ({catalog hrn: latest version} of the catalogs that
+    answered, [errors of the ones that failed]).
+    """
+    token = await run_blocking(api_request_handler.get_oauth_token)
+    catalogs = (rmob_version_query_service.RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN,
+                rmob_version_query_service.RIB_2_CATALOG_HRN,
+                opensearch_version_query_service.CATALOG_HRN)
+    results = await asyncio.gather(
+        _refresh_compatibility(token),
+        run_blocking(rmob_version_query_service.get_latest_catalog_version,
+                     rmob_version_query_service.RIB_2_CATALOG_HRN, token),
+        _refresh_opensearch(token),
+        return_exceptions=True,
+    )
+    versions = {hrn: result for hrn, result in zip(catalogs, results) if not isinstance(result, BaseException)}
+    errors = [result for result in results if isinstance(result, BaseException)]
+    return versions, errors
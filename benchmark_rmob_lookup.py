@@ -0,0 +1,80 @@
+import random
+import time
+
+from benchmark_snapshot_build import PBF_FILE, build_dict_tree, build_store
+from compatibility_index import RmobDvnIndex
+
+
+def load_json_data(pbf_file=PBF_FILE):
+    with open(pbf_file, "rb") as f:
+        return build_dict_tree(f.read())
+
+
+def full_scan_lookup(json_data, hmc_version, region=None, target_hrn=None):
+    """
+    Reference implementation: the per-request scan get_rmob_dvn_query_worker used before the interval index.
+    """
+    results = []
+    for entry in json_data.get("compatibility", []):
+        entry_region = entry["region"]
+        entry_dvn = entry["dvn"]
+        if region and entry_region.upper() != region.upper():
+            continue
+        for catalog in entry.get("catalogs", []):
+            if catalog["catalog_type"] == "HERE_MAP_CONTENT":
+                min_v = catalog.get("min_version", 0)
+                max_v = catalog.get("max_version", float("inf"))
+                if target_hrn and catalog.get("hrn") != target_hrn:
+                    continue
+                if min_v <= hmc_version <= max_v:
+                    results.append({"region": entry_region, "rmob_dvn": entry_dvn})
+    return results
+
+
+def index_lookup(store, index, hmc_version, region=None, target_hrn=None):
+    rows = [store.row(row) for row in index.lookup(hmc_version, region, target_hrn)]
+    return [{"region": row.region, "rmob_dvn": row.dvn} for row in rows]
+
+
+def make_queries(json_data, count, seed=0):
+    rng = random.Random(seed)
+    versions = [c.get("max_version", 0) for e in json_data["compatibility"] for c in e["catalogs"]
+                if c["catalog_type"] == "HERE_MAP_CONTENT"]
+    regions = sorted({e["region"] for e in json_data["compatibility"]})
+    top = max(versions) + 10
+    queries = []
+    for _ in range(count):
+        region = rng.choice(regions + [None, None, None])
+        queries.append((rng.randint(0, top), region.lower() if region and rng.random() < 0.3 else region))
+    return queries
+
+
+def timed(func, queries):
+    start = time.perf_counter()
+    for hmc_version, region in queries:
+        func(hmc_version, region)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    json_data = load_json_data()
+    with open(PBF_FILE, "rb") as f:
+        store = build_store(f.read())
+
+    start = time.perf_counter()
+    index = RmobDvnIndex(store)
+    build_seconds = time.perf_counter() - start
+
+    queries = make_queries(json_data, 2000)
+    for hmc_version, region in queries:
+        assert full_scan_lookup(json_data, hmc_version, region) == index_lookup(store, index, hmc_version, region), \
+            (hmc_version, region)
+
+    scan_seconds = timed(lambda v, r: full_scan_lookup(json_data, v, r), queries)
+    index_seconds = timed(lambda v, r: index_lookup(store, index, v, r), queries)
+
+    print(f"entries:        {len(json_data['compatibility'])}")
+    print(f"index build:    {build_seconds * 1000:.1f} ms")
+    print(f"full scan:      {scan_seconds / len(queries) * 1e6:.1f} us/query")
+    print(f"interval index: {index_seconds / len(queries) * 1e6:.1f} us/query")
+    print(f"speedup:        {scan_seconds / index_seconds:.0f}x")
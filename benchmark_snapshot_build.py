@@ -0,0 +1,101 @@
+import gc
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+PBF_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "response.pbf")
+CHUNK_SIZE = 64 * 1024  # 與 rmob_version_query_service.DOWNLOAD_CHUNK_SIZE 相同
+
+
+def current_rss_kb():
+    """
+    Resident set size from /proc/self/status, so Linux only; None elsewhere (RSS is then not reported).
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def chunks(data, size=CHUNK_SIZE):
+    # 逐段產生，同時只有一個 chunk 存在，與 HTTP 串流下載相同
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def parse_partition(data):
+    import product_compatibility_partition_pb2 as partition_pb2
+
+    partition_data = partition_pb2.VersionsPartition()
+    partition_data.ParseFromString(data)
+    return partition_data
+
+
+def message_to_dict(partition_data):
+    from google.protobuf.json_format import MessageToDict
+
+    return MessageToDict(partition_data, preserving_proto_field_name=True)
+
+
+def build_dict_tree(data):
+    """
+    Previous representation: full VersionsPartition message turned into a dict/list tree.
+    """
+    return message_to_dict(parse_partition(data))
+
+
+def build_store(data):
+    from compatibility_store import CompatibilityStore
+
+    return CompatibilityStore.from_bytes(data)
+
+
+def build_store_streamed(data):
+    """
+    Streaming decode as done for the HTTP body: the same bytes in 64 KiB chunks, one record at a time.
+    """
+    from compatibility_store import CompatibilityStore
+
+    store, _ = CompatibilityStore.from_stream(chunks(data))
+    return store
+
+
+BUILDERS = {"dict": build_dict_tree, "store": build_store, "stream": build_store_streamed}
+
+
+def measure(mode):
+    with open(PBF_FILE, "rb") as f:
+        data = f.read()
+    builder = BUILDERS[mode]
+    builder(data)  # warm up imports and descriptor pools
+    gc.collect()
+
+    rss_before = current_rss_kb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = builder(data)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = current_rss_kb()
+    rss = f"+{rss_after - rss_before} KiB" if rss_before is not None else "n/a"
+    print(f"{mode:5} build {elapsed * 1000:7.1f} ms  retained {retained / 1024:8.0f} KiB  "
+          f"peak {peak / 1024:8.0f} KiB  RSS {rss}")
+    return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        measure(sys.argv[1])
+    else:
+        print(f"PBF size: {os.path.getsize(PBF_FILE) / 1024:.0f} KiB")
+        # 每種模式在獨立 process 中量測，避免 RSS 互相影響
+        for mode in BUILDERS:
+            subprocess.run([sys.executable, os.path.abspath(__file__), mode], check=True)
@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import rmob_version_query_service
+from benchmark_snapshot_build import PBF_FILE, build_store, build_store_streamed, message_to_dict, parse_partition
+from compatibility_index import CompatibilitySnapshot
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(BASE_DIR, "benchmark_baseline.json")
+
+
+def load_pbf(pbf_file=PBF_FILE):
+    # 與 decode_pbf.py 相同的讀取方式
+    with open(pbf_file, "rb") as f:
+        return f.read()
+
+
+def make_workload(store, count, seed=0):
+    """
+    Query mix drawn from the partition itself: HMC versions around real catalog bounds (plus some misses),
+    regions with the casing clients send, existing DVNs and a share of unknown ones.
+    """
+    rng = random.Random(seed)
+    rows = list(store.rows())
+    hmc_bounds = [(min_v, max_v or min_v) for _, _, catalog_type, _, min_v, max_v in rows
+                  if catalog_type == "HERE_MAP_CONTENT"]
+    top = max(max_v for _, max_v in hmc_bounds)
+    regions = sorted({region for region, *_ in rows})
+    dvns = sorted({dvn for _, dvn, *_ in rows})
+    hrns = sorted({hrn for _, _, catalog_type, hrn, *_ in rows if catalog_type == "HERE_MAP_CONTENT"})
+
+    hmc_queries, hrn_queries, dvn_queries = [], [], []
+    for _ in range(count):
+        min_v, max_v = rng.choice(hmc_bounds)
+        version = rng.randint(min_v, max_v) if rng.random() < 0.9 else rng.randint(0, top + 100)
+        region = rng.choice(regions) if rng.random() < 0.6 else None
+        if region and rng.random() < 0.3:
+            region = region.lower()
+        hmc_queries.append((version, region))
+        hrn_queries.append((version, region, rng.choice(hrns)))
+        dvn = rng.choice(dvns) if rng.random() < 0.9 else f"X{rng.randint(0, 99999)}"
+        dvn_queries.append((dvn, rng.choice(regions) if rng.random() < 0.5 else None))
+    return hmc_queries, hrn_queries, dvn_queries
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_case(func, inputs, repeat=1):
+    """
+    Time func over every input (latency per call), then measure peak traced memory in a separate pass.
+    """
+    latencies = []
+    for _ in range(repeat):
+        for args in inputs:
+            start = time.perf_counter_ns()
+            func(*args)
+            latencies.append(time.perf_counter_ns() - start)
+    latencies.sort()
+    total_seconds = sum(latencies) / 1e9
+
+    tracemalloc.start()
+    for args in inputs[:50]:
+        func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "calls": len(latencies),
+        "ops_per_sec": round(len(latencies) / total_seconds, 1) if total_seconds else None,
+        "p50_us": round(percentile(latencies, 0.50) / 1000, 2),
+        "p99_us": round(percentile(latencies, 0.99) / 1000, 2),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def run_suite(queries=2000):
+    data = load_pbf()
+    store = build_store(data)
+    snapshot = CompatibilitySnapshot.build(0, store)
+    rmob_version_query_service.current_snapshot = snapshot
+    hmc_queries, hrn_queries, dvn_queries = make_workload(store, queries)
+    batch = [{"hmc_dvn": version, "rmob_region": region} for version, region in hmc_queries[:500]] + \
+            [{"rmob_dvn": dvn, "rmob_region": region} for dvn, region in dvn_queries[:500]]
+    message = parse_partition(data)
+
+    # 解碼與建構沿用 benchmark_snapshot_build 的同一組函式
+    results = {
+        "decode_parse": run_case(parse_partition, [(data,)] * 20),
+        "decode_message_to_dict": run_case(message_to_dict, [(message,)] * 5),
+        "store_build": run_case(build_store, [(data,)] * 10),
+        "store_stream_build": run_case(build_store_streamed, [(data,)] * 10),
+        "snapshot_index_build": run_case(lambda s: CompatibilitySnapshot.build(0, s), [(store,)] * 5),
+        "query_rmob_dvn": run_case(rmob_version_query_service.get_rmob_dvn_query_worker, hmc_queries),
+        "query_rmob_dvn_target_hrn": run_case(rmob_version_query_service.get_rmob_dvn_query_worker,
+                                              [(v, r, h) for v, r, h in hrn_queries]),
+        "query_hmc_dvn": run_case(rmob_version_query_service.get_hmc_dvn_query_worker, dvn_queries),
+        "query_batch_1000": run_case(rmob_version_query_service.batch_query_worker, [(batch,)] * 10),
+    }
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "pbf_bytes": len(data),
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Return a list of regressions: cases whose p50 grew by more than ``tolerance`` relative to the baseline.
+    """
+    regressions = []
+    for name, current in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or not previous.get("p50_us"):
+            continue
+        ratio = current["p50_us"] / previous["p50_us"]
+        current["p50_vs_baseline"] = round(ratio, 2)
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: p50 {previous['p50_us']}us -> {current['p50_us']}us ({ratio:.2f}x)")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline parse/query benchmarks on response.pbf")
+    parser.add_argument("--queries", type=int, default=2000, help="queries per lookup case")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed p50 slowdown (0.5 = +50%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="write this run as the new baseline")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run_suite(args.queries)
+    regressions = []
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+    report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    sys.exit(1 if regressions else 0)
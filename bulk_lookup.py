@@ -0,0 +1,210 @@
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from itertools import islice
+
+import decode_pbf
+import rmob_version_query_service
+from compatibility_index import CompatibilitySnapshot, FrozenDict
+
+QUERY_FIELDS = ("hmc_dvn", "rmob_dvn", "rmob_region", "target_hrn")
+CSV_COLUMNS = ("line",) + tuple(f"query_{field}" for field in QUERY_FIELDS) + (
+    "region", "rmob_dvn", "catalog_version", "catalog_hrn", "catalog_type", "hrn", "min_version", "max_version",
+    "message", "error")
+DEFAULT_CHUNK_SIZE = 10000
+
+# worker process 的輸出格式 (由 initializer 設定)
+_output_format = "ndjson"
+# 預先建立的 DVN 結果 (FrozenDict) 只序列化一次；快照持有這些物件，id 不會被重用
+_result_json = {}
+
+
+def install_partition(path, output_format, latest_hmc_version=None):
+    """
+    Load the partition and publish it as the current snapshot of this process, so the API query workers answer
+    from it. Also the process pool initializer; forked workers that inherited the snapshot skip the load.
+    """
+    global _output_format
+    _output_format = output_format
+    if latest_hmc_version is not None:
+        rmob_version_query_service.latest_catalog_versions[rmob_version_query_service.RIB_2_CATALOG_HRN] = \
+            latest_hmc_version
+    if rmob_version_query_service.current_snapshot is None:
+        store, version = decode_pbf.load_store(path)
+        rmob_version_query_service.current_snapshot = CompatibilitySnapshot.build(version, store)
+    return rmob_version_query_service.current_snapshot
+
+
+def read_queries(input_file, input_format):
+    """
+    Yield query dicts (the /batch query fields) from a CSV, NDJSON or Parquet file; "-" reads stdin.
+    """
+    if input_format == "parquet":
+        try:
+            import pyarrow.parquet as parquet
+        except ImportError:
+            raise Exception("Parquet input needs pyarrow (pip install pyarrow)")
+        for batch in parquet.ParquetFile(input_file).iter_batches(batch_size=DEFAULT_CHUNK_SIZE):
+            yield from batch.to_pylist()
+        return
+
+    f = sys.stdin if input_file == "-" else open(input_file, newline="")
+    try:
+        if input_format == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def normalize_query(row, line, latest_known):
+    query = {field: str(row[field]) for field in QUERY_FIELDS if row.get(field) not in (None, "")}
+    if query.get("hmc_dvn") == "latest" and not latest_known:
+        # 離線時無法向上游查詢 rib-2 最新版本
+        raise Exception(f"Line {line}: hmc_dvn=latest needs --latest-hmc-version when running offline")
+    return query
+
+
+def read_chunks(input_file, input_format, chunk_size, latest_known):
+    """
+    Yield (first line number, [query, ...]) chunks. Line numbers count data rows from 1.
+    """
+    rows = enumerate(read_queries(input_file, input_format), 1)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk[0][0], [normalize_query(row, line, latest_known) for line, row in chunk]
+
+
+def csv_rows(line, query, result):
+    """
+    Flatten one result into CSV rows: one per matching RMOB entry (HMC lookups) or per catalog (DVN lookups).
+    """
+    base = {"line": line}
+    base.update({f"query_{field}": query.get(field) for field in QUERY_FIELDS})
+    if "error" in result or "message" in result:
+        yield dict(base, catalog_version=result.get("catalog_version"), message=result.get("message"),
+                   error=result.get("error"))
+    elif "catalog_hrn" in result:
+        for match in result["matches"]:
+            yield dict(base, region=match["region"], rmob_dvn=match["rmob_dvn"],
+                       catalog_version=result["catalog_version"], catalog_hrn=result["catalog_hrn"])
+    else:
+        for match in result["matches"]:
+            for catalog in match["catalogs"]:
+                yield dict(base, region=match["region"], rmob_dvn=result["rmob_dvn"], **catalog)
+
+
+def lookup_chunk(chunk):
+    """
+    Answer one chunk with batch_query_worker (the code behind /batch, /get_rmob_dvn and /get_hmc_dvn) and return
+    (queries, errors, serialized output). Output is serialized here so results never cross process boundaries as
+    objects.
+    """
+    first_line, queries = chunk
+    results = rmob_version_query_service.batch_query_worker(queries)["results"]
+    errors = sum(1 for result in results if "error" in result)
+    if _output_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, CSV_COLUMNS)
+        for line, (query, result) in enumerate(zip(queries, results), first_line):
+            writer.writerows(csv_rows(line, query, result))
+        return len(queries), errors, buffer.getvalue()
+    # 與 Flask jsonify 相同的 key 排序，結果與 API 回應逐字相同
+    lines = [f'{{"line":{line},"query":{to_json(query)},"result":{result_json(result)}}}\n'
+             for line, (query, result) in enumerate(zip(queries, results), first_line)]
+    return len(queries), errors, "".join(lines)
+
+
+def to_json(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def result_json(result):
+    if not isinstance(result, FrozenDict):
+        return to_json(result)
+    text = _result_json.get(id(result))
+    if text is None:
+        text = _result_json[id(result)] = to_json(result)
+    return text
+
+
+def run(args):
+    snapshot = install_partition(args.partition, args.output_format, args.latest_hmc_version)
+    chunks = read_chunks(args.input, args.input_format, args.chunk_size, args.latest_hmc_version is not None)
+    # 只有一個 chunk 以上的輸入才值得啟動 process pool
+    head = list(islice(chunks, 2))
+    use_pool = args.workers > 1 and len(head) > 1
+    chunks_iter = _chain(head, chunks)
+
+    out = sys.stdout if args.output in (None, "-") else open(args.output, "w", newline="")
+    started = time.perf_counter()
+    total = errors = 0
+    try:
+        if args.output_format == "csv":
+            out.write(",".join(CSV_COLUMNS) + "\r\n")
+        if use_pool:
+            # fork 時 worker 直接繼承已建好的快照
+            with multiprocessing.Pool(args.workers, initializer=install_partition,
+                                      initargs=(args.partition, args.output_format, args.latest_hmc_version)) as pool:
+                for count, chunk_errors, text in pool.imap(lookup_chunk, chunks_iter):
+                    out.write(text)
+                    total += count
+                    errors += chunk_errors
+        else:
+            for count, chunk_errors, text in map(lookup_chunk, chunks_iter):
+                out.write(text)
+                total += count
+                errors += chunk_errors
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started
+    print(f"✅ {total} lookups against compatibility version {snapshot.version} in {elapsed:.2f}s "
+          f"({total / elapsed if elapsed else 0:.0f}/s, {errors} errors, "
+          f"{args.workers if use_pool else 1} process(es))", file=sys.stderr)
+
+
+def _chain(head, rest):
+    yield from head
+    yield from rest
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    return {".parquet": "parquet", ".pq": "parquet", ".ndjson": "ndjson", ".jsonl": "ndjson"}.get(extension, "csv")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Resolve HMC version / RMOB DVN lookups from a CSV, NDJSON or Parquet file against a local "
+                    "partition, with the same results as the API")
+    parser.add_argument("input", help="input file with hmc_dvn / rmob_dvn [/ rmob_region / target_hrn] columns, "
+                                      "- for stdin")
+    parser.add_argument("-o", "--output", help="output file (default stdout)")
+    parser.add_argument("--partition", help=".pbf or .snap file (default: newest file in SNAPSHOT_CACHE_DIR)")
+    parser.add_argument("--input-format", choices=("csv", "ndjson", "parquet"),
+                        help="default: from the input file extension, csv for stdin")
+    parser.add_argument("--output-format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="lookup processes")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="queries per chunk")
+    parser.add_argument("--latest-hmc-version", type=int, help="rib-2 version that hmc_dvn=latest resolves to")
+    args = parser.parse_args()
+    if args.input_format is None:
+        args.input_format = detect_format(args.input)
+
+    try:
+        run(args)
+    except Exception as e:
+        print(f"錯誤: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,238 @@
+import threading
+import time
+import weakref
+from bisect import bisect_right
+from collections import namedtuple
+
+HERE_MAP_CONTENT = "HERE_MAP_CONTENT"
+
+
+class FrozenDict(dict):
+    """
+    dict that refuses mutation, so prebuilt results can be shared between requests and still go through jsonify.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("FrozenDict is read-only")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+
+class RecordPool:
+    """
+    Interns the prebuilt read-only results of HmcDvnIndex across snapshots: a catalog range, region match or DVN
+    result that is identical in several versions is stored once. Entries are held weakly and disappear with the
+    last snapshot that uses them.
+    """
+
+    def __init__(self):
+        self.records = weakref.WeakValueDictionary()
+        self.lock = threading.Lock()
+        self.shared = 0
+
+    def intern(self, key, build):
+        with self.lock:
+            record = self.records.get(key)
+            if record is None:
+                record = build()
+                self.records[key] = record
+            else:
+                self.shared += 1
+            return record
+
+
+class _LocalPool:
+    """
+    Pool used when snapshots do not share records: builds every record.
+    """
+
+    @staticmethod
+    def intern(key, build):
+        return build()
+
+
+class IntervalIndex:
+    """
+    Static stabbing index over closed [min, max] intervals.
+
+    The bounds are cut into elementary segments; every segment stores the payloads of the intervals covering it
+    (in insertion order), so a point lookup is one bisect plus the number of matches.
+    """
+
+    __slots__ = ("bounds", "segments")
+
+    def __init__(self, intervals):
+        points = set()
+        for min_v, max_v, _ in intervals:
+            points.add(min_v)
+            points.add(max_v + 1)
+        self.bounds = sorted(points)
+        segments = [[] for _ in self.bounds]
+        for min_v, max_v, payload in intervals:
+            start = bisect_right(self.bounds, min_v) - 1
+            end = bisect_right(self.bounds, max_v + 1) - 1
+            for i in range(start, end):
+                segments[i].append(payload)
+        self.segments = [tuple(s) for s in segments]
+
+    def stab(self, version):
+        i = bisect_right(self.bounds, version) - 1
+        if i < 0:
+            return ()
+        return self.segments[i]
+
+    def stab_sorted(self, versions):
+        """
+        Stab an ascending sequence of versions in one merge-style sweep over the bounds.
+        """
+        bounds, segments = self.bounds, self.segments
+        i = -1
+        last = len(bounds) - 1
+        for version in versions:
+            while i < last and bounds[i + 1] <= version:
+                i += 1
+            yield segments[i] if i >= 0 else ()
+
+
+class RmobDvnIndex:
+    """
+    HMC version -> RMOB DVN lookup, keyed by (catalog_type, hrn, region).
+
+    ``None`` in the hrn or region position of the key is a wildcard, so every filter combination the query worker
+    accepts is a single dictionary hit followed by a stabbing query. Segments hold CompatibilityStore row ids.
+
+    With lazy=True (historical snapshots) only the filter combinations that are actually queried are built, on
+    first use; a concurrent duplicate build is harmless because both produce the same index.
+    """
+
+    def __init__(self, store, lazy=False):
+        self.store = store
+        self.lazy = lazy
+        self.intervals = {} if lazy else \
+            {key: IntervalIndex(intervals) for key, intervals in self._group(store).items()}
+
+    @staticmethod
+    def _group(store, wanted=None):
+        grouped = {}
+        for row, (region, _, catalog_type, hrn, min_v, max_v) in enumerate(store.rows()):
+            max_v = max_v or float("inf")
+            region_key = region.upper()
+            for key in ((catalog_type, hrn, region_key), (catalog_type, hrn, None),
+                        (catalog_type, None, region_key), (catalog_type, None, None)):
+                if wanted is None or key == wanted:
+                    grouped.setdefault(key, []).append((min_v, max_v, row))
+        return grouped
+
+    def _index(self, key):
+        index = self.intervals.get(key)
+        if index is None and self.lazy:
+            index = self.intervals[key] = IntervalIndex(self._group(self.store, key).get(key, []))
+        return index
+
+    def lookup(self, hmc_version, region=None, target_hrn=None, catalog_type=HERE_MAP_CONTENT):
+        """
+        Return the store row ids whose catalog range contains hmc_version, in partition order.
+        """
+        key = (catalog_type, target_hrn or None, region.upper() if region else None)
+        index = self._index(key)
+        if index is None:
+            return ()
+        return index.stab(hmc_version)
+
+    def lookup_many(self, hmc_versions, region=None, target_hrn=None, catalog_type=HERE_MAP_CONTENT):
+        """
+        Batch form of lookup for one filter combination: sorts the versions once and sweeps them against the
+        bounds. Results are returned in the order of hmc_versions.
+        """
+        key = (catalog_type, target_hrn or None, region.upper() if region else None)
+        index = self._index(key)
+        if index is None:
+            return [()] * len(hmc_versions)
+        order = sorted(range(len(hmc_versions)), key=hmc_versions.__getitem__)
+        results = [()] * len(hmc_versions)
+        for position, matches in zip(order, index.stab_sorted(hmc_versions[i] for i in order)):
+            results[position] = matches
+        return results
+
+
+class HmcDvnIndex:
+    """
+    RMOB DVN -> catalog ranges lookup, keyed by dvn and by (dvn, region).
+
+    Results are built once per partition in the exact shape get_hmc_dvn_query_worker returns and are read-only.
+    With a RecordPool, results that are unchanged from another snapshot using the same pool are reused. With
+    ``previous`` (the index of the partition this one replaces) only the DVNs in ``changed_dvns`` are rebuilt and
+    the results of all other DVNs are taken over as they are.
+    """
+
+    def __init__(self, store, pool=None, previous=None, changed_dvns=None):
+        pool = pool if pool is not None else _LocalPool
+        grouped = {}
+        for region, dvn, catalog_type, hrn, min_v, max_v in store.rows():
+            if previous is not None and dvn not in changed_dvns:
+                continue
+            # proto3 不輸出 0，維持與 MessageToDict 相同的 None
+            catalog_data = pool.intern(
+                ("catalog", catalog_type, hrn, min_v, max_v),
+                lambda: FrozenDict(catalog_type=catalog_type, hrn=hrn, min_version=min_v or None,
+                                   max_version=max_v or None))
+            grouped.setdefault(dvn, {}).setdefault(region, []).append(catalog_data)
+
+        if previous is None:
+            self.by_dvn = {}
+            self.by_dvn_region = {}
+        else:
+            self.by_dvn = {dvn: result for dvn, result in previous.by_dvn.items() if dvn not in changed_dvns}
+            self.by_dvn_region = {key: result for key, result in previous.by_dvn_region.items()
+                                  if key[0] not in changed_dvns}
+        for dvn, region_catalog_map in grouped.items():
+            matches = []
+            for region, catalogs in region_catalog_map.items():
+                # 已共用的物件以 id 組 key；pool 持有它們，id 不會被重用
+                catalog_ids = tuple(id(catalog) for catalog in catalogs)
+                match = pool.intern(("match", region, catalog_ids),
+                                    lambda: FrozenDict(region=region, catalogs=tuple(catalogs)))
+                matches.append(match)
+                self.by_dvn_region[(dvn, region.upper())] = pool.intern(
+                    ("dvn_region", dvn, id(match)), lambda: FrozenDict(rmob_dvn=dvn, matches=(match,)))
+            match_ids = tuple(id(match) for match in matches)
+            self.by_dvn[dvn] = pool.intern(("dvn", dvn, match_ids),
+                                           lambda: FrozenDict(rmob_dvn=dvn, matches=tuple(matches)))
+
+    def lookup(self, dvn, region=None):
+        """
+        Return the prebuilt result for dvn (optionally limited to one region), or None when nothing matches.
+        """
+        if region is None:
+            return self.by_dvn.get(dvn)
+        return self.by_dvn_region.get((dvn, region.upper()))
+
+
+class CompatibilitySnapshot(namedtuple("CompatibilitySnapshot",
+                                       ["version", "data_handle", "store", "rmob_dvn_index", "hmc_dvn_index",
+                                        "created_at"])):
+    """
+    Immutable bundle of one compatibility catalog version: the columnar partition and the indexes built from it.
+
+    A snapshot is fully built before it is published, so readers that grab one reference always see a version and
+    data that belong together.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def build(cls, version, store, created_at=None, data_handle=None, record_pool=None, lazy=False, previous=None,
+              changed_dvns=None):
+        """
+        ``previous`` / ``changed_dvns`` (see snapshot_diff) build the DVN index incrementally from the snapshot
+        being replaced. The HMC interval index is always rebuilt: its segments hold row ids, which shift with any
+        inserted or removed entry.
+        """
+        incremental = previous is not None and changed_dvns is not None
+        return cls(version=version,
+                   data_handle=data_handle,
+                   store=store,
+                   rmob_dvn_index=RmobDvnIndex(store, lazy),
+                   hmc_dvn_index=HmcDvnIndex(store, record_pool,
+                                             previous.hmc_dvn_index if incremental else None, changed_dvns),
+                   created_at=created_at if created_at is not None else time.time())
@@ -0,0 +1,141 @@
+import json
+import threading
+from collections import OrderedDict
+
+import metrics
+from compatibility_store import CATALOG_TYPE_NAMES, REGION_NAMES
+from single_flight import SingleFlight
+
+CSV_HEADER = "region,rmob_dvn,catalog_type,hrn,min_version,max_version\r\n"
+CHUNK_ROWS = 1000  # 每次 yield 的列數
+MAX_VERSIONS = 2  # 保留的 matrix 數：最新版本加一個歷史版本
+
+
+class CompatibilityMatrix:
+    """
+    The full RMOB DVN <-> catalog version mapping of one snapshot: one row per (region, rmob_dvn, catalog_type, hrn)
+    and version range, sorted by region, catalog type, HRN and range.
+
+    Ranges of the same key that overlap or touch (max + 1 == next min) are merged into one, so duplicated or split
+    catalogs come out as a single compatible range. An open upper bound (0 in the partition) is None.
+    """
+
+    __slots__ = ("version", "rows", "_quoted")
+
+    def __init__(self, version, store):
+        self.version = version
+        strings = store.strings.strings
+        ranges = {}
+        for entry, catalog_type, hrn, min_v, max_v in zip(store.catalog_entry, store.catalog_type,
+                                                          store.catalog_hrn, store.catalog_min, store.catalog_max):
+            key = (REGION_NAMES[store.entry_region[entry]], CATALOG_TYPE_NAMES[catalog_type], strings[hrn],
+                   strings[store.entry_dvn[entry]])
+            ranges.setdefault(key, []).append((min_v, max_v or float("inf")))
+
+        rows = []
+        for (region, catalog_type, hrn, dvn), intervals in ranges.items():
+            intervals.sort()
+            current_min, current_max = intervals[0]
+            for min_v, max_v in intervals[1:]:
+                if min_v <= current_max + 1:
+                    current_max = max(current_max, max_v)
+                else:
+                    rows.append((region, catalog_type, hrn, current_min, dvn, current_max))
+                    current_min, current_max = min_v, max_v
+            rows.append((region, catalog_type, hrn, current_min, dvn, current_max))
+        rows.sort()
+        # (region, rmob_dvn, catalog_type, hrn, min_version, max_version)，上界 inf 轉回 None
+        self.rows = [(region, dvn, catalog_type, hrn, min_v, None if max_v == float("inf") else max_v)
+                     for region, catalog_type, hrn, min_v, dvn, max_v in rows]
+        self._quoted = {}
+
+    def select(self, region=None, catalog_type=None, hrn=None, min_version=None, max_version=None):
+        """
+        Yield the rows matching the filters. A version range keeps the rows whose range overlaps
+        [min_version, max_version] (either side may be None); ranges are reported unclipped.
+        """
+        region = region.upper() if region else None
+        catalog_type = catalog_type.upper() if catalog_type else None
+        for row in self.rows:
+            row_region, _, row_type, row_hrn, row_min, row_max = row
+            if region is not None and row_region != region:
+                continue
+            if catalog_type is not None and row_type != catalog_type:
+                continue
+            if hrn is not None and row_hrn != hrn:
+                continue
+            if max_version is not None and row_min > max_version:
+                continue
+            if min_version is not None and row_max is not None and row_max < min_version:
+                continue
+            yield row
+
+    def _quote(self, value):
+        quoted = self._quoted.get(value)
+        if quoted is None:
+            quoted = self._quoted[value] = json.dumps(value)
+        return quoted
+
+    def ndjson(self, rows):
+        """
+        Render rows as NDJSON, CHUNK_ROWS lines per yielded string.
+        """
+        quote = self._quote
+        lines = []
+        for region, dvn, catalog_type, hrn, min_v, max_v in rows:
+            lines.append(f'{{"region":{quote(region)},"rmob_dvn":{quote(dvn)},"catalog_type":{quote(catalog_type)},'
+                         f'"hrn":{quote(hrn)},"min_version":{min_v or "null"},'
+                         f'"max_version":{"null" if max_v is None else max_v}}}\n')
+            if len(lines) == CHUNK_ROWS:
+                yield "".join(lines)
+                lines = []
+        if lines:
+            yield "".join(lines)
+
+    def csv(self, rows):
+        """
+        Render rows as CSV with a header line; empty bounds are left blank. HRNs and DVNs never contain commas or
+        quotes, so no quoting is needed.
+        """
+        yield CSV_HEADER
+        lines = []
+        for region, dvn, catalog_type, hrn, min_v, max_v in rows:
+            lines.append(f"{region},{dvn},{catalog_type},{hrn},{min_v or ''},{'' if max_v is None else max_v}\r\n")
+            if len(lines) == CHUNK_ROWS:
+                yield "".join(lines)
+                lines = []
+        if lines:
+            yield "".join(lines)
+
+
+_matrices = OrderedDict()  # version -> CompatibilityMatrix
+_lock = threading.Lock()  # 只保護 LRU，建表不在鎖內
+_builds = SingleFlight("matrix_build")  # 同一版本同時只建一次，不同版本可並行
+
+
+def matrix_for(snapshot):
+    """
+    The CompatibilityMatrix of snapshot, built once per version and kept for the MAX_VERSIONS most recently used.
+    """
+    with _lock:
+        matrix = _matrices.get(snapshot.version)
+        if matrix is not None:
+            _matrices.move_to_end(snapshot.version)
+    metrics.cache_result("matrix", matrix is not None)
+    if matrix is None:
+        matrix = _builds.do(snapshot.version, lambda: _build(snapshot))
+    return matrix
+
+
+def _build(snapshot):
+    with _lock:
+        matrix = _matrices.get(snapshot.version)
+    if matrix is not None:
+        return matrix  # 另一個請求剛建好
+    with metrics.stage("matrix_build"):
+        matrix = CompatibilityMatrix(snapshot.version, snapshot.store)
+    with _lock:
+        _matrices[snapshot.version] = matrix
+        while len(_matrices) > MAX_VERSIONS:
+            _matrices.popitem(last=False)
+    return matrix
@@ -0,0 +1,166 @@
+from array import array
+
+import product_compatibility_attributes_pb2 as attributes_pb2
+import product_compatibility_partition_pb2 as partition_pb2
+from partition_stream import PartitionStreamDecoder
+
+REGION_NAMES = {value.number: value.name for value in attributes_pb2.VersionCompatibility.Region.DESCRIPTOR.values}
+CATALOG_TYPE_NAMES = {value.number: value.name for value in attributes_pb2.CatalogType.DESCRIPTOR.values}
+
+
+class StringTable:
+    """
+    Interns repeated strings (HRNs, DVNs) so every distinct value is stored once and referenced by id.
+    """
+
+    __slots__ = ("strings", "ids")
+
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def intern(self, value):
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[value] = string_id
+            self.strings.append(value)
+        return string_id
+
+
+class CatalogRow:
+    """
+    Read-only view of one compatible catalog of one partition entry.
+    """
+
+    __slots__ = ("store", "row")
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    @property
+    def entry(self):
+        return self.store.catalog_entry[self.row]
+
+    @property
+    def region(self):
+        return REGION_NAMES[self.store.entry_region[self.entry]]
+
+    @property
+    def dvn(self):
+        return self.store.strings.strings[self.store.entry_dvn[self.entry]]
+
+    @property
+    def catalog_type(self):
+        return CATALOG_TYPE_NAMES[self.store.catalog_type[self.row]]
+
+    @property
+    def hrn(self):
+        return self.store.strings.strings[self.store.catalog_hrn[self.row]]
+
+    @property
+    def min_version(self):
+        return self.store.catalog_min[self.row]
+
+    @property
+    def max_version(self):
+        return self.store.catalog_max[self.row]
+
+
+class CompatibilityStore:
+    """
+    Columnar copy of a VersionsPartition.
+
+    Entries and catalogs live in parallel ``array`` columns: regions and catalog types as their enum numbers, DVNs
+    and HRNs as ids into a shared StringTable, bounds as uint32. Zero bounds are kept as 0 exactly like proto3
+    reports them; the query workers decide what a missing bound means.
+    """
+
+    __slots__ = ("strings", "entry_region", "entry_dvn", "catalog_entry", "catalog_type", "catalog_hrn",
+                 "catalog_min", "catalog_max")
+
+    def __init__(self, strings=None):
+        self.strings = strings if strings is not None else StringTable()
+        self.entry_region = array("B")
+        self.entry_dvn = array("I")
+        self.catalog_entry = array("I")
+        self.catalog_type = array("B")
+        self.catalog_hrn = array("I")
+        self.catalog_min = array("I")
+        self.catalog_max = array("I")
+
+    def add_entry(self, entry):
+        """
+        Append one VersionCompatibility message and its catalogs.
+        """
+        intern = self.strings.intern
+        entry_id = len(self.entry_region)
+        self.entry_region.append(entry.region)
+        self.entry_dvn.append(intern(entry.dvn))
+        for catalog in entry.catalogs:
+            self.catalog_entry.append(entry_id)
+            self.catalog_type.append(catalog.catalog_type)
+            self.catalog_hrn.append(intern(catalog.hrn))
+            self.catalog_min.append(catalog.min_version)
+            self.catalog_max.append(catalog.max_version)
+
+    @classmethod
+    def from_message(cls, partition_data, strings=None):
+        store = cls(strings)
+        for entry in partition_data.compatibility:
+            store.add_entry(entry)
+        return store
+
+    @classmethod
+    def from_bytes(cls, data, strings=None):
+        partition_data = partition_pb2.VersionsPartition()
+        partition_data.ParseFromString(data)
+        return cls.from_message(partition_data, strings)
+
+    @classmethod
+    def from_stream(cls, chunks, strings=None):
+        """
+        Build the store from a serialized VersionsPartition arriving in chunks, one VersionCompatibility record at
+        a time, without holding the whole blob or message tree. Returns (store, decoder) so callers can report
+        the decoder's byte / record counts and decode time.
+        """
+        store = cls(strings)
+        parse_entry = attributes_pb2.VersionCompatibility.FromString
+        decoder = PartitionStreamDecoder(lambda record: store.add_entry(parse_entry(record)))
+        for chunk in chunks:
+            decoder.feed(chunk)
+        decoder.close()
+        return store, decoder
+
+    def columns(self):
+        """
+        Name -> array of every column, used to persist the store without going through protobuf again.
+        """
+        return {name: getattr(self, name) for name in self.__slots__ if name != "strings"}
+
+    @classmethod
+    def from_columns(cls, strings, columns):
+        store = cls()
+        for value in strings:
+            store.strings.intern(value)
+        for name, column in columns.items():
+            setattr(store, name, column)
+        return store
+
+    def __len__(self):
+        return len(self.catalog_entry)
+
+    def row(self, row):
+        return CatalogRow(self, row)
+
+    def rows(self):
+        """
+        Yield (region, dvn, catalog_type, hrn, min_version, max_version) for every catalog, in partition order.
+        """
+        strings = self.strings.strings
+        entry_region, entry_dvn = self.entry_region, self.entry_dvn
+        for row, entry in enumerate(self.catalog_entry):
+            yield (REGION_NAMES[entry_region[entry]], strings[entry_dvn[entry]],
+                   CATALOG_TYPE_NAMES[self.catalog_type[row]], strings[self.catalog_hrn[row]],
+                   self.catalog_min[row], self.catalog_max[row])
@@ -1,6 +1,15 @@
+import argparse
 import json
+import os
+
 from google.protobuf.json_format import MessageToDict
 import product_compatibility_partition_pb2 as partition_pb2
+import snapshot_disk_cache
+from compatibility_store import CompatibilityStore
+
+PBF_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "response.pbf")
+READ_CHUNK_SIZE = 64 * 1024
+
 
 def parse_pbf_to_json(pbf_file):
     # 創建 Protocol Buffer 的對象
@@ -14,11 +23,34 @@ def parse_pbf_to_json(pbf_file):
 
     return json.dumps(json_data, indent=2)
 
+
+def load_store(path=None):
+    """
+    Load a partition into a CompatibilityStore: a raw VersionsPartition blob (.pbf, decoded in chunks) or a file of
+    the snapshot cache (.snap, memory-mapped). Without a path, the newest file of the snapshot cache is used.
+    Returns (store, compatibility version or None when the file does not record it).
+    """
+    if path is None:
+        cached = snapshot_disk_cache.load_newest(zero_copy=True)
+        if cached is None:
+            raise Exception(f"No snapshot in {snapshot_disk_cache.CACHE_DIR}; pass a .pbf or .snap file")
+        header, store = cached
+        return store, header["version"]
+    if path.endswith(snapshot_disk_cache.FILE_SUFFIX):
+        header, store = snapshot_disk_cache.read_file(path, zero_copy=True)
+        return store, header["version"]
+    with open(path, "rb") as f:
+        store, _ = CompatibilityStore.from_stream(iter(lambda: f.read(READ_CHUNK_SIZE), b""))
+    return store, None
+
+
 # 測試解析 .pbf
 if __name__ == "__main__":
-    pbf_file = "C:/Users/guanlwu/PycharmProjects/here_data_api_client_test/response.pbf"
+    parser = argparse.ArgumentParser(description="Dump a VersionsPartition .pbf file as JSON")
+    parser.add_argument("pbf_file", nargs="?", default=PBF_FILE)
+    args = parser.parse_args()
     try:
-        json_result = parse_pbf_to_json(pbf_file)
+        json_result = parse_pbf_to_json(args.pbf_file)
         print(json_result)
     except Exception as e:
         print(f"錯誤: {e}")
@@ -0,0 +1,106 @@
+import heapq
+import threading
+from bisect import bisect_left, bisect_right
+
+
+def _row_key(row):
+    return row[0], row[1]
+
+
+class DependencyIndex:
+    """
+    Reverse dependency index: (dependency hrn, dependency version) -> versions of the catalog that depend on it.
+
+    Every dependency hrn maps to a list of (dependency_version, catalog_version, timestamp) sorted by dependency
+    version, so a version range is two bisects. New catalog versions are merged in incrementally; each update
+    publishes fresh lists with a reference swap, so readers never lock.
+    """
+
+    def __init__(self):
+        self.by_hrn = {}
+        self.indexed_until = None  # 已索引的最大 catalog 版本
+        self.update_lock = threading.Lock()
+
+    def add_versions(self, entries, indexed_until):
+        """
+        Merge metadata entries (the ``versions`` items of the metadata API) for catalog versions up to
+        indexed_until. Only called with versions newer than the ones already indexed. The new rows are sorted on
+        their own and merged into each HRN's list in linear time; dependencies without a version are skipped.
+        """
+        additions = {}
+        for entry in entries:
+            catalog_version = entry.get("version")
+            timestamp = entry.get("timestamp")
+            for dependency in entry.get("dependencies", []):
+                dependency_version = dependency.get("version")
+                if dependency_version is None or catalog_version is None:
+                    continue  # 沒有版本的依賴無法排序或查詢
+                additions.setdefault(dependency.get("hrn"), []).append(
+                    (dependency_version, catalog_version, timestamp))
+
+        by_hrn = dict(self.by_hrn)
+        for hrn, rows in additions.items():
+            # 只排序新的一頁，再與已排序的舊列表線性合併
+            rows.sort(key=_row_key)
+            by_hrn[hrn] = list(heapq.merge(by_hrn.get(hrn, ()), rows, key=_row_key))
+        self.by_hrn = by_hrn
+        self.indexed_until = indexed_until
+
+    def install(self, by_hrn, indexed_until):
+        """
+        Replace the whole index, e.g. with the one the shared mode leader published.
+        """
+        with self.update_lock:
+            self.by_hrn = by_hrn
+            self.indexed_until = indexed_until
+
+    def query(self, hrn, min_version=None, max_version=None):
+        """
+        Return ([(catalog_version, timestamp), ...] sorted by catalog version, exact).
+
+        When no dependency version falls inside [min_version, max_version], the catalog version whose dependency
+        version is closest to min_version is returned instead (earliest catalog version on ties) and exact is False.
+        """
+        rows = self.by_hrn.get(hrn, [])
+        keys = _DependencyVersions(rows)
+        start = 0 if min_version is None else bisect_left(keys, min_version)
+        end = len(rows) if max_version is None else bisect_right(keys, max_version)
+
+        matches = {}
+        for _, catalog_version, timestamp in rows[start:end]:
+            matches.setdefault(catalog_version, timestamp)
+        if matches:
+            return sorted(matches.items()), True
+        if min_version is None or not rows:
+            return [], True
+
+        # 找依賴版本最接近 min_version 的 catalog 版本
+        candidates = []
+        if start < len(rows):
+            candidates.append(rows[start][0])
+        if start > 0:
+            candidates.append(rows[start - 1][0])
+        best_diff = min(abs(version - min_version) for version in candidates)
+        closest = []
+        for dependency_version in {version for version in candidates if abs(version - min_version) == best_diff}:
+            first = bisect_left(keys, dependency_version)
+            last = bisect_right(keys, dependency_version)
+            closest.extend((row[1], row[2]) for row in rows[first:last])
+        return [min(closest)], False
+
+
+class _DependencyVersions:
+    """
+    Sequence view over the dependency-version column of the sorted rows, for bisect.
+    """
+
+    __slots__ = ("rows",)
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        return self.rows[i][0]
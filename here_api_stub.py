@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PBF_FILE = os.path.join(BASE_DIR, "response.pbf")
+
+RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN = "hrn:here:data::olp-here:rib-product-compatibility-1"
+RIB_2_CATALOG_HRN = "hrn:here:data::olp-here:rib-2"
+RIB_EXTERNAL_REFERENCE_2_CATALOG_HRN = "hrn:here:data::olp-here:rib-external-references-2"
+OPENSEARCH_CATALOG_HRN = "hrn:here:data::olp-here:here-optimized-map-for-opensearch-3"
+
+# 合成 OpenSearch 相依版本的範圍，對齊 response.pbf 裡 rib-2 / rib-external-references-2 的 HMC 版本
+RIB_2_VERSION_RANGE = (31, 6973)
+RIB_EXTERNAL_REFERENCE_2_VERSION_RANGE = (34, 6610)
+OPENSEARCH_EPOCH_MS = 1672531200000  # 2023-01-01T00:00:00Z
+
+
+class StubState:
+    """
+    Runtime configuration and per-endpoint call counters of the stub. Changed live through POST /_config.
+    """
+
+    def __init__(self, pbf_file=PBF_FILE, compat_version=100, opensearch_versions=3000,
+                 latency_ms=0.0, jitter_ms=0.0, failure_rate=0.0, failing_catalogs=(), token_ttl=3600, seed=None):
+        with open(pbf_file, "rb") as f:
+            self.blob = f.read()
+        self.config = {
+            "compat_version": compat_version,
+            "opensearch_versions": opensearch_versions,
+            "latency_ms": latency_ms,
+            "jitter_ms": jitter_ms,
+            "failure_rate": failure_rate,
+            "failing_catalogs": list(failing_catalogs),  # 這些 catalog 的 metadata 呼叫一律回 503
+            "token_ttl": token_ttl,
+        }
+        self.tokens = {}  # 已發出的 token -> 到期時間
+        self.rng = random.Random(seed)
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, hrn=None):
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+            latency = self.config["latency_ms"] + self.rng.uniform(0, self.config["jitter_ms"])
+            failed = self.rng.random() < self.config["failure_rate"] or hrn in self.config["failing_catalogs"]
+        return latency / 1000, failed
+
+    def issue_token(self):
+        with self.lock:
+            token = f"stub-{time.time_ns()}-{len(self.tokens)}"
+            ttl = self.config["token_ttl"]
+            self.tokens[token] = time.time() + ttl
+        return token, ttl
+
+    def token_valid(self, token):
+        with self.lock:
+            expires_at = self.tokens.get(token)
+        return expires_at is not None and time.time() < expires_at
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.counts), "total": sum(self.counts.values()), "config": dict(self.config)}
+
+    def latest_version(self, hrn):
+        if hrn == RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN:
+            return self.config["compat_version"]
+        if hrn == OPENSEARCH_CATALOG_HRN:
+            return self.config["opensearch_versions"]
+        if hrn == RIB_2_CATALOG_HRN:
+            return RIB_2_VERSION_RANGE[1]
+        if hrn == RIB_EXTERNAL_REFERENCE_2_CATALOG_HRN:
+            return RIB_EXTERNAL_REFERENCE_2_VERSION_RANGE[1]
+        return None
+
+    def opensearch_entry(self, version):
+        """
+        Deterministic metadata for one OpenSearch version: dependency versions grow linearly with the version.
+        """
+        fraction = version / max(1, self.config["opensearch_versions"])
+        dependencies = []
+        for hrn, (low, high) in ((RIB_2_CATALOG_HRN, RIB_2_VERSION_RANGE),
+                                 (RIB_EXTERNAL_REFERENCE_2_CATALOG_HRN, RIB_EXTERNAL_REFERENCE_2_VERSION_RANGE)):
+            dependencies.append({"hrn": hrn, "version": low + int((high - low) * fraction), "direct": True})
+        return {
+            "version": version,
+            "timestamp": OPENSEARCH_EPOCH_MS + version * 3600 * 1000,
+            "dependencies": dependencies,
+            "partitionCounts": {},
+        }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "HereApiStub/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def upstream(self, endpoint, hrn=None):
+        """
+        Count the call, apply latency and decide on failure injection. Returns False when a 503 was sent.
+        """
+        delay, failed = self.state.record(endpoint, hrn)
+        if delay:
+            time.sleep(delay)
+        if failed:
+            self.send_json(503, {"title": "Service Unavailable", "status": 503, "injected": True})
+            return False
+        authorization = self.headers.get("Authorization", "")
+        if endpoint != "token" and not (authorization.startswith("Bearer ") and
+                                        self.state.token_valid(authorization[len("Bearer "):])):
+            self.send_json(401, {"title": "Unauthorized", "status": 401})
+            return False
+        return True
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.read_body()
+        if url.path == "/_config":
+            try:
+                updates = json.loads(body or b"{}")
+            except ValueError:
+                return self.send_json(400, {"error": "Invalid JSON"})
+            with self.state.lock:
+                for key, value in updates.items():
+                    if key in self.state.config:
+                        self.state.config[key] = value
+            return self.send_json(200, self.state.stats()["config"])
+        if url.path == "/_revoke":
+            # 讓已發出的 token 全部失效，模擬上游提前撤銷
+            with self.state.lock:
+                revoked = len(self.state.tokens)
+                self.state.tokens.clear()
+            return self.send_json(200, {"revoked": revoked})
+        if url.path == "/_reset":
+            with self.state.lock:
+                self.state.counts.clear()
+            return self.send_json(200, {"status": "reset"})
+        if url.path.endswith("/oauth2/token"):
+            if not self.upstream("token"):
+                return
+            token, ttl = self.state.issue_token()
+            return self.send_json(200, {"access_token": token, "token_type": "bearer", "expires_in": ttl})
+        self.send_json(404, {"error": "Not found"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/_stats":
+            return self.send_json(200, self.state.stats())
+
+        parts = url.path.strip("/").split("/")
+        # /metadata/v1/catalogs/{hrn}/... 或 /blobstore/v1/catalogs/{hrn}/layers/{layer}/data/{handle}
+        if len(parts) < 5 or parts[1:3] != ["v1", "catalogs"]:
+            return self.send_json(404, {"error": "Not found"})
+        service, hrn, rest = parts[0], parts[3], parts[4:]
+
+        if service == "blobstore" and len(rest) == 4 and rest[0] == "layers" and rest[2] == "data":
+            if not self.upstream("blob"):
+                return
+            return self.send_body(200, self.state.blob, "application/octet-stream")
+
+        if service != "metadata":
+            return self.send_json(404, {"error": "Not found"})
+        latest = self.state.latest_version(hrn)
+        if latest is None:
+            return self.send_json(404, {"error": f"Unknown catalog {hrn}"})
+
+        if rest == ["versions", "latest"]:
+            if not self.upstream("versions_latest", hrn):
+                return
+            return self.send_json(200, {"version": latest})
+        if rest == ["versions", "minimum"]:
+            if not self.upstream("versions_minimum", hrn):
+                return
+            return self.send_json(200, {"version": 0})
+        if rest == ["layerVersions"]:
+            if not self.upstream("layer_versions", hrn):
+                return
+            version = int(query.get("version", latest))
+            return self.send_json(200, {"version": version,
+                                        "layerVersions": [{"layer": "versions", "version": version,
+                                                           "timestamp": OPENSEARCH_EPOCH_MS}]})
+        if len(rest) == 3 and rest[0] == "layers" and rest[2] == "partitions":
+            if not self.upstream("partitions", hrn):
+                return
+            version = int(query.get("version", latest))
+            return self.send_json(200, {"partitions": [{"partition": "versions", "layer": rest[1],
+                                                        "version": version,
+                                                        "dataHandle": f"stub-{hrn.rsplit(':', 1)[-1]}-{version}",
+                                                        "dataSize": len(self.state.blob)}]})
+        if rest == ["versions"]:
+            if not self.upstream("versions_range", hrn):
+                return
+            start = int(query.get("startVersion", -1))
+            end = min(int(query.get("endVersion", latest)), latest)
+            entries = [self.state.opensearch_entry(version) for version in range(max(start + 1, 0), end + 1)] \
+                if hrn == OPENSEARCH_CATALOG_HRN else []
+            return self.send_json(200, {"versions": entries})
+        self.send_json(404, {"error": "Not found"})
+
+
+def make_server(host="127.0.0.1", port=0, **state_options):
+    """
+    Create (but do not start) the stub server; port 0 picks a free port (see server.server_address).
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(**state_options)
+    return server
+
+
+def app_environment(base_url):
+    """
+    Environment variables that point the app's upstream calls at a stub listening on base_url.
+    """
+    return {
+        "HERE_TOKEN_URL": f"{base_url}/oauth2/token",
+        "HERE_CLIENT_ID": "stub-client",
+        "HERE_CLIENT_SECRET": "stub-secret",
+        "RIB_METADATA_URL": f"{base_url}/metadata/v1/catalogs",
+        "RIB_BLOBSTORE_URL": f"{base_url}/blobstore/v1/catalogs",
+        "OPENSEARCH_METADATA_URL": f"{base_url}/metadata/v1/catalogs",
+        "OPENSEARCH_BLOBSTORE_URL": f"{base_url}/blobstore/v1/catalogs",
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the HERE token, metadata and blobstore APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--pbf", default=PBF_FILE, help="partition blob served for every data handle")
+    parser.add_argument("--compat-version", type=int, default=100, help="latest rib-product-compatibility-1 version")
+    parser.add_argument("--opensearch-versions", type=int, default=3000, help="latest synthetic OpenSearch version")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every upstream call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform random extra latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of calls answered with 503")
+    parser.add_argument("--token-ttl", type=float, default=3600, help="expires_in of issued tokens (seconds)")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, pbf_file=args.pbf, compat_version=args.compat_version,
+                         opensearch_versions=args.opensearch_versions, latency_ms=args.latency_ms,
+                         jitter_ms=args.jitter_ms, failure_rate=args.failure_rate, token_ttl=args.token_ttl)
+    base_url = f"http://{args.host}:{server.server_address[1]}"
+    print(f"🚀 HERE API stub listening on {base_url}")
+    for key, value in app_environment(base_url).items():
+        print(f"export {key}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,130 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import upstream_guard
+
+# 連線池、逾時與重試設定 (秒)
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.2"))
+BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "5"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url):
+    """
+    Return the keep-alive session for the URL's host, creating it (with its own connection pool) on first use.
+    """
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount(f"{parts.scheme}://", adapter)
+                _sessions[host] = session
+    return session
+
+
+def endpoint_label(url):
+    """
+    Low-cardinality name of a HERE API call for metrics, e.g. versions_latest, partitions, blob, token.
+    """
+    path = urlsplit(url).path.rstrip("/")
+    if path.endswith("/token"):
+        return "token"
+    if "/data/" in path:
+        return "blob"
+    last = path.rsplit("/", 1)[-1]
+    if last in ("latest", "minimum"):
+        return f"versions_{last}"
+    if last == "versions":
+        return "versions_range"
+    return {"layerVersions": "layer_versions", "partitions": "partitions"}.get(last, "other")
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    Full-jitter exponential backoff, honouring a numeric Retry-After header when the server sends one.
+    """
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def request(method, url, timeout=None, retries=None, **kwargs):
+    """
+    Send a request through the pooled session of the target host.
+
+    Connection errors, timeouts and 429/5xx responses are retried with jittered exponential backoff; the last
+    response (or exception) is returned (or raised) once the retries are used up.
+    Every attempt goes through the host's upstream_guard.HostGuard, which raises UpstreamUnavailable without
+    calling the host when its circuit is open or its concurrency limit stays full. With stream=True the call slot
+    is held until the response headers arrive.
+    """
+    timeout = timeout if timeout is not None else (CONNECT_TIMEOUT, READ_TIMEOUT)
+    retries = MAX_RETRIES if retries is None else retries
+    session = get_session(url)
+    endpoint = endpoint_label(url)
+    guard = upstream_guard.guard_for(url)
+
+    attempt = 0
+    while True:
+        probe = guard.acquire()
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            guard.release(probe, time.perf_counter() - started, False)
+            metrics.observe("upstream_request_duration_seconds", time.perf_counter() - started, endpoint=endpoint)
+            metrics.inc("upstream_requests_total", endpoint=endpoint, status="error")
+            metrics.trace_event("upstream", method=method, url=url, endpoint=endpoint, attempt=attempt,
+                                status=e.__class__.__name__, seconds=time.perf_counter() - started)
+            if attempt >= retries:
+                raise
+            print(f"[WARN] {method} {url} failed ({e.__class__.__name__}), retrying...")
+            time.sleep(backoff_delay(attempt))
+        except BaseException:
+            guard.release(probe, time.perf_counter() - started, False)
+            raise
+        else:
+            guard.release(probe, time.perf_counter() - started, response.status_code not in RETRY_STATUS_CODES)
+            # stream=True 時只含到回應標頭為止的時間，下載本身記在 stage_duration_seconds
+            metrics.observe("upstream_request_duration_seconds", time.perf_counter() - started, endpoint=endpoint)
+            metrics.inc("upstream_requests_total", endpoint=endpoint, status=str(response.status_code))
+            metrics.trace_event("upstream", method=method, url=url, endpoint=endpoint, attempt=attempt,
+                                status=response.status_code, seconds=time.perf_counter() - started)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                return response
+            print(f"[WARN] {method} {url} returned {response.status_code}, retrying...")
+            retry_after = response.headers.get("Retry-After")
+            response.close()
+            time.sleep(backoff_delay(attempt, retry_after))
+        attempt += 1
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
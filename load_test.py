@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+import here_api_stub
+from compatibility_store import CompatibilityStore
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 請求組合 (權重)：與正式流量相近，以單筆查詢為主
+DEFAULT_MIX = "rmob_dvn=50,hmc_dvn=30,opensearch_dependencies=10,batch=5,opensearch_versions=5"
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def load_query_values(pbf_file=here_api_stub.PBF_FILE):
+    """
+    Regions and RMOB DVNs present in the partition the stub serves, so lookups mostly hit.
+    """
+    with open(pbf_file, "rb") as f:
+        store = CompatibilityStore.from_bytes(f.read())
+    rows = list(store.rows())
+    return {"regions": sorted({row[0] for row in rows}), "dvns": sorted({row[1] for row in rows})}
+
+
+def make_request(session, base_url, kind, rng, opensearch_versions, values):
+    """
+    Send one request of the given kind with randomized parameters. Returns the HTTP status.
+    """
+    if kind == "rmob_dvn":
+        params = {"hmc_dvn": rng.randint(31, 6973)}
+        if rng.random() < 0.5:
+            params["rmob_region"] = rng.choice(values["regions"])
+        return session.get(f"{base_url}/get_rmob_dvn", params=params).status_code
+    if kind == "hmc_dvn":
+        params = {"rmob_dvn": rng.choice(values["dvns"])}
+        return session.get(f"{base_url}/get_hmc_dvn", params=params).status_code
+    if kind == "opensearch_dependencies":
+        params = {"opensearch_version": rng.randint(1, opensearch_versions),
+                  "target_hrn": here_api_stub.RIB_2_CATALOG_HRN}
+        return session.get(f"{base_url}/get_opensearch_dependencies", params=params).status_code
+    if kind == "opensearch_versions":
+        low = rng.randint(31, 6900)
+        params = {"target_hrn": here_api_stub.RIB_2_CATALOG_HRN, "min_version": low, "max_version": low + 50}
+        return session.get(f"{base_url}/get_opensearch_versions", params=params).status_code
+    if kind == "batch":
+        queries = [{"hmc_dvn": rng.randint(31, 6973)} for _ in range(50)]
+        return session.post(f"{base_url}/batch", json={"queries": queries}).status_code
+    raise Exception(f"Unknown request kind: {kind}")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+    }
+
+
+def drive(base_url, concurrency, duration, mix, opensearch_versions, values, seed=0):
+    """
+    Run ``concurrency`` client threads against base_url for ``duration`` seconds.
+    Returns {kind: [latency seconds]}, {kind: error count}, elapsed seconds.
+    """
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    latencies = {kind: [] for kind in kinds}
+    errors = {kind: 0 for kind in kinds}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        rng = random.Random(seed + index)
+        session = requests.Session()
+        local_latencies = {kind: [] for kind in kinds}
+        local_errors = {kind: 0 for kind in kinds}
+        while time.monotonic() < deadline:
+            kind = rng.choices(kinds, weights)[0]
+            start = time.perf_counter()
+            try:
+                status = make_request(session, base_url, kind, rng, opensearch_versions, values)
+            except requests.RequestException:
+                status = None
+            local_latencies[kind].append(time.perf_counter() - start)
+            if status is None or status >= 400:
+                local_errors[kind] += 1
+        with lock:
+            for kind in kinds:
+                latencies[kind].extend(local_latencies[kind])
+                errors[kind] += local_errors[kind]
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.monotonic() - started
+
+
+def wait_healthy(base_url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"gunicorn exited with code {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/health", timeout=2).json().get("status") == "ok":
+                return
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.2)
+    raise Exception(f"App did not become healthy within {timeout}s")
+
+
+def start_app(stub_url, port, workers, threads, cache_dir, extra_env=None):
+    env = dict(os.environ)
+    env.update(here_api_stub.app_environment(stub_url))
+    env["SNAPSHOT_CACHE_DIR"] = cache_dir
+    env.update(extra_env or {})
+    command = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+               "--workers", str(workers), "--threads", str(threads), "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=BASE_DIR, env=env)
+
+
+def run(args):
+    values = load_query_values()
+    stub = here_api_stub.make_server(compat_version=args.compat_version,
+                                     opensearch_versions=args.opensearch_versions, latency_ms=args.latency_ms,
+                                     jitter_ms=args.jitter_ms, failure_rate=args.failure_rate, seed=args.seed)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    with tempfile.TemporaryDirectory(prefix="rmob-load-") as cache_dir:
+        extra_env = {"SNAPSHOT_SHARED_MODE": "true" if args.shared_mode else "false"}
+        process = start_app(stub_url, args.port, args.workers, args.threads, cache_dir, extra_env)
+        try:
+            started = time.monotonic()
+            wait_healthy(base_url, process, args.startup_timeout)
+            startup_seconds = time.monotonic() - started
+            startup_calls = stub.state.stats()["calls"]
+
+            if args.warmup:
+                drive(base_url, args.concurrency, args.warmup, parse_mix(args.mix), args.opensearch_versions,
+                      values, args.seed + 1000)
+            before = stub.state.stats()
+            latencies, errors, elapsed = drive(base_url, args.concurrency, args.duration, parse_mix(args.mix),
+                                               args.opensearch_versions, values, args.seed)
+            after = stub.state.stats()
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+            stub.shutdown()
+
+    all_latencies = [value for kind_latencies in latencies.values() for value in kind_latencies]
+    total_requests = len(all_latencies)
+    upstream_calls = {endpoint: count - before["calls"].get(endpoint, 0)
+                      for endpoint, count in after["calls"].items()
+                      if count - before["calls"].get(endpoint, 0)}
+    upstream_total = after["total"] - before["total"]
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "startup_seconds": round(startup_seconds, 2),
+        "startup_upstream_calls": startup_calls,
+        "elapsed_seconds": round(elapsed, 2),
+        "rps": round(total_requests / elapsed, 1) if elapsed else None,
+        "errors": sum(errors.values()),
+        "latency": summarize(all_latencies),
+        "by_kind": {kind: dict(summarize(kind_latencies), errors=errors[kind])
+                    for kind, kind_latencies in latencies.items()},
+        "upstream_calls": upstream_calls,
+        "upstream_calls_per_request": round(upstream_total / total_requests, 4) if total_requests else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the app under gunicorn against the local HERE API stub")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--port", type=int, default=10080, help="port the app listens on")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads")
+    parser.add_argument("--duration", type=float, default=15, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="unmeasured seconds before the run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="request kinds and weights")
+    parser.add_argument("--latency-ms", type=float, default=20, help="stub latency per upstream call")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="stub random extra latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of upstream calls failing with 503")
+    parser.add_argument("--compat-version", type=int, default=100)
+    parser.add_argument("--opensearch-versions", type=int, default=3000)
+    parser.add_argument("--shared-mode", action="store_true", help="run with SNAPSHOT_SHARED_MODE=true")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
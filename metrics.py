@@ -0,0 +1,220 @@
+import threading
+import time
+from bisect import bisect_left
+
+# 直方圖 bucket 上界 (秒)：涵蓋 µs 級查詢到數十秒的下載
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRICS = {
+    # name: (type, help)
+    "http_request_duration_seconds": ("histogram", "Latency of API requests by endpoint"),
+    "http_requests_total": ("counter", "API requests by endpoint and status code"),
+    "upstream_request_duration_seconds": ("histogram", "Latency of single HERE API calls (one attempt) by endpoint"),
+    "upstream_requests_total": ("counter", "HERE API call attempts by endpoint and status (error = no response)"),
+    "stage_duration_seconds": ("histogram", "Latency of internal stages (token, download, parse, index build, query)"),
+    "refresh_duration_seconds": ("histogram", "Duration of snapshot refresh rounds"),
+    "refresh_failures_total": ("counter", "Failed snapshot refresh rounds"),
+    "cache_requests_total": ("counter", "Cache lookups by cache and result (hit / miss)"),
+    "upstream_rejected_total": ("counter", "Upstream calls refused locally (circuit_open / concurrency_limit)"),
+    "stale_snapshot_served_total": ("counter", "Requests served from a snapshot past max staleness without refreshing"),
+    "single_flight_calls_total": ("counter", "Upstream GETs by single-flight role (leader = sent, follower = shared)"),
+    "response_cache_invalidated_total": ("counter", "Cached responses dropped because a new snapshot changed them"),
+}
+
+_histograms = {}  # (name, labels) -> Histogram
+_counters = {}  # (name, labels) -> Counter
+_collectors = []  # (name, type, help, func)；scrape 時才計算的值
+_lock = threading.Lock()
+
+# 單一請求的 debug trace (見 request_profiler)：只有在有請求被追蹤時才查 thread-local
+_trace_local = threading.local()
+_tracing = 0
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. Updates take no lock: a thread switch in the middle of an update can very rarely drop
+    one observation, which is acceptable for monitoring and keeps observe() well under a microsecond.
+    """
+
+    __slots__ = ("key", "counts", "sums")
+
+    def __init__(self, key):
+        self.key = key  # (name, labels)
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sums = [0.0] * (len(BUCKETS) + 1)  # 各 bucket 各自累加，避免共用一個 sum 欄位
+
+    def observe(self, value, _bisect=bisect_left, _buckets=BUCKETS):
+        index = _bisect(_buckets, value)
+        self.counts[index] += 1
+        self.sums[index] += value
+        if _tracing:
+            trace_event(self.key[0], seconds=value, **dict(self.key[1]))
+
+    def snapshot(self):
+        counts = list(self.counts)
+        return counts, sum(self.sums), sum(counts)
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self, key):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount  # 同 Histogram，不加鎖
+
+
+def _series(table, factory, name, labels):
+    key = (name, tuple(sorted(labels.items())))
+    series = table.get(key)
+    if series is None:
+        with _lock:
+            series = table.setdefault(key, factory(key))
+    return series
+
+
+def histogram(name, **labels):
+    """
+    Histogram handle for one label set; resolve it once at import time on hot paths and call observe() on it.
+    """
+    return _series(_histograms, Histogram, name, labels)
+
+
+def observe(name, seconds, **labels):
+    _series(_histograms, Histogram, name, labels).observe(seconds)
+
+
+def inc(name, amount=1, **labels):
+    _series(_counters, Counter, name, labels).inc(amount)
+
+
+def cache_result(cache, hit):
+    inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+    if _tracing:
+        trace_event("cache", cache=cache, result="hit" if hit else "miss")
+
+
+def begin_trace():
+    """
+    Start collecting the observations made by the current thread; returns the event list that fills up.
+    """
+    global _tracing
+    events = []
+    with _lock:
+        _tracing += 1
+    _trace_local.events = events
+    return events
+
+
+def end_trace():
+    global _tracing
+    if getattr(_trace_local, "events", None) is None:
+        return
+    _trace_local.events = None
+    with _lock:
+        _tracing -= 1
+
+
+def trace_event(kind, **details):
+    """
+    Append an event to the current thread's trace, if it has one. Cheap no-op when nothing is traced.
+    """
+    if not _tracing:
+        return
+    events = getattr(_trace_local, "events", None)
+    if events is not None:
+        details["kind"] = kind
+        details["at"] = time.perf_counter()
+        events.append(details)
+
+
+class timed:
+    """
+    Context manager observing the elapsed time of its block into a histogram, also when the block raises.
+    """
+
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def stage(name):
+    return timed("stage_duration_seconds", stage=name)
+
+
+def register_collector(name, metric_type, help_text, func):
+    """
+    Register a metric computed at scrape time. func() returns a number or a list of (labels dict, value).
+    """
+    _collectors.append((name, metric_type, help_text, func))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render():
+    """
+    All metrics in the Prometheus text exposition format (version 0.0.4).
+    """
+    by_name = {}
+    for (name, labels), histogram in list(_histograms.items()):
+        by_name.setdefault(name, []).append((labels, histogram))
+    for (name, labels), counter in list(_counters.items()):
+        by_name.setdefault(name, []).append((labels, counter))
+
+    lines = []
+    for name in sorted(by_name):
+        metric_type, help_text = METRICS.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, series in sorted(by_name[name], key=lambda item: item[0]):
+            if isinstance(series, Histogram):
+                counts, total, count = series.snapshot()
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    bucket_labels = labels + (("le", _format_value(float(bound))),)
+                    lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(series.value)}")
+
+    for name, metric_type, help_text, func in _collectors:
+        try:
+            samples = func()
+        except Exception as e:
+            print(f"[WARN] Metric collector {name} failed: {e}")
+            continue
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            if value is not None:
+                lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -1,22 +1,21 @@
-import threading
+import os
 import time
 
-import requests
-
 import api_request_handler
+import async_upstream
+import metrics
 import rmob_version_query_service
+from dependency_index import DependencyIndex
+from version_metadata_store import VersionMetadataStore
 
 CATALOG_HRN = "hrn:here:data::olp-here:here-optimized-map-for-opensearch-3"
-METADATA_URL = "https://sab.metadata.data.api.platform.here.com/metadata/v1/catalogs"
-BLOBSTORE_URL = "https://sab.blob.data.api.platform.here.com/blobstore/v1/catalogs"
-
-# Cache 變數與 Lock
-CACHE = {
-    "latest_version": None,
-    "metadata": None
-}
-CACHE_LOCK = threading.Lock()  # 用於確保 thread safety
+METADATA_URL = os.getenv("OPENSEARCH_METADATA_URL",
+                         "https://sab.metadata.data.api.platform.here.com/metadata/v1/catalogs")
+BLOBSTORE_URL = os.getenv("OPENSEARCH_BLOBSTORE_URL",
+                          "https://sab.blob.data.api.platform.here.com/blobstore/v1/catalogs")
 
+# 反向相依索引每次向上游抓取的版本數
+DEPENDENCY_INDEX_PAGE_SIZE = int(os.getenv("DEPENDENCY_INDEX_PAGE_SIZE", "500"))
 
 def epoch_converter(epoch):
     return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(epoch))
@@ -24,8 +23,7 @@ def epoch_converter(epoch):
 
 def get_latest_catalog_version(token):
     url = f"{METADATA_URL}/{CATALOG_HRN}/versions/latest?startVersion=0"
-    headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
+    response = api_request_handler.request_with_token_refresh(url)
 
     if response.status_code == 200:
         return response.json()["version"]
@@ -35,8 +33,7 @@ def get_latest_catalog_version(token):
 
 def get_earliest_catalog_version(token):
     url = f"{METADATA_URL}/{CATALOG_HRN}/versions/minimum?"
-    headers = {"Authorization": f"Bearer {token}"}
-    response = requests.get(url, headers=headers)
+    response = api_request_handler.request_with_token_refresh(url)
 
     if response.status_code == 200:
         return response.json()["version"]
@@ -44,85 +41,74 @@ def get_earliest_catalog_version(token):
         raise Exception(f"Failed to fetch catalog version: {response.text}")
 
 
+def fetch_version_range_metadata(start_version, end_version):
+    """
+    Fetch the metadata of versions in (start_version, end_version] from upstream.
+    """
+    url = f"{METADATA_URL}/{CATALOG_HRN}/versions?startVersion={start_version}&endVersion={end_version}&context=super"
+    response = api_request_handler.request_with_token_refresh(url)
+
+    if response.status_code == 200:
+        return response.json().get("versions", [])
+    else:
+        raise Exception(f"Failed to fetch catalog version: {response.text}")
+
+
+# 每個版本的 metadata 各自快取 (LRU)，只抓缺少的範圍
+METADATA_STORE = VersionMetadataStore(fetch_version_range_metadata, name="opensearch_metadata")
+
+
 def get_version_range_metadata(token, earliest_version, latest_version):
     """
-    Fetch metadata only if latest_version has changed. Uses threading.Lock() to ensure thread safety.
+    Return the metadata of versions in (earliest_version, latest_version], served from the per-version store.
+    """
+    with metrics.stage("opensearch_metadata"):
+        return {"versions": METADATA_STORE.get_range(earliest_version, latest_version)}
+
+
+# (dependency hrn, dependency version) -> OpenSearch versions，隨新版本遞增更新
+DEPENDENCY_INDEX = DependencyIndex()
+
+
+def update_dependency_index(latest_version=None):
+    """
+    Bring DEPENDENCY_INDEX up to latest_version, fetching only the OpenSearch versions it has not indexed yet.
+    The first call indexes everything from the earliest available version.
+    """
+    with DEPENDENCY_INDEX.update_lock, metrics.stage("dependency_index_update"):
+        token = api_request_handler.get_oauth_token()
+        if latest_version is None:
+            latest_version = get_latest_catalog_version(token)
+        start_version = DEPENDENCY_INDEX.indexed_until
+        if start_version is None:
+            start_version = get_earliest_catalog_version(token) - 1
+        pages = [(page_start, min(page_start + DEPENDENCY_INDEX_PAGE_SIZE, latest_version))
+                 for page_start in range(start_version, latest_version, DEPENDENCY_INDEX_PAGE_SIZE)]
+        # 各頁並行抓取，依序併入索引
+        for (_, end_version), entries in zip(pages, async_upstream.fetch_all(fetch_version_range_metadata, pages)):
+            DEPENDENCY_INDEX.add_versions(entries, end_version)
+
+
+def filter_opensearch_versions_by_hrn(target_hrn, min_version=None, max_version=None):
+    """
+    Find the OpenSearch versions whose dependency on target_hrn has a version within [min_version, max_version].
+
+    :param target_hrn: Dependency catalog HRN.
+    :param min_version: Minimum version number (inclusive).
+    :param max_version: Maximum version number (inclusive).
+    :return: List of dictionaries with version and timestamp. If nothing is in range, the single version whose
+             dependency is closest to min_version.
     """
-    global CACHE
-
-    with CACHE_LOCK:  # 確保只有一個執行緒能夠存取與更新 Cache
-        if CACHE["latest_version"] == latest_version and CACHE["metadata"] is not None:
-            print("🔹 Using cached metadata")
-            return CACHE["metadata"]
-
-        url = f"{METADATA_URL}/{CATALOG_HRN}/versions?startVersion={earliest_version}&endVersion={latest_version}&context=super"
-        headers = {"Authorization": f"Bearer {token}"}
-        response = requests.get(url, headers=headers)
-
-        if response.status_code == 200:
-            metadata = response.json()
-            CACHE["latest_version"] = latest_version  # 更新最新版本
-            CACHE["metadata"] = metadata  # 更新 Cache
-            print("✅ Cache updated with new metadata")
-            return metadata
-        else:
-            raise Exception(f"Failed to fetch catalog version: {response.text}")
-
-
-# def filter_opensearch_versions_by_hrn(target_hrn, min_version=None, max_version=None):
-#     """
-#     Filter metadata to find entries where the target HRN exists in dependencies
-#     with a valid version within the specified range.
-#
-#     :param metadata_list: List of metadata dictionaries.
-#     :param min_version: Minimum version number (inclusive).
-#     :param max_version: Maximum version number (inclusive).
-#     :return: List of dictionaries with version and timestamp.
-#     """
-#     earliest_version = get_earliest_catalog_version(api_request_handler.get_oauth_token())
-#     latest_version = get_latest_catalog_version(api_request_handler.get_oauth_token())
-#     metadata_list = get_version_range_metadata(api_request_handler.get_oauth_token(), earliest_version, latest_version)[
-#         "versions"]
-#
-#     filtered_versions = []
-#
-#     closest_entry = None
-#     closest_diff = float("inf")  # 設定一個極大值，確保可以找到最接近的版本
-#
-#     for entry in metadata_list:
-#         version_number = entry.get("version")
-#         timestamp = entry.get("timestamp")
-#         dependencies = entry.get("dependencies", [])
-#
-#         for dependency in dependencies:
-#             if dependency.get("hrn") == target_hrn:
-#                 target_version = dependency.get("version")
-#
-#                 # 主要條件: 如果 target_version 落在 min/max_version 區間內，則正常返回
-#                 if (min_version is None or target_version >= min_version) and (
-#                         max_version is None or target_version <= max_version):
-#                     filtered_versions.append({
-#                         "version": version_number,
-#                         "timestamp": epoch_converter(float(timestamp) / 1000)
-#                     })
-#                     break  # No need to check further dependencies
-#
-#                 # 找最接近 min_version 的版本
-#                 if min_version is not None:
-#                     diff = abs(target_version - min_version)
-#                     if diff < closest_diff:
-#                         closest_diff = diff
-#                         closest_entry = {
-#                             "version": version_number,
-#                             "timestamp": epoch_converter(float(timestamp) / 1000)
-#                         }
-#
-#     # 如果沒有找到符合 min/max_version 的版本，則回傳最接近的 min_version 版本
-#     if not filtered_versions and closest_entry:
-#         print(f"⚠️ No exact match found, returning closest version to min_version: {closest_entry}")
-#         return [closest_entry]
-#
-#     return filtered_versions
+    if DEPENDENCY_INDEX.indexed_until is None:
+        update_dependency_index(rmob_version_query_service.latest_catalog_versions.get(CATALOG_HRN))
+
+    with metrics.stage("dependency_index_query"):
+        versions, exact = DEPENDENCY_INDEX.query(target_hrn, min_version, max_version)
+    filtered_versions = [{"version": version, "timestamp": epoch_converter(float(timestamp) / 1000)}
+                         for version, timestamp in versions]
+    if not exact:
+        print(f"⚠️ No exact match found, returning closest version to min_version: {filtered_versions[0]}")
+    return filtered_versions
 
 
 def get_opensearch_hmc_dvn_worker(oepnsearch_version, target_hrn):
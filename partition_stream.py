@@ -0,0 +1,104 @@
+import time
+
+# protobuf wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+COMPATIBILITY_FIELD = 1  # VersionsPartition.compatibility (repeated VersionCompatibility)
+
+
+class PartitionStreamDecoder:
+    """
+    Incremental decoder for the top level of a serialized VersionsPartition.
+
+    Bytes are fed in arbitrary chunks (e.g. straight from the HTTP body); every complete ``compatibility`` record is
+    handed to on_record as the serialized VersionCompatibility bytes, as soon as its last byte arrives. Only the
+    current, incomplete record is buffered, so memory stays at about one record plus one chunk. Unknown top-level
+    fields are skipped without buffering them.
+    """
+
+    def __init__(self, on_record):
+        self.on_record = on_record
+        self.buffer = bytearray()
+        self.skip = 0  # 尚待略過的未知欄位 bytes
+        self.records = 0
+        self.bytes_read = 0
+        self.decode_seconds = 0.0  # feed() 內花費的時間 (不含等待網路)
+
+    def feed(self, chunk):
+        started = time.perf_counter()
+        self.bytes_read += len(chunk)
+        if self.skip:
+            skipped = min(self.skip, len(chunk))
+            self.skip -= skipped
+            chunk = memoryview(chunk)[skipped:]
+        self.buffer += chunk
+
+        buffer = self.buffer
+        position = 0
+        end = len(buffer)
+        while position < end:
+            parsed = _read_varint(buffer, position)
+            if parsed is None:
+                break
+            key, field_start = parsed
+            field_number, wire_type = key >> 3, key & 7
+            if wire_type == LENGTH_DELIMITED:
+                parsed = _read_varint(buffer, field_start)
+                if parsed is None:
+                    break
+                length, value_start = parsed
+                value_end = value_start + length
+                if field_number == COMPATIBILITY_FIELD:
+                    if value_end > end:
+                        break
+                    self.on_record(bytes(buffer[value_start:value_end]))
+                    self.records += 1
+                elif value_end > end:
+                    # 未知欄位不必緩衝，記下剩餘長度後直接丟棄
+                    self.skip = value_end - end
+                    value_end = end
+                position = value_end
+            elif wire_type == VARINT:
+                parsed = _read_varint(buffer, field_start)
+                if parsed is None:
+                    break
+                position = parsed[1]
+            elif wire_type in (FIXED64, FIXED32):
+                value_end = field_start + (8 if wire_type == FIXED64 else 4)
+                if value_end > end:
+                    break
+                position = value_end
+            else:
+                raise ValueError(f"Unsupported wire type {wire_type} for field {field_number}")
+        del buffer[:position]
+        self.decode_seconds += time.perf_counter() - started
+
+    def close(self):
+        """
+        Check that the stream ended on a record boundary.
+        """
+        if self.buffer or self.skip:
+            raise ValueError(f"Truncated partition: {len(self.buffer) + self.skip} bytes missing or left over "
+                             f"after {self.records} records")
+
+
+def _read_varint(buffer, position):
+    """
+    Decode a base-128 varint at position. Returns (value, next position), or None if the buffer ends first.
+    """
+    result = 0
+    shift = 0
+    end = len(buffer)
+    while position < end:
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+        if shift >= 64:
+            raise ValueError("Varint too long")
+    return None
@@ -0,0 +1,148 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+import metrics
+
+# 每個請求 profile 回傳的函式數
+PROFILE_TOP_FUNCTIONS = int(os.getenv("DEBUG_PROFILE_TOP_FUNCTIONS", "30"))
+SAMPLING_MAX_SECONDS = 60
+SAMPLING_MIN_INTERVAL_MS = 1
+
+# 取樣時視為閒置的最內層 frame (檔名, 函式)：等待鎖 / socket / queue / 背景輪詢的 sleep
+IDLE_LEAF_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("socket.py", "accept"),
+    ("socket.py", "readinto"),
+    ("thread.py", "_worker"),
+    ("socketserver.py", "serve_forever"),
+    ("version_tracker.py", "_run"),
+}
+
+# Python 3.12 起同時只能有一個 cProfile 啟用
+_cprofile_lock = threading.Lock()
+
+
+class RequestProfile:
+    """
+    Profile of one request on the current thread: cProfile (when no other request holds it) plus the stage,
+    upstream and cache events recorded through metrics while the request ran.
+    """
+
+    def __init__(self, use_cprofile=True):
+        self.started = time.perf_counter()
+        self.events = metrics.begin_trace()
+        self.profiler = None
+        self.note = None
+        if use_cprofile and _cprofile_lock.acquire(blocking=False):
+            try:
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+            except ValueError as e:
+                self.profiler = None
+                self.note = f"cProfile unavailable: {e}"
+                _cprofile_lock.release()
+        elif use_cprofile:
+            self.note = "cProfile busy with another request; only stage timings recorded"
+
+    def finish(self):
+        """
+        Stop profiling and return the report as a JSON-ready dict.
+        """
+        wall = time.perf_counter() - self.started
+        if self.profiler is not None:
+            self.profiler.disable()
+            _cprofile_lock.release()
+        metrics.end_trace()
+
+        stages, upstream, caches = [], [], []
+        for event in self.events:
+            kind = event["kind"]
+            offset_ms = round((event["at"] - self.started) * 1000, 3)
+            if kind == "stage_duration_seconds":
+                stages.append({"stage": event["stage"], "ms": round(event["seconds"] * 1000, 3),
+                               "ended_at_ms": offset_ms})
+            elif kind == "upstream":
+                upstream.append({"endpoint": event["endpoint"], "method": event["method"], "url": event["url"],
+                                 "attempt": event["attempt"], "status": event["status"],
+                                 "ms": round(event["seconds"] * 1000, 3), "ended_at_ms": offset_ms})
+            elif kind == "cache":
+                caches.append({"cache": event["cache"], "result": event["result"]})
+
+        report = {
+            "wall_ms": round(wall * 1000, 3),
+            "stages": stages,
+            "upstream_calls": upstream,
+            "upstream_ms": round(sum(call["ms"] for call in upstream), 3),
+            "caches": caches,
+        }
+        if self.profiler is not None:
+            report["functions"] = top_functions(self.profiler, PROFILE_TOP_FUNCTIONS)
+        if self.note:
+            report["note"] = self.note
+        return report
+
+
+def top_functions(profiler, limit):
+    """
+    The ``limit`` functions with the highest cumulative time, as dicts.
+    """
+    stats = pstats.Stats(profiler).stats
+    rows = []
+    for (filename, line, name), (primitive_calls, calls, total_time, cumulative_time, _) in stats.items():
+        rows.append({
+            "function": f"{os.path.basename(filename)}:{line}({name})" if line else name,
+            "calls": calls,
+            "primitive_calls": primitive_calls,
+            "tottime_ms": round(total_time * 1000, 3),
+            "cumtime_ms": round(cumulative_time * 1000, 3),
+        })
+    rows.sort(key=lambda row: row["cumtime_ms"], reverse=True)
+    return rows[:limit]
+
+
+def frame_label(frame):
+    # 以函式定義行區分，同一函式的不同執行行合併成一個 flamegraph 節點
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval_ms=5, include_idle=False):
+    """
+    Sample the Python stacks of all other threads every ``interval_ms`` for ``seconds`` and return
+    ({collapsed stack: count}, number of sampling rounds). Collapsed stacks are root-first, ``;``-separated and
+    prefixed with the thread name, the input format of flamegraph.pl / speedscope.
+    """
+    seconds = min(max(seconds, 0), SAMPLING_MAX_SECONDS)
+    interval = max(interval_ms, SAMPLING_MIN_INTERVAL_MS) / 1000
+    own_id = threading.get_ident()
+    counts = {}
+    rounds = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            if not include_idle and \
+                    (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_LEAF_FRAMES:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, f"thread-{thread_id}"))
+            stack = ";".join(reversed(labels))
+            counts[stack] = counts.get(stack, 0) + 1
+        rounds += 1
+        time.sleep(interval)
+    return counts, rounds
+
+
+def collapsed_text(counts):
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items(), key=lambda item: -item[1]))
@@ -0,0 +1,163 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from flask import Response, jsonify, request
+
+import metrics
+
+MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+
+
+class CachedResponse:
+    """
+    Ready-to-send JSON body, its gzip variant and the ETag that identifies it.
+    """
+
+    __slots__ = ("body", "gzip_body", "etag")
+
+    def __init__(self, body, etag):
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=6, mtime=0)
+        self.etag = etag
+
+
+class ResponseCache:
+    """
+    Bounded LRU of serialized responses keyed by (endpoint, normalized params, snapshot version).
+
+    The cache remembers the snapshot version it was filled for. advance() moves it to a new snapshot keeping the
+    entries the change did not affect; a lookup that sees a newer version without that (no diff available) drops
+    everything, and lookups for an older version bypass the cache until their request finishes.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.snapshot_version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, snapshot_version):
+        with self.lock:
+            if snapshot_version != self.snapshot_version:
+                if self.snapshot_version is not None and snapshot_version < self.snapshot_version:
+                    # 請求開始時讀到的是已被取代的快照
+                    self.misses += 1
+                    metrics.cache_result("response", False)
+                    return None
+                self.entries.clear()
+                self.snapshot_version = snapshot_version
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.cache_result("response", cached is not None)
+        return cached
+
+    def put(self, key, snapshot_version, cached):
+        with self.lock:
+            if snapshot_version != self.snapshot_version:
+                return
+            self.entries[key] = cached
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def advance(self, snapshot_version, is_affected):
+        """
+        Switch to snapshot_version, dropping only the entries for which is_affected(key) is true.
+        Returns the number of entries dropped.
+        """
+        with self.lock:
+            affected = [key for key in self.entries if is_affected(key)]
+            for key in affected:
+                del self.entries[key]
+            self.snapshot_version = snapshot_version
+        return len(affected)
+
+    def invalidate(self, keys=None):
+        """
+        Drop the given keys, or everything when keys is None.
+        """
+        with self.lock:
+            if keys is None:
+                self.entries.clear()
+                return
+            for key in keys:
+                self.entries.pop(key, None)
+
+
+RESPONSE_CACHE = ResponseCache()
+
+
+def affected_by(diff):
+    """
+    is_affected(key) for the keys app.py builds, given a snapshot_diff.SnapshotDiff. Keys pinned to a
+    compat_version never change; DVN lookups depend on their DVN, HMC lookups on the changed entries' ranges.
+    OpenSearch dependency lookups resolve their HMC version through metadata, so any change drops them; their keys
+    also carry the latest OpenSearch version, so a new OpenSearch version is never answered from an older entry.
+    """
+    hmc_affected = diff.hmc_version_checker()
+
+    def is_affected(key):
+        endpoint = key[0]
+        if endpoint == "get_hmc_dvn":
+            return key[3] is None and key[1] in diff.changed_dvns
+        if endpoint == "get_rmob_dvn":
+            _, hmc_version, region, compat_version = key
+            return compat_version is None and (not isinstance(hmc_version, int) or hmc_affected(hmc_version, region))
+        if endpoint == "get_opensearch_dependencies":
+            return bool(diff)
+        return True  # 例如 /changes：內容隨每個新版本改變
+
+    return is_affected
+
+
+def on_snapshot_published(previous, snapshot, diff):
+    """
+    rmob_version_query_service snapshot listener: carry the cache over to the new snapshot.
+    """
+    if previous is None or RESPONSE_CACHE.snapshot_version != previous.version:
+        return
+    with metrics.stage("response_cache_advance"):
+        dropped = RESPONSE_CACHE.advance(snapshot.version, affected_by(diff))
+    metrics.inc("response_cache_invalidated_total", dropped)
+
+
+def make_etag(snapshot_version, key):
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+    return f"{snapshot_version}-{digest}"
+
+
+def cached_json_response(key, snapshot_version, build, cache_empty=True):
+    """
+    Serve build()'s JSON result for key from the response cache, honouring If-None-Match and Accept-Encoding.
+    ``snapshot_version`` None (no snapshot yet) bypasses the cache. With cache_empty False, a None or empty result
+    is sent but not cached (e.g. data upstream has not published yet).
+    """
+    if snapshot_version is None:
+        return jsonify(build())
+
+    cached = RESPONSE_CACHE.get(key, snapshot_version)
+    if cached is None:
+        result = build()
+        cached = CachedResponse(jsonify(result).get_data(), make_etag(snapshot_version, key))
+        if result or cache_empty:
+            RESPONSE_CACHE.put(key, snapshot_version, cached)
+
+    if request.if_none_match.contains(cached.etag):
+        response = Response(status=304)
+    elif "gzip" in request.accept_encodings:
+        response = Response(cached.gzip_body, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(cached.body, mimetype="application/json")
+    response.set_etag(cached.etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
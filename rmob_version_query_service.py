@@ -1,20 +1,32 @@
+import os
 import threading
 
-from google.protobuf.json_format import MessageToDict
-
 import api_request_handler
-import product_compatibility_partition_pb2
-
-# Global cache
-cached_json_data = None
-cached_version = None
-lock = threading.Lock()  # Prevent race conditions when updating cache
+import metrics
+import snapshot_diff
+import snapshot_disk_cache
+from compatibility_index import CompatibilitySnapshot
+from compatibility_store import CompatibilityStore
+from snapshot_history import SnapshotHistory
+
+# Global cache: the published snapshot is replaced with a single reference swap, readers never lock
+current_snapshot = None
+latest_catalog_versions = {}  # catalog hrn -> latest version, kept current by version_tracker
+build_lock = threading.Lock()  # Only one snapshot builder at a time
 
 RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN = "hrn:here:data::olp-here:rib-product-compatibility-1"
 RIB_2_CATALOG_HRN = "hrn:here:data::olp-here:rib-2"
 RIB_EXTERNAL_REFERENCE_2_CATALOG_HRN = "hrn:here:data::olp-here:rib-external-references-2"
-BASE_URL = "https://mabcd.metadata.data.api.platform.here.com/metadata/v1/catalogs"
-BLOBSTORE_URL = "https://mabcd.blob.data.api.platform.here.com/blobstore/v1/catalogs"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+BASE_URL = os.getenv("RIB_METADATA_URL", "https://mabcd.metadata.data.api.platform.here.com/metadata/v1/catalogs")
+BLOBSTORE_URL = os.getenv("RIB_BLOBSTORE_URL", "https://mabcd.blob.data.api.platform.here.com/blobstore/v1/catalogs")
+
+
+class VersionNotFound(Exception):
+    """
+    Raised for a compatibility version that does not exist (negative, newer than the latest, or without a versions
+    partition upstream), as opposed to one that failed to load.
+    """
 
 
 def get_latest_catalog_version(catalog_hrn, token):
@@ -27,23 +39,9 @@ def get_latest_catalog_version(catalog_hrn, token):
         raise Exception(f"Failed to fetch catalog version: {response.text}")
 
 
-# 3. Get latest layer version
-def get_layer_versions(token, catalog_version):
-    url = f"{BASE_URL}/{RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN}/layerVersions?version={catalog_version}"
-    response = api_request_handler.request_with_token_refresh(url)
-
-    if response.status_code == 200:
-        layers = response.json()["layerVersions"]
-        for layer in layers:
-            if layer["layer"] == "versions":
-                return layer["version"]
-    else:
-        raise Exception(f"Failed to fetch layer version: {response.text}")
-
-
-# 4. Get partition data handle
-def get_data_handle(token, layer_version):
-    url = f"{BASE_URL}/{RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN}/layers/versions/partitions?version={layer_version}"
+# 3. Get partition data handle (version: catalog version)
+def get_data_handle(token, catalog_version):
+    url = f"{BASE_URL}/{RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN}/layers/versions/partitions?version={catalog_version}"
     response = api_request_handler.request_with_token_refresh(url)
 
     if response.status_code == 200:
@@ -51,104 +49,299 @@ def get_data_handle(token, layer_version):
         for partition in partitions:
             if partition["layer"] == "versions":
                 return partition["dataHandle"]
+    elif response.status_code == 404:
+        raise VersionNotFound(f"No compatibility catalog version {catalog_version}: {response.text}")
     else:
         raise Exception(f"Failed to fetch DataHandle: {response.text}")
 
 
-# 6. Fetch and parse PBF in memory
-def fetch_pbf_and_cache():
-    global cached_json_data, cached_version
-    token = api_request_handler.get_oauth_token()
-    latest_version = get_latest_catalog_version(RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN, token)
-
-    with lock:
-        if cached_version == latest_version:
-            return
-
-        layer_version = get_layer_versions(token, latest_version)
-        data_handle = get_data_handle(token, layer_version)
-
-        # 下載 PBF
-        url = f"{BLOBSTORE_URL}/{RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN}/layers/versions/data/{data_handle}"
-        response = api_request_handler.request_with_token_refresh(url)
+# 4. Stream the partition blob straight into the columnar store
+def download_partition(token, data_handle):
+    """
+    Download the partition and decode it while it arrives: each VersionCompatibility record is appended to the
+    store as soon as it is complete, so neither the whole blob nor a full message tree is ever held in memory.
+    """
+    url = f"{BLOBSTORE_URL}/{RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN}/layers/versions/data/{data_handle}"
+    with metrics.stage("blob_download"):
+        response = api_request_handler.request_with_token_refresh(url, stream=True)
 
         if response.status_code == 200:
-            partition_data = product_compatibility_partition_pb2.VersionsPartition()
-            partition_data.ParseFromString(response.content)
-
-            cached_json_data = MessageToDict(partition_data, preserving_proto_field_name=True)
-            cached_version = latest_version
+            with response:
+                store, decoder = CompatibilityStore.from_stream(response.iter_content(DOWNLOAD_CHUNK_SIZE))
+            metrics.observe("stage_duration_seconds", decoder.decode_seconds, stage="decode")
+            return store
         else:
             raise Exception(f"Failed to download and parse PBF: {response.text}")
 
 
-def get_rmob_dvn_query_worker(hmc_version, region=None, target_hrn=None):
-    if cached_json_data is None:
+def load_store(token, version):
+    """
+    Resolve the data handle for version and return (store, data handle), from the disk cache when the
+    (version, data handle) pair is already there, otherwise from the streamed download.
+    """
+    # partitions 查詢的 version 即 catalog 版本，不需要先經過 layerVersions 轉換
+    data_handle = get_data_handle(token, version)
+    if data_handle is None:
+        raise VersionNotFound(f"No versions partition in compatibility catalog version {version}")
+
+    # 本機快取已有相同 version / data handle 時不必重新下載
+    with metrics.stage("disk_cache_load"):
+        store = snapshot_disk_cache.load(version, data_handle)
+    metrics.cache_result("snapshot_disk", store is not None)
+    if store is not None:
+        return store, data_handle
+
+    # 邊下載邊解碼成欄位式資料
+    store = download_partition(token, data_handle)
+    try:
+        with metrics.stage("disk_cache_save"):
+            snapshot_disk_cache.save(version, data_handle, store)
+    except OSError as e:
+        print(f"[WARN] Failed to write snapshot cache: {e}")
+    return store, data_handle
+
+
+def build_snapshot(token, version, record_pool=None):
+    """
+    Build the snapshot of one compatibility version (see load_store).
+    ``record_pool`` lets several snapshots share unchanged results; such (historical) snapshots build their HMC
+    interval indexes lazily, per queried filter combination.
+    """
+    store, data_handle = load_store(token, version)
+    with metrics.stage("index_build"):
+        return CompatibilitySnapshot.build(version, store, data_handle=data_handle, record_pool=record_pool,
+                                           lazy=record_pool is not None)
+
+
+def next_snapshot(version, store, data_handle=None, created_at=None):
+    """
+    Build the snapshot that replaces the current one. The two partitions are diffed first, so only the DVN
+    results of changed entries are rebuilt. Returns (snapshot, diff); diff is None when nothing is published yet.
+    Call with build_lock held.
+    """
+    previous = current_snapshot
+    diff = None
+    if previous is not None:
+        with metrics.stage("snapshot_diff"):
+            diff = snapshot_diff.diff_stores(previous.store, store, previous.version, version)
+    with metrics.stage("index_build"):
+        snapshot = CompatibilitySnapshot.build(version, store, created_at=created_at, data_handle=data_handle,
+                                               previous=previous,
+                                               changed_dvns=diff.changed_dvns if diff is not None else None)
+    return snapshot, diff
+
+
+def add_snapshot_listener(listener):
+    """
+    Register listener(previous snapshot, new snapshot, diff), called before readers see a new snapshot that
+    replaces an older one (e.g. to invalidate the affected cached responses).
+    """
+    snapshot_listeners.append(listener)
+
+
+def publish_snapshot(snapshot, diff=None):
+    """
+    Make snapshot the current one (build_lock held). The diff goes to CHANGE_FEED and the listeners, the replaced
+    snapshot to SNAPSHOT_HISTORY.
+    """
+    global current_snapshot
+    previous = current_snapshot
+    if diff is not None:
+        CHANGE_FEED.append(diff)
+        for listener in snapshot_listeners:
+            try:
+                listener(previous, snapshot, diff)
+            except Exception as e:
+                print(f"[WARN] Snapshot listener failed: {e}")
+        if diff:
+            print(f"🔀 Compatibility {diff.from_version} -> {diff.to_version}: {len(diff.added)} added, "
+                  f"{len(diff.removed)} removed, {len(diff.changed)} changed entries")
+    current_snapshot = snapshot
+    if previous is not None and previous.version != snapshot.version:
+        SNAPSHOT_HISTORY.add(previous)  # 剛被取代的版本留給 compat_version 查詢
+
+
+# 5. Fetch and parse PBF in memory
+def fetch_pbf_and_cache(latest_version=None):
+    token = api_request_handler.get_oauth_token()
+    if latest_version is None:
+        latest_version = get_latest_catalog_version(RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN, token)
+
+    snapshot = current_snapshot
+    if snapshot is not None and snapshot.version == latest_version:
+        return
+
+    with build_lock:
+        # 其他 builder 可能已經發佈相同版本
+        snapshot = current_snapshot
+        if snapshot is not None and snapshot.version == latest_version:
+            return
+
+        # 在旁邊建好完整快照 (只重建有變動的 DVN) 後一次替換；失敗時保留舊快照
+        store, data_handle = load_store(token, latest_version)
+        publish_snapshot(*next_snapshot(latest_version, store, data_handle))
+
+
+def load_cached_snapshot():
+    """
+    Publish the newest valid snapshot from the local disk cache, if there is one and nothing is loaded yet.
+    Lets a fresh process answer immediately while the version tracker revalidates against upstream.
+    """
+    global current_snapshot
+    with build_lock:
+        if current_snapshot is not None:
+            return False
+        cached = snapshot_disk_cache.load_newest()
+        if cached is None:
+            return False
+        header, store = cached
+        current_snapshot = CompatibilitySnapshot.build(header["version"], store, created_at=header["saved_at"],
+                                                       data_handle=header["data_handle"])
+        print(f"✅ Loaded cached snapshot version {header['version']} from disk")
+        return True
+
+
+def install_store(version, store, data_handle=None, created_at=None):
+    """
+    Publish a partition loaded elsewhere (e.g. mapped from the shared snapshot file of another worker), diffed
+    against the current snapshot like a regular refresh.
+    """
+    with build_lock:
+        snapshot = current_snapshot
+        if snapshot is not None and snapshot.version == version:
+            return
+        publish_snapshot(*next_snapshot(version, store, data_handle, created_at))
+
+
+def load_historical_snapshot(compat_version, record_pool):
+    """
+    Loader of SNAPSHOT_HISTORY: the same partitions -> disk cache / blob chain as the latest snapshot.
+    """
+    print(f"📥 Loading compatibility version {compat_version} for a historical query")
+    return build_snapshot(api_request_handler.get_oauth_token(), compat_version, record_pool)
+
+
+# 歷史版本 (compat_version 查詢)：LRU，版本間共用未變動的結果
+SNAPSHOT_HISTORY = SnapshotHistory(load_historical_snapshot)
+# 最近幾次快照替換的 diff (/changes)
+CHANGE_FEED = snapshot_diff.ChangeFeed()
+snapshot_listeners = []
+
+
+def get_snapshot(compat_version=None):
+    """
+    The snapshot to answer from: the current one, or the given rib-product-compatibility-1 version (loaded on
+    demand into SNAPSHOT_HISTORY). Raises VersionNotFound for versions that are negative, newer than the latest known
+    or missing upstream, and the upstream error for versions that failed to load.
+    """
+    snapshot = current_snapshot
+    if compat_version is None or (snapshot is not None and snapshot.version == compat_version):
+        return snapshot
+    latest = latest_catalog_versions.get(RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN) or \
+        (snapshot.version if snapshot is not None else None)
+    if compat_version < 0:
+        raise VersionNotFound("negative version")
+    if latest is not None and compat_version > latest:
+        raise VersionNotFound(f"newer than the latest version {latest}")
+    return SNAPSHOT_HISTORY.get(compat_version)
+
+
+def changes_since(since):
+    """
+    The diffs leading from compatibility version ``since`` to the current snapshot, oldest first. Served from
+    CHANGE_FEED when it reaches back to since, otherwise since is loaded (SNAPSHOT_HISTORY) and diffed against the
+    current snapshot in one step. Versions at or after the current one have no changes.
+    """
+    snapshot = current_snapshot
+    if snapshot is None:
         return {"error": "Data is not available yet. Try again later."}
+    diffs = []
+    if since < snapshot.version:
+        diffs = CHANGE_FEED.since(since)
+        if not diffs or diffs[-1].to_version != snapshot.version:
+            older = get_snapshot(since)
+            with metrics.stage("snapshot_diff"):
+                diffs = [snapshot_diff.diff_stores(older.store, snapshot.store, since, snapshot.version)]
+    return {"since": since, "compat_version": snapshot.version, "changes": [diff.to_dict() for diff in diffs]}
+
+
+def resolve_hmc_version(hmc_version):
     try:
-        hmc_version = int(hmc_version)
+        return int(hmc_version)
     except ValueError:
         if hmc_version == 'latest':
-            hmc_version = get_latest_catalog_version(RIB_2_CATALOG_HRN, api_request_handler.get_oauth_token())
-    results = []
-    for entry in cached_json_data.get("compatibility", []):
-        entry_region = entry["region"]
-        entry_dvn = entry["dvn"]
-
-        if region and entry_region.upper() != region.upper():
-            continue
-
-        for catalog in entry.get("catalogs", []):
-            if catalog["catalog_type"] == "HERE_MAP_CONTENT":
-                min_v = catalog.get("min_version", 0)
-                max_v = catalog.get("max_version", float("inf"))
-                catalog_hrn = catalog.get("hrn")
-                if not target_hrn:
-                    if min_v <= hmc_version <= max_v:
-                        results.append({"region": entry_region, "rmob_dvn": entry_dvn})
-                if target_hrn:
-                    if catalog_hrn == target_hrn:
-                        if min_v <= hmc_version <= max_v:
-                            results.append({"region": entry_region, "rmob_dvn": entry_dvn})
-
-    return {"catalog_version": hmc_version, "catalog_hrn": catalog_hrn, "matches": results} if results else \
+            return latest_catalog_versions.get(RIB_2_CATALOG_HRN) or \
+                   get_latest_catalog_version(RIB_2_CATALOG_HRN, api_request_handler.get_oauth_token())
+        return hmc_version
+
+
+def build_rmob_dvn_result(snapshot, hmc_version, matches):
+    rows = [snapshot.store.row(row) for row in matches]
+    results = [{"region": row.region, "rmob_dvn": row.dvn} for row in rows]
+
+    return {"catalog_version": hmc_version, "catalog_hrn": rows[-1].hrn, "matches": results} if results else \
         {"message": "No matching version found",
          "catalog_version": hmc_version}
 
 
-def get_hmc_dvn_query_worker(dvn, region=None):
-    if cached_json_data is None:
+def build_hmc_dvn_result(dvn, result):
+    return result if result is not None else \
+        {"rmob_dvn": dvn, "message": "No matching versions found"}
+
+
+def get_rmob_dvn_query_worker(hmc_version, region=None, target_hrn=None, compat_version=None):
+    snapshot = current_snapshot if compat_version is None else get_snapshot(compat_version)
+    if snapshot is None:
         return {"error": "Data is not available yet. Try again later."}
+    hmc_version = resolve_hmc_version(hmc_version)
 
-    region_catalog_map = {}
-
-    for entry in cached_json_data.get("compatibility", []):
-        entry_region = entry["region"]
-        entry_dvn = entry["dvn"]
-
-        if entry_dvn == dvn and (region is None or entry_region.upper() == region.upper()):
-            for catalog in entry.get("catalogs", []):
-                min_version = catalog.get("min_version")
-                max_version = catalog.get("max_version")
-                # catalog_hrn = catalog["hrn"]
-                # opensearch_matching = opensearch_version_query_service.filter_opensearch_versions_by_hrn(catalog_hrn, min_version, max_version)
-                catalog_data = {
-                    "catalog_type": catalog["catalog_type"],
-                    "hrn": catalog["hrn"],
-                    "min_version": min_version,
-                    "max_version": max_version,
-                    # "opensearch_versions": opensearch_matching
-                }
-
-                # 初始化該 region，如果還沒有出現過
-                if entry_region not in region_catalog_map:
-                    region_catalog_map[entry_region] = {"region": entry_region, "catalogs": []}
-
-                # 加入該 region 的 catalog list
-                region_catalog_map[entry_region]["catalogs"].append(catalog_data)
-
-    # 把 dictionary 轉換為 list
-    matches_list = list(region_catalog_map.values())
-
-    return {"rmob_dvn": dvn, "matches": matches_list} if matches_list else \
-        {"rmob_dvn": dvn, "message": "No matching versions found"}
+    # 以 (catalog_type, hrn, region) 區間索引查詢，不再逐筆掃描
+    matches = snapshot.rmob_dvn_index.lookup(hmc_version, region=region, target_hrn=target_hrn)
+    return build_rmob_dvn_result(snapshot, hmc_version, matches)
+
+
+def get_hmc_dvn_query_worker(dvn, region=None, compat_version=None):
+    snapshot = current_snapshot if compat_version is None else get_snapshot(compat_version)
+    if snapshot is None:
+        return {"error": "Data is not available yet. Try again later."}
+
+    # 預先建立的唯讀結果，直接以 dvn / (dvn, region) 查表
+    return build_hmc_dvn_result(dvn, snapshot.hmc_dvn_index.lookup(dvn, region))
+
+
+def batch_query_worker(queries, compat_version=None):
+    """
+    Evaluate many lookups against one snapshot. Each query is a dict with either ``hmc_dvn`` (plus optional
+    ``rmob_region`` / ``target_hrn``) or ``rmob_dvn`` (plus optional ``rmob_region``). HMC lookups that share a
+    filter combination are answered in a single sorted sweep. Results keep the input order and have the same
+    shape as the single-query workers. ``compat_version`` evaluates them against that historical snapshot.
+    """
+    snapshot = get_snapshot(compat_version)
+    if snapshot is None:
+        return {"error": "Data is not available yet. Try again later."}
+
+    results = [None] * len(queries)
+    hmc_groups = {}
+    for position, query in enumerate(queries):
+        if not isinstance(query, dict):
+            results[position] = {"error": "Query must be an object"}
+        elif query.get("hmc_dvn") is not None:
+            hmc_version = resolve_hmc_version(str(query["hmc_dvn"]))
+            if not isinstance(hmc_version, int):
+                results[position] = {"error": f"Invalid hmc_dvn: {query['hmc_dvn']}"}
+                continue
+            key = (query.get("rmob_region") or None, query.get("target_hrn") or None)
+            hmc_groups.setdefault(key, []).append((position, hmc_version))
+        elif query.get("rmob_dvn"):
+            dvn = str(query["rmob_dvn"])
+            results[position] = build_hmc_dvn_result(dvn, snapshot.hmc_dvn_index.lookup(dvn, query.get("rmob_region")))
+        else:
+            results[position] = {"error": "Missing required parameter: hmc_dvn or rmob_dvn"}
+
+    for (region, target_hrn), group in hmc_groups.items():
+        versions = [hmc_version for _, hmc_version in group]
+        all_matches = snapshot.rmob_dvn_index.lookup_many(versions, region=region, target_hrn=target_hrn)
+        for (position, hmc_version), matches in zip(group, all_matches):
+            results[position] = build_rmob_dvn_result(snapshot, hmc_version, matches)
+
+    return {"compat_version": snapshot.version, "results": results}
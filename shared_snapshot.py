@@ -0,0 +1,148 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import snapshot_disk_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 flock，只能以單一 process 模式執行
+    fcntl = None
+
+# 多個 gunicorn worker 共用同一份快照：
+# 只有取得 leader lock 的 worker 向上游更新，其他 worker 透過 generation 讀取
+SHARED_MODE = os.getenv("SNAPSHOT_SHARED_MODE", "false").lower() == "true"
+if SHARED_MODE and fcntl is None:
+    print("[WARN] SNAPSHOT_SHARED_MODE needs fcntl (not available on this platform), shared mode disabled")
+    SHARED_MODE = False
+LEADER_LOCK_PATH = os.path.join(snapshot_disk_cache.CACHE_DIR, "leader.lock")
+CONTROL_PATH = os.path.join(snapshot_disk_cache.CACHE_DIR, "current.ctl")
+DEPENDENCY_INDEX_PATH = os.path.join(snapshot_disk_cache.CACHE_DIR, "opensearch_dependencies.json")
+
+CONTROL_SIZE = 4096
+_CONTROL_HEADER = struct.Struct("<QI")  # generation, body length
+
+_leader_file = None
+_control = None
+
+
+def try_become_leader():
+    """
+    Non-blocking attempt to take the process-wide leader lock. The lock is held until the process exits, so a
+    crashed leader is replaced by whichever worker tries next.
+    """
+    global _leader_file
+    if _leader_file is not None:
+        return True
+    if fcntl is None:
+        raise Exception("Shared snapshot mode needs fcntl, which is not available on this platform")
+    os.makedirs(snapshot_disk_cache.CACHE_DIR, exist_ok=True)
+    f = open(LEADER_LOCK_PATH, "a+")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _leader_file = f
+    print(f"✅ Process {os.getpid()} is the snapshot refresh leader")
+    return True
+
+
+def is_leader():
+    return _leader_file is not None
+
+
+def _control_map():
+    global _control
+    if _control is None:
+        os.makedirs(snapshot_disk_cache.CACHE_DIR, exist_ok=True)
+        fd = os.open(CONTROL_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < CONTROL_SIZE:
+                os.ftruncate(fd, CONTROL_SIZE)
+            _control = mmap.mmap(fd, CONTROL_SIZE, access=mmap.ACCESS_WRITE)
+        finally:
+            os.close(fd)
+    return _control
+
+
+def publish(snapshot, state):
+    """
+    Leader only: point the control block at the snapshot file and bump the generation counter.
+
+    The generation is odd while the body is being rewritten (seqlock), so readers never act on a torn update.
+    """
+    body = json.dumps({
+        "version": snapshot.version,
+        "path": snapshot_disk_cache.snapshot_path(snapshot.version, snapshot.data_handle),
+        "created_at": snapshot.created_at,
+        "state": state,
+    }).encode("utf-8")
+    if len(body) > CONTROL_SIZE - _CONTROL_HEADER.size:
+        raise ValueError("Shared snapshot control block overflow")
+
+    control = _control_map()
+    generation, _ = _CONTROL_HEADER.unpack_from(control, 0)
+    generation += generation % 2  # 前一個 leader 寫到一半中斷時恢復成偶數
+    _CONTROL_HEADER.pack_into(control, 0, generation + 1, 0)
+    control[_CONTROL_HEADER.size:_CONTROL_HEADER.size + len(body)] = body
+    _CONTROL_HEADER.pack_into(control, 0, generation + 2, len(body))
+
+
+def current_generation():
+    """
+    Cheap per-request check: a single read from the shared mapping, no syscalls.
+    """
+    return _CONTROL_HEADER.unpack_from(_control_map(), 0)[0]
+
+
+def read_published():
+    """
+    Return (generation, published info) or (generation, None) if nothing has been published yet.
+    """
+    control = _control_map()
+    for _ in range(100):
+        generation, length = _CONTROL_HEADER.unpack_from(control, 0)
+        if generation % 2:
+            continue
+        body = control[_CONTROL_HEADER.size:_CONTROL_HEADER.size + length]
+        if _CONTROL_HEADER.unpack_from(control, 0)[0] != generation:
+            continue
+        return generation, json.loads(body) if length else None
+    return generation, None
+
+
+def load_published(info):
+    """
+    Map the published snapshot file without copying its columns. Returns (header, store).
+    """
+    return snapshot_disk_cache.read_file(info["path"], zero_copy=True)
+
+
+def publish_dependency_index(index):
+    """
+    Leader only: write the OpenSearch reverse dependency index (see dependency_index.DependencyIndex) for the
+    followers, to a temp file renamed into place. Returns the catalog version it covers.
+    """
+    os.makedirs(snapshot_disk_cache.CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=snapshot_disk_cache.CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump({"indexed_until": index.indexed_until, "by_hrn": index.by_hrn}, f, separators=(",", ":"))
+        os.replace(tmp_path, DEPENDENCY_INDEX_PATH)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return index.indexed_until
+
+
+def load_dependency_index():
+    """
+    Follower side of publish_dependency_index. Returns (by_hrn, indexed_until) for DependencyIndex.install.
+    """
+    with open(DEPENDENCY_INDEX_PATH) as f:
+        data = json.load(f)
+    return {hrn: [tuple(row) for row in rows] for hrn, rows in data["by_hrn"].items()}, data["indexed_until"]
@@ -0,0 +1,54 @@
+import threading
+
+import metrics
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution: the first caller runs it, the others wait for its
+    result (or exception). Nothing is remembered once the call finishes.
+    """
+
+    def __init__(self, name):
+        self.name = name  # group label in metrics
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func):
+        with self.lock:
+            call = self.calls.get(key)
+            owner = call is None
+            if owner:
+                call = self.calls[key] = _Call()
+        metrics.inc("single_flight_calls_total", group=self.name, role="leader" if owner else "follower")
+
+        if owner:
+            finished = False
+            try:
+                call.result = func()
+                finished = True
+            except Exception as e:
+                call.error = e
+                finished = True
+            finally:
+                if not finished:
+                    # leader 被 KeyboardInterrupt / SystemExit 中斷：
+                    # 等待者要收到例外，而不是把 None 當結果
+                    call.error = Exception(f"{self.name} call for {key!r} was interrupted")
+                with self.lock:
+                    self.calls.pop(key, None)
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
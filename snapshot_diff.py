@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from collections import Counter, deque
+
+from compatibility_index import HERE_MAP_CONTENT, IntervalIndex
+from compatibility_store import CATALOG_TYPE_NAMES, REGION_NAMES
+
+# 每個 process 記住的最近 diff 數 (/changes 的回溯範圍)
+CHANGE_FEED_MAX_ENTRIES = int(os.getenv("CHANGE_FEED_MAX_ENTRIES", "50"))
+
+
+def entry_catalogs(store):
+    """
+    (region, rmob_dvn) -> list of (catalog_type, hrn, min_version, max_version), both in partition order.
+    Repeated entries for the same region and DVN are merged.
+    """
+    strings = store.strings.strings
+    keys = [(REGION_NAMES[region], strings[dvn]) for region, dvn in zip(store.entry_region, store.entry_dvn)]
+    entries = {key: [] for key in keys}
+    for entry, catalog_type, hrn, min_v, max_v in zip(store.catalog_entry, store.catalog_type, store.catalog_hrn,
+                                                      store.catalog_min, store.catalog_max):
+        entries[keys[entry]].append((CATALOG_TYPE_NAMES[catalog_type], strings[hrn], min_v, max_v))
+    return entries
+
+
+def catalog_dict(catalog):
+    # 與 get_hmc_dvn 相同的形狀：proto3 的 0 輸出為 None
+    catalog_type, hrn, min_v, max_v = catalog
+    return {"catalog_type": catalog_type, "hrn": hrn, "min_version": min_v or None, "max_version": max_v or None}
+
+
+def _bound(before, after):
+    return {"from": before or None, "to": after or None}
+
+
+def entry_change(region, dvn, old_catalogs, new_catalogs):
+    """
+    Describe how the catalogs of one entry changed. A catalog (type + HRN) that was replaced by exactly one
+    catalog with the same type and HRN is reported under bounds_changed, everything else as added / removed.
+    """
+    old_counts, new_counts = Counter(old_catalogs), Counter(new_catalogs)
+    removed = list((old_counts - new_counts).elements())
+    added = list((new_counts - old_counts).elements())
+
+    bounds_changed = []
+    for before in list(removed):
+        same_removed = [c for c in removed if c[:2] == before[:2]]
+        same_added = [c for c in added if c[:2] == before[:2]]
+        if len(same_removed) == 1 and len(same_added) == 1:
+            after = same_added[0]
+            removed.remove(before)
+            added.remove(after)
+            bounds_changed.append({"catalog_type": before[0], "hrn": before[1],
+                                   "min_version": _bound(before[2], after[2]),
+                                   "max_version": _bound(before[3], after[3])})
+    return {"region": region, "rmob_dvn": dvn,
+            "catalogs": [catalog_dict(c) for c in new_catalogs],
+            "bounds_changed": bounds_changed,
+            "catalogs_added": [catalog_dict(c) for c in added],
+            "catalogs_removed": [catalog_dict(c) for c in removed]}
+
+
+class SnapshotDiff:
+    """
+    Structural difference between the partitions of two compatibility versions, per (region, rmob_dvn) entry:
+    entries added, removed, and changed (new catalog list plus the bounds / catalogs that differ).
+    """
+
+    __slots__ = ("from_version", "to_version", "created_at", "added", "removed", "changed", "changed_dvns",
+                 "_hmc_ranges")
+
+    def __init__(self, from_version, to_version):
+        self.from_version = from_version
+        self.to_version = to_version
+        self.created_at = time.time()
+        self.added = []
+        self.removed = []
+        self.changed = []
+        self.changed_dvns = set()
+        self._hmc_ranges = []  # 受影響 entry 新舊的 HMC 區間 (min, max, region)，供 cache 失效判斷
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def _touch(self, region, dvn, *catalog_lists):
+        self.changed_dvns.add(dvn)
+        for catalogs in catalog_lists:
+            self._hmc_ranges.extend((min_v, max_v or float("inf"), region)
+                                    for catalog_type, _, min_v, max_v in catalogs if catalog_type == HERE_MAP_CONTENT)
+
+    def hmc_version_checker(self):
+        """
+        Function (hmc_version, region or None) -> whether an HMC lookup may answer differently after this diff.
+        """
+        index = IntervalIndex(self._hmc_ranges)
+
+        def affected(hmc_version, region=None):
+            regions = index.stab(hmc_version)
+            return bool(regions) if region is None else region in regions
+
+        return affected
+
+    def to_dict(self):
+        return {"from_version": self.from_version,
+                "to_version": self.to_version,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.created_at)),
+                "added": self.added,
+                "removed": self.removed,
+                "changed": self.changed}
+
+
+def diff_stores(old_store, new_store, from_version=None, to_version=None):
+    """
+    Compare two CompatibilityStores entry by entry. Entries whose catalog list is identical (same catalogs in the
+    same order) are unchanged; changed entries are invalidated as a whole.
+    """
+    old_entries = entry_catalogs(old_store)
+    new_entries = entry_catalogs(new_store)
+    diff = SnapshotDiff(from_version, to_version)
+    for (region, dvn), catalogs in new_entries.items():
+        old_catalogs = old_entries.get((region, dvn))
+        if old_catalogs is None:
+            diff.added.append({"region": region, "rmob_dvn": dvn, "catalogs": [catalog_dict(c) for c in catalogs]})
+            diff._touch(region, dvn, catalogs)
+        elif old_catalogs != catalogs:
+            diff.changed.append(entry_change(region, dvn, old_catalogs, catalogs))
+            diff._touch(region, dvn, old_catalogs, catalogs)
+    for (region, dvn), old_catalogs in old_entries.items():
+        if (region, dvn) not in new_entries:
+            diff.removed.append({"region": region, "rmob_dvn": dvn,
+                                 "catalogs": [catalog_dict(c) for c in old_catalogs]})
+            diff._touch(region, dvn, old_catalogs)
+    return diff
+
+
+class ChangeFeed:
+    """
+    The most recent diffs applied by this process, oldest first.
+    """
+
+    def __init__(self, max_entries=CHANGE_FEED_MAX_ENTRIES):
+        self.diffs = deque(maxlen=max_entries)
+        self.lock = threading.Lock()
+
+    def append(self, diff):
+        with self.lock:
+            self.diffs.append(diff)
+
+    def since(self, version):
+        """
+        The chain of diffs leading from version to the newest diff, [] when version is the newest, or None when
+        the feed does not reach back to version.
+        """
+        with self.lock:
+            diffs = list(self.diffs)
+        if diffs and diffs[-1].to_version == version:
+            return []
+        for start in range(len(diffs) - 1, -1, -1):
+            if diffs[start].from_version == version:
+                chain = diffs[start:]
+                if all(a.to_version == b.from_version for a, b in zip(chain, chain[1:])):
+                    return chain
+                return None
+        return None
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+
+from compatibility_store import CompatibilityStore
+
+# 本機快照快取目錄與大小上限 (bytes)
+CACHE_DIR = os.getenv("SNAPSHOT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshot_cache"))
+MAX_CACHE_BYTES = int(os.getenv("SNAPSHOT_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+MAGIC = b"RMOBSNAP2\n"
+ALIGNMENT = 8  # payload sections start on 8-byte boundaries so columns can be mapped without copying
+FILE_SUFFIX = ".snap"
+_HEADER_LENGTH = struct.Struct("<I")
+INVALID_FILE_ERRORS = (OSError, ValueError, KeyError, TypeError, struct.error)
+
+
+def snapshot_path(version, data_handle):
+    handle_digest = hashlib.sha1(data_handle.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"compat-{int(version):012d}-{handle_digest}{FILE_SUFFIX}")
+
+
+def save(version, data_handle, store):
+    """
+    Persist the prebuilt columnar store for (version, data_handle).
+
+    File layout: MAGIC, uint32 header length, JSON header, payload. The header lists every payload section and a
+    sha256 of the whole payload; the file is written to a temp name and renamed so readers never see a partial file.
+    """
+    sections = [("strings", "\0".join(store.strings.strings).encode("utf-8"))]
+    columns = {}
+    for name, column in store.columns().items():
+        sections.append((name, column.tobytes()))
+        columns[name] = getattr(column, "typecode", None) or column.format
+
+    offset = 0
+    layout = []
+    digest = hashlib.sha256()
+    padded = []
+    for name, data in sections:
+        layout.append([name, offset, len(data)])
+        data += b"\0" * (-len(data) % ALIGNMENT)
+        digest.update(data)
+        padded.append(data)
+        offset += len(data)
+
+    header = json.dumps({
+        "version": version,
+        "data_handle": data_handle,
+        "saved_at": time.time(),
+        "byteorder": sys.byteorder,
+        "itemsizes": {typecode: array(typecode).itemsize for typecode in set(columns.values())},
+        "columns": columns,
+        "sections": layout,
+        "sha256": digest.hexdigest(),
+    }).encode("utf-8")
+    header += b" " * (-(len(MAGIC) + _HEADER_LENGTH.size + len(header)) % ALIGNMENT)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(_HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            for data in padded:
+                f.write(data)
+        os.replace(tmp_path, snapshot_path(version, data_handle))
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    evict()
+
+
+def read_file(path, zero_copy=False):
+    """
+    Memory-map a snapshot file, verify it and return (header, store). Raises ValueError if the file is invalid.
+
+    With zero_copy the store columns are memoryviews over the mapping (shared page cache between processes, the
+    mapping stays open as long as the store references it); otherwise they are copied into arrays.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if mapped[:len(MAGIC)] != MAGIC:
+            raise ValueError("bad magic")
+        start = len(MAGIC) + _HEADER_LENGTH.size
+        (header_length,) = _HEADER_LENGTH.unpack(mapped[len(MAGIC):start])
+        header = json.loads(mapped[start:start + header_length])
+        payload_start = start + header_length
+
+        digest = hashlib.sha256()
+        digest.update(mapped[payload_start:])
+        if digest.hexdigest() != header["sha256"]:
+            raise ValueError("checksum mismatch")
+        if header["byteorder"] != sys.byteorder or any(
+                array(typecode).itemsize != size for typecode, size in header["itemsizes"].items()):
+            raise ValueError("written on an incompatible platform")
+
+        sections = {name: (payload_start + offset, payload_start + offset + length)
+                    for name, offset, length in header["sections"]}
+        begin, end = sections["strings"]
+        strings = mapped[begin:end].decode("utf-8").split("\0") if end > begin else []
+        columns = {}
+        for name, typecode in header["columns"].items():
+            begin, end = sections[name]
+            if zero_copy:
+                columns[name] = memoryview(mapped)[begin:end].cast(typecode)
+            else:
+                column = array(typecode)
+                column.frombytes(mapped[begin:end])
+                columns[name] = column
+    except Exception:
+        columns = None
+        mapped.close()
+        raise
+    if not zero_copy:
+        mapped.close()
+    return header, CompatibilityStore.from_columns(strings, columns)
+
+
+def load(version, data_handle):
+    """
+    Return the cached store for exactly (version, data_handle), or None.
+    """
+    path = snapshot_path(version, data_handle)
+    if not os.path.exists(path):
+        return None
+    try:
+        return read_file(path)[1]
+    except INVALID_FILE_ERRORS as e:
+        print(f"[WARN] Discarding invalid snapshot cache file {path}: {e}")
+        _remove(path)
+        return None
+
+
+def load_newest(zero_copy=False):
+    """
+    Return (header, store) of the newest valid cached snapshot, or None. Invalid files are removed.
+    """
+    for path in _cache_files(newest_first=True):
+        try:
+            return read_file(path, zero_copy)
+        except INVALID_FILE_ERRORS as e:
+            print(f"[WARN] Discarding invalid snapshot cache file {path}: {e}")
+            _remove(path)
+    return None
+
+
+def evict():
+    """
+    Remove the oldest snapshot files until the cache fits in MAX_CACHE_BYTES; the newest file is always kept.
+    """
+    paths = _cache_files(newest_first=True)
+    total = 0
+    for i, path in enumerate(paths):
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            continue
+        if i > 0 and total > MAX_CACHE_BYTES:
+            _remove(path)
+
+
+def _cache_files(newest_first):
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    names = [name for name in os.listdir(CACHE_DIR) if name.startswith("compat-") and name.endswith(FILE_SUFFIX)]
+    # 檔名中的版本號補零，字串排序即版本排序
+    return [os.path.join(CACHE_DIR, name) for name in sorted(names, reverse=newest_first)]
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
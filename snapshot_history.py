@@ -0,0 +1,69 @@
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+from compatibility_index import RecordPool
+from single_flight import SingleFlight
+
+# 記憶體中保留的歷史 compatibility 版本數 (不含目前的最新快照)
+MAX_VERSIONS = int(os.getenv("SNAPSHOT_HISTORY_MAX_VERSIONS", "4"))
+
+
+class SnapshotHistory:
+    """
+    LRU of older compatibility snapshots for time-travel queries.
+
+    Snapshots are loaded lazily with load(version, record_pool). Each keeps its own StringTable, so evicting a
+    version frees everything only it referenced; the weak RecordPool makes the prebuilt results of DVNs that did
+    not change between versions the same objects. Concurrent requests for the same version share one load; loads
+    never run under the LRU lock. The latest snapshot is kept by the caller and is not part of the LRU.
+    """
+
+    def __init__(self, load, max_versions=MAX_VERSIONS):
+        self.load = load
+        self.max_versions = max_versions
+        self.snapshots = OrderedDict()
+        self.loads = SingleFlight("snapshot_history")
+        self.lock = threading.Lock()
+        self.record_pool = RecordPool()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version):
+        """
+        Return the snapshot for version, loading it if needed. Load errors are raised to every waiting caller.
+        """
+        with self.lock:
+            snapshot = self.snapshots.get(version)
+            if snapshot is not None:
+                self.snapshots.move_to_end(version)
+                self.hits += 1
+                metrics.cache_result("snapshot_history", True)
+                return snapshot
+            self.misses += 1
+            metrics.cache_result("snapshot_history", False)
+        return self.loads.do(version, lambda: self._load(version))
+
+    def _load(self, version):
+        with self.lock:
+            snapshot = self.snapshots.get(version)
+        if snapshot is not None:
+            return snapshot  # 另一個請求剛載入完成
+        snapshot = self.load(version, self.record_pool)
+        self.add(snapshot)
+        return snapshot
+
+    def add(self, snapshot):
+        """
+        Put an already built snapshot (e.g. the latest one being replaced) into the LRU.
+        """
+        with self.lock:
+            self.snapshots[snapshot.version] = snapshot
+            self.snapshots.move_to_end(snapshot.version)
+            while len(self.snapshots) > self.max_versions:
+                self.snapshots.popitem(last=False)
+
+    def versions(self):
+        with self.lock:
+            return list(self.snapshots)
@@ -0,0 +1,73 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# 模組都在 repo 根目錄 (沒有 package)
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import benchmark_rmob_lookup  # noqa: E402
+from compatibility_store import CompatibilityStore  # noqa: E402
+
+PBF_FILE = os.path.join(REPO_DIR, "response.pbf")
+
+
+@pytest.fixture(scope="session")
+def partition_bytes():
+    with open(PBF_FILE, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture(scope="session")
+def json_data():
+    """
+    The partition as MessageToDict output, the data the original scan-based workers read.
+    """
+    return benchmark_rmob_lookup.load_json_data(PBF_FILE)
+
+
+@pytest.fixture
+def store(partition_bytes):
+    return CompatibilityStore.from_bytes(partition_bytes)
+
+
+@pytest.fixture
+def stub_upstream(tmp_path, monkeypatch):
+    """
+    A here_api_stub server with the app's upstream URLs, credentials and process-wide caches pointed at it.
+    Yields the server; its ``state.config`` can be changed while the test runs.
+    """
+    import api_request_handler
+    import here_api_stub
+    import http_client
+    import opensearch_version_query_service
+    import rmob_version_query_service
+    import snapshot_disk_cache
+    import upstream_guard
+    from dependency_index import DependencyIndex
+
+    server = here_api_stub.make_server()
+    threading.Thread(target=server.serve_forever, name="here-api-stub", daemon=True).start()
+    base_url = "http://%s:%d" % server.server_address
+
+    monkeypatch.setattr(api_request_handler, "OAUTH2_URL", f"{base_url}/oauth2/token")
+    monkeypatch.setattr(api_request_handler, "CLIENT_ID", "stub-client")
+    monkeypatch.setattr(api_request_handler, "CLIENT_SECRET", "stub-secret")
+    monkeypatch.setitem(api_request_handler.credentials_result, "status", "ok")
+    monkeypatch.setattr(api_request_handler, "TOKEN_CACHE", {"token": None, "expires_at": 0, "refresh_at": 0})
+    monkeypatch.setattr(api_request_handler, "LATEST_VERSION_CACHE_TTL", 0)
+    monkeypatch.setattr(http_client, "MAX_RETRIES", 0)
+    monkeypatch.setattr(upstream_guard, "_guards", {})
+    monkeypatch.setattr(rmob_version_query_service, "BASE_URL", f"{base_url}/metadata/v1/catalogs")
+    monkeypatch.setattr(rmob_version_query_service, "BLOBSTORE_URL", f"{base_url}/blobstore/v1/catalogs")
+    monkeypatch.setattr(opensearch_version_query_service, "METADATA_URL", f"{base_url}/metadata/v1/catalogs")
+    monkeypatch.setattr(opensearch_version_query_service, "BLOBSTORE_URL", f"{base_url}/blobstore/v1/catalogs")
+    monkeypatch.setattr(opensearch_version_query_service, "DEPENDENCY_INDEX", DependencyIndex())
+    monkeypatch.setattr(rmob_version_query_service, "current_snapshot", None)
+    monkeypatch.setattr(rmob_version_query_service, "latest_catalog_versions", {})
+    monkeypatch.setattr(snapshot_disk_cache, "CACHE_DIR", str(tmp_path))
+    yield server
+    server.shutdown()
+    server.server_close()
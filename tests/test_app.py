@@ -0,0 +1,97 @@
+import pytest
+
+import response_cache
+import rmob_version_query_service
+import upstream_guard
+import version_tracker
+from snapshot_history import SnapshotHistory
+
+COMPAT_HRN = rmob_version_query_service.RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN
+
+
+@pytest.fixture
+def client(stub_upstream, monkeypatch):
+    """
+    Flask test client of app.py with snapshot version 100 from the stub installed.
+    """
+    import app
+
+    monkeypatch.setattr(version_tracker, "REFRESH_STATUS", dict.fromkeys(version_tracker.REFRESH_STATUS))
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE", response_cache.ResponseCache())
+    monkeypatch.setattr(rmob_version_query_service, "SNAPSHOT_HISTORY",
+                        SnapshotHistory(rmob_version_query_service.load_historical_snapshot))
+    version_tracker.refresh()
+    return app.app.test_client()
+
+
+def test_compat_version_loads_older_version(client):
+    response = client.get("/get_hmc_dvn?rmob_dvn=24151&compat_version=99")
+
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("compat_version", ["101", "-1"])
+def test_unknown_compat_version_is_404(client, compat_version):
+    response = client.get(f"/get_hmc_dvn?rmob_dvn=24151&compat_version={compat_version}")
+
+    assert response.status_code == 404
+
+
+def test_upstream_error_loading_compat_version_is_502(client, stub_upstream):
+    stub_upstream.state.config["failing_catalogs"] = [COMPAT_HRN]
+
+    response = client.get("/get_hmc_dvn?rmob_dvn=24151&compat_version=99")
+
+    assert response.status_code == 502
+    assert "Failed to load compatibility version 99" in response.get_json()["error"]
+
+
+def test_open_circuit_loading_compat_version_is_503(client, stub_upstream, monkeypatch):
+    monkeypatch.setattr(upstream_guard, "BREAKER_FAILURE_THRESHOLD", 1)
+    stub_upstream.state.config["failing_catalogs"] = [COMPAT_HRN]
+    assert client.get("/get_hmc_dvn?rmob_dvn=24151&compat_version=99").status_code == 502
+
+    response = client.get("/get_hmc_dvn?rmob_dvn=24151&compat_version=98")
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_changes_since_older_version(client):
+    response = client.get("/changes?since=99")
+
+    assert response.status_code == 200
+    assert response.get_json()["compat_version"] == 100
+
+
+def test_changes_since_unknown_version_is_404(client):
+    assert client.get("/changes?since=-1").status_code == 404
+
+
+def test_changes_with_open_circuit_is_503(client, stub_upstream, monkeypatch):
+    monkeypatch.setattr(upstream_guard, "BREAKER_FAILURE_THRESHOLD", 1)
+    stub_upstream.state.config["failing_catalogs"] = [COMPAT_HRN]
+    assert client.get("/changes?since=99").status_code == 502
+
+    response = client.get("/changes?since=98")
+
+    assert response.status_code == 503
+    assert "Circuit open" in response.get_json()["error"]
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_opensearch_versions_with_bounds(client):
+    response = client.get("/get_opensearch_versions?target_hrn=hrn:here:data::olp-here:rib-2"
+                          "&min_version=3000&max_version=3100")
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body["min_version"], body["max_version"]) == (3000, 3100)
+    assert body["opensearch_versions"]
+
+
+def test_matrix_rejects_malformed_bound(client):
+    response = client.get("/matrix?max_version=x")
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid max_version: x"}
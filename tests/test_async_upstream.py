@@ -0,0 +1,68 @@
+import pytest
+
+import opensearch_version_query_service
+import rmob_version_query_service
+import version_tracker
+
+COMPAT_HRN = rmob_version_query_service.RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN
+RIB_2_HRN = rmob_version_query_service.RIB_2_CATALOG_HRN
+OPENSEARCH_HRN = opensearch_version_query_service.CATALOG_HRN
+
+
+@pytest.fixture
+def refresh_status(monkeypatch):
+    status = dict.fromkeys(version_tracker.REFRESH_STATUS)
+    monkeypatch.setattr(version_tracker, "REFRESH_STATUS", status)
+    return status
+
+
+def test_refresh_records_every_catalog(stub_upstream, refresh_status):
+    version_tracker.refresh()
+
+    assert rmob_version_query_service.current_snapshot.version == 100
+    assert rmob_version_query_service.latest_catalog_versions == {COMPAT_HRN: 100, RIB_2_HRN: 6973,
+                                                                  OPENSEARCH_HRN: 3000}
+    assert refresh_status["last_error"] is None
+
+
+def test_failing_catalog_does_not_cancel_the_compatibility_refresh(stub_upstream, refresh_status):
+    version_tracker.refresh()
+    stub_upstream.state.config.update(compat_version=101, opensearch_versions=3001,
+                                      failing_catalogs=[OPENSEARCH_HRN])
+
+    with pytest.raises(Exception, match="Failed to fetch catalog version"):
+        version_tracker.refresh()
+
+    assert rmob_version_query_service.current_snapshot.version == 101
+    latest = rmob_version_query_service.latest_catalog_versions
+    assert (latest[COMPAT_HRN], latest[RIB_2_HRN], latest[OPENSEARCH_HRN]) == (101, 6973, 3000)
+    assert "Failed to fetch catalog version" in refresh_status["last_error"]
+
+
+def test_failing_compatibility_catalog_keeps_the_snapshot(stub_upstream, refresh_status):
+    version_tracker.refresh()
+    stub_upstream.state.config.update(compat_version=101, opensearch_versions=3001, failing_catalogs=[COMPAT_HRN])
+
+    with pytest.raises(Exception, match="Failed to fetch catalog version"):
+        version_tracker.refresh()
+
+    assert rmob_version_query_service.current_snapshot.version == 100
+    latest = rmob_version_query_service.latest_catalog_versions
+    assert (latest[COMPAT_HRN], latest[OPENSEARCH_HRN]) == (100, 3001)
+
+
+def test_other_catalog_outage_does_not_make_the_snapshot_stale(stub_upstream, refresh_status, monkeypatch):
+    monkeypatch.setattr(version_tracker, "MAX_STALENESS", 60)
+    version_tracker.refresh()
+    refresh_status["snapshot_confirmed_at"] -= 3600  # 上一輪確認已超過 MAX_STALENESS
+    stub_upstream.state.config["failing_catalogs"] = [OPENSEARCH_HRN]
+
+    with pytest.raises(Exception):
+        version_tracker.refresh()
+
+    assert version_tracker.staleness() < 60
+    stub_upstream.state.config["failing_catalogs"] = [COMPAT_HRN]
+    refresh_status["snapshot_confirmed_at"] -= 3600
+    with pytest.raises(Exception):
+        version_tracker.refresh()
+    assert version_tracker.staleness() > 60
@@ -0,0 +1,93 @@
+import random
+
+import pytest
+
+from benchmark_rmob_lookup import full_scan_lookup, index_lookup, make_queries
+from compatibility_index import HmcDvnIndex, IntervalIndex, RecordPool, RmobDvnIndex
+
+RIB_2 = "hrn:here:data::olp-here:rib-2"
+
+
+def hmc_versions(json_data, count=150, seed=0):
+    """
+    A sample of the partition's range bounds and their neighbours, plus values outside all ranges.
+    """
+    bounds = sorted({bound for entry in json_data["compatibility"] for catalog in entry["catalogs"]
+                     for bound in (catalog.get("min_version", 0), catalog.get("max_version", 0))})
+    versions = {0, 1, 10 ** 9}
+    for bound in random.Random(seed).sample(bounds, min(count, len(bounds))):
+        versions.update((bound - 1, bound, bound + 1))
+    return sorted(version for version in versions if version >= 0)
+
+
+def full_scan_hmc_dvn(json_data, dvn, region=None):
+    """
+    Reference: the per-request scan get_hmc_dvn_query_worker used before the DVN index.
+    """
+    region_catalog_map = {}
+    for entry in json_data["compatibility"]:
+        if entry["dvn"] != dvn or (region is not None and entry["region"].upper() != region.upper()):
+            continue
+        for catalog in entry.get("catalogs", []):
+            region_catalog_map.setdefault(entry["region"], {"region": entry["region"], "catalogs": []})
+            region_catalog_map[entry["region"]]["catalogs"].append({
+                "catalog_type": catalog["catalog_type"], "hrn": catalog["hrn"],
+                "min_version": catalog.get("min_version"), "max_version": catalog.get("max_version")})
+    matches = list(region_catalog_map.values())
+    return {"rmob_dvn": dvn, "matches": matches} if matches else None
+
+
+def as_plain(value):
+    if isinstance(value, dict):
+        return {key: as_plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [as_plain(item) for item in value]
+    return value
+
+
+def test_interval_index_matches_brute_force():
+    rng = random.Random(0)
+    intervals = []
+    for payload in range(300):
+        min_v = rng.randint(0, 1000)
+        intervals.append((min_v, min_v + rng.randint(0, 200), payload))
+    intervals.append((500, float("inf"), "open"))
+    index = IntervalIndex(intervals)
+
+    versions = list(range(-5, 1300))
+    for version in versions:
+        expected = tuple(payload for min_v, max_v, payload in intervals if min_v <= version <= max_v)
+        assert index.stab(version) == expected, version
+    assert list(index.stab_sorted(versions)) == [index.stab(version) for version in versions]
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_rmob_dvn_index_matches_full_scan(json_data, store, lazy):
+    index = RmobDvnIndex(store, lazy=lazy)
+    regions = sorted({entry["region"] for entry in json_data["compatibility"]})
+    filters = [(region, target_hrn) for region in [None, "na", "x"] + regions[:3] for target_hrn in (None, RIB_2)]
+
+    for hmc_version in hmc_versions(json_data):
+        for region, target_hrn in filters:
+            assert index_lookup(store, index, hmc_version, region, target_hrn) == \
+                full_scan_lookup(json_data, hmc_version, region, target_hrn), (hmc_version, region, target_hrn)
+    for hmc_version, region in make_queries(json_data, 500, seed=1):
+        assert index_lookup(store, index, hmc_version, region) == full_scan_lookup(json_data, hmc_version, region)
+
+
+def test_lookup_many_matches_lookup(json_data, store):
+    index = RmobDvnIndex(store)
+    versions = [hmc_version for hmc_version, _ in make_queries(json_data, 500, seed=2)]
+    for region in (None, "WEU"):
+        assert index.lookup_many(versions, region=region) == [index.lookup(version, region) for version in versions]
+
+
+@pytest.mark.parametrize("pool", [None, RecordPool()])
+def test_hmc_dvn_index_matches_full_scan(json_data, store, pool):
+    index = HmcDvnIndex(store, pool)
+    dvns = sorted({entry["dvn"] for entry in json_data["compatibility"]}) + ["missing"]
+    regions = [None] + sorted({entry["region"] for entry in json_data["compatibility"]}) + ["na", "macau"]
+
+    for dvn in dvns:
+        for region in regions:
+            assert as_plain(index.lookup(dvn, region)) == full_scan_hmc_dvn(json_data, dvn, region), (dvn, region)
@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+from dependency_index import DependencyIndex
+
+HRN = "hrn:here:data::olp-here:rib-2"
+OTHER_HRN = "hrn:here:data::olp-here:rib-external-references-2"
+
+
+def entry(version, *dependencies):
+    return {"version": version, "timestamp": 1000 + version,
+            "dependencies": [{"hrn": hrn, "version": dependency_version} for hrn, dependency_version in dependencies]}
+
+
+def random_entries(rng, count):
+    return [entry(version, (HRN, rng.randint(1, 200)), (OTHER_HRN, rng.randint(1, 50)))
+            for version in range(1, count + 1)]
+
+
+def reference_query(entries, hrn, min_version=None, max_version=None):
+    rows = [(d["version"], e["version"], e["timestamp"]) for e in entries for d in e["dependencies"]
+            if d["hrn"] == hrn and d["version"] is not None]
+    matches = {}
+    for dependency_version, version, timestamp in sorted(rows):
+        if (min_version is None or dependency_version >= min_version) and \
+                (max_version is None or dependency_version <= max_version):
+            matches.setdefault(version, timestamp)
+    if matches or min_version is None or not rows:
+        return sorted(matches.items()), True
+    best = min(abs(row[0] - min_version) for row in rows)
+    return [min((row[1], row[2]) for row in rows if abs(row[0] - min_version) == best)], False
+
+
+def test_incremental_pages_merge_into_sorted_lists():
+    rng = random.Random(7)
+    entries = random_entries(rng, 600)
+    index = DependencyIndex()
+    for start in range(0, 600, 97):
+        page = entries[start:start + 97]
+        index.add_versions(page, page[-1]["version"])
+
+    assert index.indexed_until == 600
+    for hrn in (HRN, OTHER_HRN):
+        rows = index.by_hrn[hrn]
+        assert [row[:2] for row in rows] == sorted(row[:2] for row in rows)
+        assert sorted(rows) == sorted((d["version"], e["version"], e["timestamp"]) for e in entries
+                                      for d in e["dependencies"] if d["hrn"] == hrn)
+
+
+def test_query_matches_reference():
+    rng = random.Random(11)
+    entries = random_entries(rng, 400)
+    index = DependencyIndex()
+    for start in range(0, 400, 50):
+        index.add_versions(entries[start:start + 50], start + 50)
+
+    bounds = [None, -5, 0, 1, 17, 100, 150, 199, 200, 201, 500]
+    for min_version in bounds:
+        for max_version in bounds:
+            assert index.query(HRN, min_version, max_version) == \
+                reference_query(entries, HRN, min_version, max_version), (min_version, max_version)
+
+
+def test_versionless_dependencies_are_skipped():
+    index = DependencyIndex()
+    index.add_versions([entry(1, (HRN, None), (OTHER_HRN, 5)), {"version": None, "timestamp": 0,
+                                                                 "dependencies": [{"hrn": HRN, "version": 3}]},
+                        entry(2, (HRN, 4))], 2)
+
+    assert index.by_hrn[HRN] == [(4, 2, 1002)]
+    assert index.by_hrn[OTHER_HRN] == [(5, 1, 1001)]
+
+
+def test_closest_version_fallback():
+    index = DependencyIndex()
+    index.add_versions([entry(1, (HRN, 10)), entry(2, (HRN, 20)), entry(3, (HRN, 30)), entry(4, (HRN, 10))], 4)
+
+    # 範圍內沒有相依版本：回傳最接近 min_version 的那一個 (同距離取最早的 catalog 版本)
+    assert index.query(HRN, 14, 16) == ([(1, 1001)], False)
+    assert index.query(HRN, 16, 17) == ([(2, 1002)], False)
+    assert index.query(HRN, 15, 15) == ([(1, 1001)], False)
+    assert index.query(HRN, 100) == ([(3, 1003)], False)
+    assert index.query(HRN, 1, 5) == ([(1, 1001)], False)
+    # 沒有 min_version 或沒有資料時不做替代
+    assert index.query(HRN, None, 5) == ([], True)
+    assert index.query(OTHER_HRN, 1, 5) == ([], True)
+    assert index.query(HRN, 10, 20) == ([(1, 1001), (2, 1002), (4, 1004)], True)
+
+
+@pytest.mark.parametrize("value", ["abc", "1.5", "latest"])
+def test_malformed_bound_is_rejected(value):
+    import app
+
+    client = app.app.test_client()
+    for name in ("min_version", "max_version"):
+        response = client.get(f"/get_opensearch_versions?target_hrn={HRN}&{name}={value}")
+        assert response.status_code == 400
+        assert response.get_json() == {"error": f"Invalid {name}: {value}"}
@@ -0,0 +1,146 @@
+import threading
+
+import pytest
+
+import api_request_handler
+import single_flight
+from single_flight import SingleFlight
+
+CALLERS = 8
+
+
+@pytest.fixture
+def followers(monkeypatch):
+    """
+    Event set once CALLERS - 1 callers have joined a call as followers (counted from the metrics hook).
+    """
+    joined = threading.Semaphore(0)
+    inc = single_flight.metrics.inc
+
+    def counting_inc(name, amount=1, **labels):
+        if name == "single_flight_calls_total" and labels.get("role") == "follower":
+            joined.release()
+        inc(name, amount, **labels)
+
+    monkeypatch.setattr(single_flight.metrics, "inc", counting_inc)
+
+    def wait_for_followers(count=CALLERS - 1):
+        for _ in range(count):
+            assert joined.acquire(timeout=5)
+
+    return wait_for_followers
+
+
+def run_concurrently(target, count=CALLERS):
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = ("ok", target())
+        except BaseException as e:
+            results[i] = ("error", e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def join(threads):
+    for thread in threads:
+        thread.join(5)
+
+
+def test_concurrent_calls_share_one_execution(followers):
+    flight = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def func():
+        calls.append(1)
+        release.wait(5)
+        return object()
+
+    threads, results = run_concurrently(lambda: flight.do("key", func))
+    followers()
+    release.set()
+    join(threads)
+
+    assert len(calls) == 1
+    assert {id(result) for _, result in results} == {id(results[0][1])}
+    assert flight.calls == {}
+
+
+def test_error_reaches_every_waiter(followers):
+    flight = SingleFlight("test")
+    release = threading.Event()
+    error = ValueError("upstream failed")
+
+    def func():
+        release.wait(5)
+        raise error
+
+    threads, results = run_concurrently(lambda: flight.do("key", func))
+    followers()
+    release.set()
+    join(threads)
+
+    assert results == [("error", error)] * CALLERS
+    assert flight.calls == {}
+
+
+def test_interrupted_leader_fails_the_waiters(followers):
+    flight = SingleFlight("test")
+    release = threading.Event()
+
+    def func():
+        release.wait(5)
+        raise KeyboardInterrupt()
+
+    threads, results = run_concurrently(lambda: flight.do("key", func))
+    followers()
+    release.set()
+    join(threads)
+
+    errors = [e for _, e in results]
+    assert sum(isinstance(e, KeyboardInterrupt) for e in errors) == 1
+    assert all("was interrupted" in str(e) for e in errors if not isinstance(e, KeyboardInterrupt))
+    assert flight.calls == {}
+
+
+def test_key_is_released_after_the_call():
+    flight = SingleFlight("test")
+    calls = []
+
+    assert flight.do("key", lambda: calls.append(1) or 1) == 1
+    assert flight.do("key", lambda: calls.append(2) or 2) == 2
+    assert calls == [1, 2]
+    assert flight.calls == {}
+    # 不同 key 各自執行
+    assert flight.do("other", lambda: 3) == 3
+
+
+def test_identical_upstream_gets_hit_upstream_once(stub_upstream):
+    api_request_handler.get_oauth_token()
+    stub_upstream.state.config["latency_ms"] = 300
+    url = "http://%s:%d/metadata/v1/catalogs/hrn:here:data::olp-here:rib-2/versions/minimum" % \
+        stub_upstream.server_address
+
+    threads, results = run_concurrently(lambda: api_request_handler.request_with_token_refresh(url))
+    join(threads)
+
+    assert {status for status, _ in results} == {"ok"}
+    assert {response.status_code for _, response in results} == {200}
+    assert stub_upstream.state.counts["versions_minimum"] == 1
+    api_request_handler.request_with_token_refresh(url)
+    assert stub_upstream.state.counts["versions_minimum"] == 2
+
+
+def test_concurrent_token_requests_fetch_one_token(stub_upstream):
+    stub_upstream.state.config["latency_ms"] = 300
+
+    threads, results = run_concurrently(api_request_handler.get_oauth_token)
+    join(threads)
+
+    assert len({token for _, token in results}) == 1
+    assert stub_upstream.state.counts["token"] == 1
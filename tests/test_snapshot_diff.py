@@ -0,0 +1,127 @@
+import product_compatibility_attributes_pb2 as attributes_pb2
+import product_compatibility_partition_pb2 as partition_pb2
+import pytest
+
+import rmob_version_query_service
+from compatibility_index import HERE_MAP_CONTENT, CompatibilitySnapshot
+from compatibility_store import REGION_NAMES, CompatibilityStore
+from response_cache import ResponseCache, affected_by
+from snapshot_diff import diff_stores
+
+HMC_TYPE = attributes_pb2.CatalogType.Value(HERE_MAP_CONTENT)
+ADDED_DVN = "TEST_ADDED_DVN"
+
+
+def hmc_entries(partition):
+    return [i for i, entry in enumerate(partition.compatibility)
+            if any(c.catalog_type == HMC_TYPE and c.min_version and c.max_version for c in entry.catalogs)]
+
+
+@pytest.fixture
+def mutation(partition_bytes):
+    """
+    The partition with one HMC bound moved, one entry copied under a new DVN and one entry removed.
+    """
+    partition = partition_pb2.VersionsPartition()
+    partition.ParseFromString(partition_bytes)
+    changed, copied, removed = hmc_entries(partition)[:3]
+
+    changed_entry = partition.compatibility[changed]
+    catalog = next(c for c in changed_entry.catalogs if c.catalog_type == HMC_TYPE and c.max_version)
+    old_max = catalog.max_version
+    catalog.max_version += 25
+
+    added_entry = partition.compatibility.add()
+    added_entry.CopyFrom(partition.compatibility[copied])
+    added_entry.dvn = ADDED_DVN
+
+    removed_entry = partition.compatibility[removed]
+    removed_key = (REGION_NAMES[removed_entry.region], removed_entry.dvn)
+    del partition.compatibility[removed]
+
+    return {"store": CompatibilityStore.from_message(partition),
+            "changed": (REGION_NAMES[changed_entry.region], changed_entry.dvn, catalog.hrn, old_max,
+                        catalog.max_version),
+            "added": (REGION_NAMES[added_entry.region], ADDED_DVN),
+            "removed": removed_key}
+
+
+def test_identical_partitions_have_no_diff(store, partition_bytes):
+    diff = diff_stores(store, CompatibilityStore.from_bytes(partition_bytes), 1, 2)
+
+    assert not diff
+    assert diff.changed_dvns == set()
+
+
+def test_diff_reports_mutated_entries(store, mutation):
+    diff = diff_stores(store, mutation["store"], 1, 2)
+    region, dvn, hrn, old_max, new_max = mutation["changed"]
+
+    assert [(e["region"], e["rmob_dvn"]) for e in diff.changed] == [(region, dvn)]
+    [bounds] = diff.changed[0]["bounds_changed"]
+    assert (bounds["catalog_type"], bounds["hrn"]) == (HERE_MAP_CONTENT, hrn)
+    assert bounds["min_version"]["from"] == bounds["min_version"]["to"]
+    assert bounds["max_version"] == {"from": old_max, "to": new_max}
+    assert diff.changed[0]["catalogs_added"] == diff.changed[0]["catalogs_removed"] == []
+    assert [(e["region"], e["rmob_dvn"]) for e in diff.added] == [mutation["added"]]
+    assert [(e["region"], e["rmob_dvn"]) for e in diff.removed] == [mutation["removed"]]
+    assert diff.changed_dvns == {dvn, ADDED_DVN, mutation["removed"][1]}
+
+
+def test_incremental_build_matches_full_build(store, mutation):
+    new_store = mutation["store"]
+    diff = diff_stores(store, new_store, 1, 2)
+    previous = CompatibilitySnapshot.build(1, store)
+
+    incremental = CompatibilitySnapshot.build(2, new_store, previous=previous, changed_dvns=diff.changed_dvns)
+    full = CompatibilitySnapshot.build(2, new_store)
+
+    assert incremental.hmc_dvn_index.by_dvn == full.hmc_dvn_index.by_dvn
+    assert incremental.hmc_dvn_index.by_dvn_region == full.hmc_dvn_index.by_dvn_region
+
+
+def query(snapshot, key):
+    """
+    Answer a response cache key the way app.py's build functions do.
+    """
+    rmob_version_query_service.current_snapshot = snapshot
+    if key[0] == "get_hmc_dvn":
+        return rmob_version_query_service.get_hmc_dvn_query_worker(key[1], key[2])
+    return rmob_version_query_service.get_rmob_dvn_query_worker(key[1], key[2])
+
+
+def test_cache_advance_drops_exactly_the_changed_answers(store, mutation, monkeypatch):
+    monkeypatch.setattr(rmob_version_query_service, "current_snapshot", None)
+    new_store = mutation["store"]
+    diff = diff_stores(store, new_store, 1, 2)
+    old_snapshot = CompatibilitySnapshot.build(1, store)
+    new_snapshot = CompatibilitySnapshot.build(2, new_store)
+
+    regions = [None] + sorted(set(REGION_NAMES.values()))
+    dvns = sorted({row[1] for row in new_store.rows()} | {ADDED_DVN, mutation["removed"][1]})
+    _, _, _, old_max, new_max = mutation["changed"]
+    hmc_versions = sorted({0, 1, old_max, new_max, 7000} | set(range(old_max - 3, new_max + 4))
+                          | set(store.catalog_min[::50]))
+    keys = [("get_hmc_dvn", dvn, region, None) for dvn in dvns for region in (None, mutation["added"][0])]
+    keys += [("get_rmob_dvn", version, region, None) for version in hmc_versions for region in regions]
+    pinned = [("get_hmc_dvn", dvn, None, 1) for dvn in dvns[:20]]
+
+    cache = ResponseCache(max_entries=len(keys) + len(pinned))
+    for key in keys:
+        cache.put(key, None, query(old_snapshot, key))
+    for key in pinned:
+        cache.put(key, None, object())
+    dropped = cache.advance(2, affected_by(diff))
+
+    changed = {key for key in keys if query(old_snapshot, key) != query(new_snapshot, key)}
+    assert any(key[0] == "get_rmob_dvn" for key in changed)
+    kept = set(cache.entries)
+    # 答案變了的一定被丟掉；留下的仍與新快照一致
+    assert not changed & kept
+    for key in kept - set(pinned):
+        assert cache.entries[key] == query(new_snapshot, key)
+    assert set(pinned) <= kept
+    # DVN 查詢只丟 diff 碰到的 DVN
+    assert {key[1] for key in keys if key[0] == "get_hmc_dvn" and key not in kept} == diff.changed_dvns
+    assert any(key[0] == "get_rmob_dvn" for key in kept)
+    assert dropped == len(keys) + len(pinned) - len(kept)
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+import snapshot_disk_cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot_disk_cache, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def assert_same_store(loaded, store):
+    assert loaded.strings.strings == store.strings.strings
+    for name, column in store.columns().items():
+        assert list(getattr(loaded, name)) == list(column), name
+    assert list(loaded.rows()) == list(store.rows())
+
+
+@pytest.mark.parametrize("zero_copy", [False, True])
+def test_round_trip(store, zero_copy):
+    snapshot_disk_cache.save(42, "handle-a", store)
+    header, loaded = snapshot_disk_cache.read_file(snapshot_disk_cache.snapshot_path(42, "handle-a"), zero_copy)
+
+    assert header["version"] == 42
+    assert header["data_handle"] == "handle-a"
+    assert_same_store(loaded, store)
+
+
+def test_load_matches_version_and_data_handle(store):
+    snapshot_disk_cache.save(42, "handle-a", store)
+
+    assert_same_store(snapshot_disk_cache.load(42, "handle-a"), store)
+    assert snapshot_disk_cache.load(42, "handle-b") is None
+    assert snapshot_disk_cache.load(43, "handle-a") is None
+
+
+def corrupt(path):
+    with open(path, "r+b") as f:
+        f.seek(-16, os.SEEK_END)
+        byte = f.read(1)
+        f.seek(-16, os.SEEK_END)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+
+def truncate(path):
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+
+def overwrite_magic(path):
+    with open(path, "r+b") as f:
+        f.write(b"NOTASNAP")
+
+
+def empty(path):
+    open(path, "wb").close()
+
+
+def cut_header(path):
+    with open(path, "r+b") as f:
+        f.truncate(len(snapshot_disk_cache.MAGIC) + 2)
+
+
+@pytest.mark.parametrize("damage", [corrupt, truncate, overwrite_magic, empty, cut_header])
+def test_damaged_file_is_rejected_and_removed(store, damage):
+    snapshot_disk_cache.save(42, "handle-a", store)
+    path = snapshot_disk_cache.snapshot_path(42, "handle-a")
+    damage(path)
+
+    with pytest.raises(snapshot_disk_cache.INVALID_FILE_ERRORS):
+        snapshot_disk_cache.read_file(path)
+    assert snapshot_disk_cache.load(42, "handle-a") is None
+    assert not os.path.exists(path)
+
+
+def test_load_newest_skips_damaged_files(store):
+    snapshot_disk_cache.save(41, "handle-a", store)
+    snapshot_disk_cache.save(42, "handle-b", store)
+    newest = snapshot_disk_cache.snapshot_path(42, "handle-b")
+    truncate(newest)
+
+    header, loaded = snapshot_disk_cache.load_newest(zero_copy=True)
+
+    assert header["version"] == 41
+    assert_same_store(loaded, store)
+    assert not os.path.exists(newest)
+
+
+def test_evict_keeps_the_newest_file(store, monkeypatch):
+    for version in (40, 41, 42):
+        snapshot_disk_cache.save(version, "handle", store)
+    monkeypatch.setattr(snapshot_disk_cache, "MAX_CACHE_BYTES", 1)
+    snapshot_disk_cache.evict()
+
+    assert [os.path.basename(path) for path in snapshot_disk_cache._cache_files(newest_first=True)] == \
+        [os.path.basename(snapshot_disk_cache.snapshot_path(42, "handle"))]
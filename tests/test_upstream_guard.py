@@ -0,0 +1,185 @@
+import threading
+
+import pytest
+
+import upstream_guard
+from upstream_guard import CLOSED, HALF_OPEN, OPEN, HostGuard, UpstreamUnavailable
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(upstream_guard, "time", clock)
+    monkeypatch.setattr(upstream_guard, "HOST_MAX_CONCURRENCY", 8)
+    monkeypatch.setattr(upstream_guard, "HOST_MIN_CONCURRENCY", 1)
+    monkeypatch.setattr(upstream_guard, "RECOVERY_CONCURRENCY", 4)
+    monkeypatch.setattr(upstream_guard, "BREAKER_FAILURE_THRESHOLD", 3)
+    monkeypatch.setattr(upstream_guard, "BREAKER_OPEN_SECONDS", 30.0)
+    monkeypatch.setattr(upstream_guard, "LATENCY_SLO", 10.0)
+    monkeypatch.setattr(upstream_guard, "QUEUE_TIMEOUT", 0.0)
+    monkeypatch.setattr(upstream_guard, "_guards", {})
+    return clock
+
+
+def call(guard, ok=True, seconds=0.1):
+    probe = guard.acquire()
+    guard.release(probe, seconds, ok)
+    return probe
+
+
+def open_circuit(guard):
+    for _ in range(upstream_guard.BREAKER_FAILURE_THRESHOLD):
+        call(guard, ok=False)
+    assert guard.state == OPEN
+
+
+def test_failures_below_threshold_keep_the_circuit_closed(clock):
+    guard = HostGuard("http://upstream")
+    call(guard, ok=False)
+    call(guard, ok=False)
+    call(guard)
+    call(guard, ok=False)
+    call(guard, ok=False)
+
+    assert guard.state == CLOSED
+    assert guard.failures == 2
+
+
+def test_open_circuit_refuses_with_retry_after(clock):
+    guard = upstream_guard.guard_for("http://upstream/metadata/v1/catalogs")
+    open_circuit(guard)
+    clock.advance(10)
+
+    with pytest.raises(UpstreamUnavailable) as error:
+        guard.acquire()
+
+    assert error.value.retry_after == pytest.approx(20)
+    assert guard.refusing()
+    assert upstream_guard.any_open()
+    assert guard.in_flight == 0
+
+
+def test_half_open_probe_success_closes_the_circuit(clock):
+    guard = HostGuard("http://upstream")
+    open_circuit(guard)
+    clock.advance(30)
+
+    assert not guard.refusing()
+    probe = guard.acquire()
+    assert probe and guard.state == HALF_OPEN
+    guard.release(probe, 0.1, True)
+
+    assert guard.state == CLOSED
+    assert guard.failures == 0
+    assert guard.limit >= upstream_guard.RECOVERY_CONCURRENCY
+    assert call(guard) is False
+
+
+def test_half_open_probe_failure_reopens_the_circuit(clock):
+    guard = HostGuard("http://upstream")
+    open_circuit(guard)
+    clock.advance(31)
+
+    assert call(guard, ok=False) is True
+
+    assert guard.state == OPEN
+    assert guard.opened_at == clock.now
+    with pytest.raises(UpstreamUnavailable) as error:
+        guard.acquire()
+    assert error.value.retry_after == pytest.approx(30)
+
+
+def test_half_open_callers_give_up_after_queue_timeout_while_the_probe_runs(clock):
+    guard = HostGuard("http://upstream")
+    open_circuit(guard)
+    clock.advance(30)
+    probe = guard.acquire()
+
+    with pytest.raises(UpstreamUnavailable, match="probe still in flight"):
+        guard.acquire()
+    guard.release(probe, 0.1, True)
+    assert guard.state == CLOSED
+
+
+def test_half_open_callers_wait_for_the_probe(clock, monkeypatch):
+    monkeypatch.setattr(upstream_guard, "QUEUE_TIMEOUT", 5.0)
+    guard = HostGuard("http://upstream")
+    open_circuit(guard)
+    clock.advance(30)
+    probe = guard.acquire()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(guard.acquire()))
+    waiter.start()
+
+    guard.release(probe, 0.1, True)
+    waiter.join(5)
+
+    assert results == [False]
+    assert guard.in_flight == 1
+
+
+def test_limit_halves_on_failure_and_slow_calls(clock, monkeypatch):
+    monkeypatch.setattr(upstream_guard, "BREAKER_FAILURE_THRESHOLD", 10)
+    guard = HostGuard("http://upstream")
+    assert guard.limit == 8
+
+    call(guard, ok=False)
+    assert guard.limit == 4
+    call(guard, seconds=upstream_guard.LATENCY_SLO + 1)  # 成功但太慢
+    assert guard.limit == 2
+    assert guard.failures == 2
+    call(guard, ok=False)
+    call(guard, ok=False)
+    assert guard.limit == upstream_guard.HOST_MIN_CONCURRENCY
+
+
+def test_limit_grows_by_one_per_round_trip(clock):
+    guard = HostGuard("http://upstream")
+    guard.limit = 2.0
+
+    call(guard, seconds=0.5)
+    assert guard.limit == 3
+    # 在上次調高之前就開始的呼叫不再調高
+    call(guard, seconds=0.5)
+    assert guard.limit == 3
+    clock.advance(1)
+    call(guard, seconds=0.5)
+    assert guard.limit == 4
+
+    for _ in range(10):
+        clock.advance(1)
+        call(guard)
+    assert guard.limit == upstream_guard.HOST_MAX_CONCURRENCY
+
+
+def test_full_limit_refuses_after_queue_timeout(clock):
+    guard = HostGuard("http://upstream")
+    guard.limit = 1.0
+    probe = guard.acquire()
+
+    with pytest.raises(UpstreamUnavailable, match="Concurrency limit 1"):
+        guard.acquire()
+    guard.release(probe, 0.1, True)
+    assert call(guard) is False
+
+
+def test_retry_after_header(clock):
+    import app
+
+    with app.app.test_request_context():
+        response = app.upstream_unavailable(UpstreamUnavailable("Circuit open", 12.4))
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "12"
+    assert response.get_json()["retry_after_seconds"] == 12.4
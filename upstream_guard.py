@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import metrics
+
+# 每個上游 host 的並行上限 (依延遲與失敗自動在 MIN ~ MAX 之間調整)
+HOST_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_HOST_MAX_CONCURRENCY", "16"))
+HOST_MIN_CONCURRENCY = int(os.getenv("UPSTREAM_HOST_MIN_CONCURRENCY", "1"))
+QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "2"))  # 等待並行名額的上限 (秒)
+LATENCY_SLO = float(os.getenv("UPSTREAM_LATENCY_SLO", "10"))  # 超過即視同失敗 (秒)
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))  # 連續失敗幾次後斷路
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))  # 斷路多久後放行一個探測請求
+# 斷路恢復時並行上限至少回到這個值，
+# 避免長時間卡在 1 (例如 dependency index 的分頁並行抓取)
+RECOVERY_CONCURRENCY = max(HOST_MIN_CONCURRENCY, HOST_MAX_CONCURRENCY // 2)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Raised instead of calling a host whose circuit is open or whose concurrency limit stayed full.
+    """
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class HostGuard:
+    """
+    Adaptive concurrency limit plus circuit breaker for one upstream host.
+
+    The limit grows by one per round trip (a call that succeeds within LATENCY_SLO and started after the last
+    increase) and halves on every failure or slow call (AIMD), so a slowing host gets fewer parallel calls instead
+    of tying up every worker thread, and a quiet host still recovers within a few calls. After
+    BREAKER_FAILURE_THRESHOLD consecutive failures the circuit opens and calls fail immediately; after
+    BREAKER_OPEN_SECONDS a single probe call is let through (half-open), and its outcome closes or reopens it; calls
+    made meanwhile wait for that outcome. Closing resets the limit to at least RECOVERY_CONCURRENCY.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.limit = float(HOST_MAX_CONCURRENCY)
+        self.in_flight = 0
+        self.state = CLOSED
+        self.failures = 0  # 連續失敗數
+        self.opened_at = 0.0
+        self.increased_at = 0.0  # 上次調高上限的時間，每個 round trip 最多 +1
+        self.probing = False
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Take a call slot, waiting up to QUEUE_TIMEOUT for one (or, while half-open, for the probe to finish).
+        Returns True when the call is the half-open probe.
+        """
+        deadline = time.monotonic() + QUEUE_TIMEOUT
+        with self.condition:
+            while True:
+                if self.state == OPEN:
+                    retry_after = self.opened_at + BREAKER_OPEN_SECONDS - time.monotonic()
+                    if retry_after > 0:
+                        metrics.inc("upstream_rejected_total", host=self.host, reason="circuit_open")
+                        raise UpstreamUnavailable(f"Circuit open for {self.host} after {self.failures} failures",
+                                                  retry_after)
+                    self.state = HALF_OPEN
+                if self.state == HALF_OPEN and not self.probing:
+                    self.probing = True
+                    self.in_flight += 1
+                    return True
+                if self.state == CLOSED and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return False
+                # 名額已滿，或 half-open 時等探測結果
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if self.state == HALF_OPEN:
+                        metrics.inc("upstream_rejected_total", host=self.host, reason="circuit_open")
+                        raise UpstreamUnavailable(f"Circuit half-open for {self.host}, probe still in flight",
+                                                  BREAKER_OPEN_SECONDS)
+                    metrics.inc("upstream_rejected_total", host=self.host, reason="concurrency_limit")
+                    raise UpstreamUnavailable(f"Concurrency limit {int(self.limit)} for {self.host} still full "
+                                              f"after {QUEUE_TIMEOUT}s", QUEUE_TIMEOUT)
+                self.condition.wait(remaining)
+
+    def release(self, probe, seconds, ok):
+        """
+        Return the slot of a call that took ``seconds``; ok is False for errors and 429/5xx responses.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if probe:
+                self.probing = False
+            if ok and seconds <= LATENCY_SLO:
+                self.failures = 0
+                now = time.monotonic()
+                if now - seconds >= self.increased_at:
+                    self.limit = min(float(HOST_MAX_CONCURRENCY), self.limit + 1)
+                    self.increased_at = now
+                if self.state != CLOSED:
+                    self.state = CLOSED
+                    self.limit = max(self.limit, float(RECOVERY_CONCURRENCY))
+                    print(f"✅ Upstream {self.host} recovered, circuit closed")
+            else:
+                self.failures += 1
+                self.limit = max(float(HOST_MIN_CONCURRENCY), self.limit / 2)
+                if self.state != OPEN and (probe or self.failures >= BREAKER_FAILURE_THRESHOLD):
+                    self.state = OPEN
+                    self.opened_at = time.monotonic()
+                    reason = "slow" if ok else "failing"
+                    print(f"[WARN] Upstream {self.host} {reason} ({self.failures} in a row), circuit open for "
+                          f"{BREAKER_OPEN_SECONDS}s")
+            self.condition.notify_all()
+
+    def refusing(self):
+        """
+        Whether a call made now would be refused: open and within BREAKER_OPEN_SECONDS. An open circuit whose time
+        is up is not refusing; the next call becomes its probe.
+        """
+        return self.state == OPEN and time.monotonic() < self.opened_at + BREAKER_OPEN_SECONDS
+
+    def status(self):
+        with self.condition:
+            return {"state": self.state, "concurrency_limit": int(self.limit), "in_flight": self.in_flight,
+                    "consecutive_failures": self.failures}
+
+
+def host_of(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def guard_for(url):
+    host = host_of(url)
+    guard = _guards.get(host)
+    if guard is None:
+        with _guards_lock:
+            guard = _guards.setdefault(host, HostGuard(host))
+    return guard
+
+
+def any_open():
+    """
+    Whether some upstream host currently refuses calls (see HostGuard.refusing).
+    """
+    return any(guard.refusing() for guard in list(_guards.values()))
+
+
+def status():
+    return {host: guard.status() for host, guard in sorted(_guards.items())}
@@ -0,0 +1,108 @@
+import os
+import threading
+from collections import OrderedDict
+
+import metrics
+from compatibility_index import FrozenDict
+from single_flight import SingleFlight
+
+MAX_VERSIONS = int(os.getenv("OPENSEARCH_METADATA_MAX_VERSIONS", "5000"))
+
+_MISSING = object()  # 上游回傳範圍內不存在的版本 (negative cache)
+
+
+def freeze(value):
+    """
+    Recursively turn a decoded JSON value into FrozenDict / tuple so cached entries can be shared safely.
+    """
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class VersionMetadataStore:
+    """
+    Per-version cache of catalog version metadata (the entries of the metadata API ``versions`` call).
+
+    Entries are immutable once published. A range request only fetches the sub-ranges that are not cached yet,
+    concurrent requests for the same sub-range share one upstream call, and the least recently used versions are
+    evicted beyond max_versions. Upstream calls never run under the store lock.
+    """
+
+    def __init__(self, fetch_range, max_versions=MAX_VERSIONS, name="version_metadata"):
+        # fetch_range(start_exclusive, end_inclusive) -> list of version entries
+        self.fetch_range = fetch_range
+        self.name = name  # cache label in metrics
+        self.max_versions = max_versions
+        self.entries = OrderedDict()
+        self.fetches = SingleFlight(name)  # 同一段範圍同時只向上游抓一次
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_range(self, start_version, end_version):
+        """
+        Return the cached entries for versions in (start_version, end_version], fetching what is missing.
+        """
+        wanted = range(start_version + 1, end_version + 1)
+        if len(wanted) > self.max_versions:
+            # 超過快取容量的範圍直接向上游查詢，不寫入快取
+            return [freeze(entry) for entry in self.fetch_range(start_version, end_version)]
+        with self.lock:
+            missing = [version for version in wanted if version not in self.entries]
+            if not missing:
+                self.hits += 1
+                metrics.cache_result(self.name, True)
+                return self._collect(wanted)
+            self.misses += 1
+            metrics.cache_result(self.name, False)
+            runs = self._runs(missing)
+
+        for sub_range in runs:
+            self.fetches.do(sub_range, lambda: self._fetch(sub_range))
+        with self.lock:
+            return self._collect(wanted)
+
+    def _fetch(self, sub_range):
+        start, end = sub_range
+        with self.lock:
+            if all(version in self.entries for version in range(start, end + 1)):
+                return  # 另一個請求剛抓完這一段
+        fetched = {entry["version"]: freeze(entry) for entry in self.fetch_range(start - 1, end)}
+        # 只把低於已回傳最大版本的空缺視為不存在；更新的版本之後可能才發佈
+        known_until = max(fetched, default=start - 1)
+        with self.lock:
+            for version in range(start, end + 1):
+                entry = fetched.get(version, _MISSING if version < known_until else None)
+                if entry is None:
+                    continue
+                self.entries[version] = entry
+                self.entries.move_to_end(version)
+            while len(self.entries) > self.max_versions:
+                self.entries.popitem(last=False)
+
+    def _collect(self, wanted):
+        result = []
+        for version in wanted:
+            entry = self.entries.get(version, _MISSING)
+            if entry is not _MISSING:
+                self.entries.move_to_end(version)
+                result.append(entry)
+        return result
+
+    @staticmethod
+    def _runs(versions):
+        """
+        Split sorted versions into contiguous inclusive (first, last) runs.
+        """
+        runs = []
+        first = previous = versions[0]
+        for version in versions[1:]:
+            if version != previous + 1:
+                runs.append((first, previous))
+                first = version
+            previous = version
+        runs.append((first, previous))
+        return runs
@@ -0,0 +1,267 @@
+import asyncio
+import os
+import threading
+import time
+
+import api_request_handler
+import async_upstream
+import metrics
+import opensearch_version_query_service
+import rmob_version_query_service
+import shared_snapshot
+import snapshot_disk_cache
+import upstream_guard
+
+# 背景輪詢間隔與可接受的最大資料延遲 (秒)
+REFRESH_INTERVAL = float(os.getenv("SNAPSHOT_REFRESH_INTERVAL", "300"))
+MAX_STALENESS = float(os.getenv("SNAPSHOT_MAX_STALENESS", "3600"))
+SHARED_POLL_INTERVAL = 5  # follower 檢查 leader 是否仍存在的間隔 (秒)
+
+TRACKED_CATALOGS = {
+    rmob_version_query_service.RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN:
+        lambda token: rmob_version_query_service.get_latest_catalog_version(
+            rmob_version_query_service.RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN, token),
+    rmob_version_query_service.RIB_2_CATALOG_HRN:
+        lambda token: rmob_version_query_service.get_latest_catalog_version(
+            rmob_version_query_service.RIB_2_CATALOG_HRN, token),
+    opensearch_version_query_service.CATALOG_HRN: opensearch_version_query_service.get_latest_catalog_version,
+}
+
+REFRESH_STATUS = {
+    "last_attempt_at": None,
+    "last_success_at": None,
+    # 相容性 catalog 最後一次確認快照為最新的時間，staleness 由此起算
+    "snapshot_confirmed_at": None,
+    "last_duration_ms": None,
+    "last_error": None,
+}
+REFRESH_LOCK = threading.RLock()  # Only one refresh (background or on-demand) at a time
+
+_thread = None
+_thread_lock = threading.Lock()
+_seen_generation = None
+# 由請求觸發的背景更新同時只跑一個 (在背景執行緒釋放，故不用 RLock)
+_revalidate_lock = threading.Lock()
+_published_dependency_until = None  # leader 最後發佈的 dependency index 版本
+
+
+def epoch_to_iso(epoch):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(epoch)) if epoch else None
+
+
+def refresh():
+    """
+    Poll the tracked catalogs and install a new compatibility snapshot if rib-product-compatibility-1 moved.
+    The upstream calls of one round run concurrently (see async_upstream.refresh_all).
+    Failures are recorded in REFRESH_STATUS and the first one is re-raised after the catalogs that answered were
+    applied; without a new compatibility version the current snapshot stays in place.
+    """
+    with REFRESH_LOCK:
+        started = time.time()
+        REFRESH_STATUS["last_attempt_at"] = started
+        versions, error = {}, None
+        try:
+            versions, errors = asyncio.run(async_upstream.refresh_all())
+            # 部分 catalog 失敗時，其他 catalog 的結果 (含新快照) 仍然生效
+            rmob_version_query_service.latest_catalog_versions.update(versions)
+            if rmob_version_query_service.RIB_PRODUCT_COMPATIBILITY_1_CATALOG_HRN in versions:
+                # 其他 catalog (例如 OpenSearch) 的故障不影響快照本身的新鮮度
+                REFRESH_STATUS["snapshot_confirmed_at"] = time.time()
+            if errors:
+                raise errors[0]
+        except Exception as e:
+            REFRESH_STATUS["last_error"] = str(e)
+            metrics.inc("refresh_failures_total")
+            error = e
+        else:
+            REFRESH_STATUS["last_success_at"] = time.time()
+            REFRESH_STATUS["last_error"] = None
+        finally:
+            REFRESH_STATUS["last_duration_ms"] = round((time.time() - started) * 1000, 1)
+            metrics.observe("refresh_duration_seconds", time.time() - started)
+
+        if versions and rmob_version_query_service.current_snapshot is not None and \
+                shared_snapshot.SHARED_MODE and shared_snapshot.is_leader():
+            try:
+                shared_snapshot.publish(rmob_version_query_service.current_snapshot, {
+                    "latest_versions": dict(rmob_version_query_service.latest_catalog_versions),
+                    "refresh_status": dict(REFRESH_STATUS),
+                    "dependency_index_until": publish_dependency_index(),
+                })
+            except (OSError, ValueError) as e:
+                print(f"[WARN] Failed to publish shared snapshot: {e}")
+        if error is not None:
+            raise error
+
+
+def publish_dependency_index():
+    """
+    Leader side of shared mode: write the OpenSearch dependency index for the followers when it moved since the
+    last publish. Returns the published catalog version, or None while nothing was indexed yet.
+    """
+    global _published_dependency_until
+    index = opensearch_version_query_service.DEPENDENCY_INDEX
+    with index.update_lock:
+        if index.indexed_until is not None and index.indexed_until != _published_dependency_until:
+            _published_dependency_until = shared_snapshot.publish_dependency_index(index)
+    return _published_dependency_until
+
+
+def sync_shared():
+    """
+    Follower side of shared mode: adopt whatever the leader published since the last check. The generation
+    counter is read from the shared mapping on every call; the snapshot file is only mapped when it changed.
+    A generation whose file cannot be mapped is skipped (warned once) until the leader publishes the next one.
+    """
+    global _seen_generation
+    generation = shared_snapshot.current_generation()
+    if generation == _seen_generation:
+        return
+    generation, info = shared_snapshot.read_published()
+    if info is None:
+        return
+
+    snapshot = rmob_version_query_service.current_snapshot
+    if snapshot is None or snapshot.version != info["version"]:
+        try:
+            header, store = shared_snapshot.load_published(info)
+        except snapshot_disk_cache.INVALID_FILE_ERRORS as e:
+            _seen_generation = generation
+            print(f"[WARN] Failed to map shared snapshot {info['path']}: {e}")
+            return
+        rmob_version_query_service.install_store(header["version"], store, data_handle=header["data_handle"],
+                                                 created_at=info["created_at"])
+
+    state = info["state"]
+    rmob_version_query_service.latest_catalog_versions.update(state["latest_versions"])
+    REFRESH_STATUS.update(state["refresh_status"])
+    _seen_generation = generation
+
+    dependency_until = state.get("dependency_index_until")
+    index = opensearch_version_query_service.DEPENDENCY_INDEX
+    if dependency_until is not None and (index.indexed_until is None or index.indexed_until < dependency_until):
+        try:
+            index.install(*shared_snapshot.load_dependency_index())
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[WARN] Failed to load shared dependency index: {e}")
+
+
+def staleness():
+    """
+    Seconds since the compatibility catalog last confirmed the snapshot as its latest version, or None if there is
+    no snapshot yet. A snapshot loaded from the disk cache counts from the time it was written.
+    """
+    snapshot = rmob_version_query_service.current_snapshot
+    if snapshot is None:
+        return None
+    confirmed_at = REFRESH_STATUS["snapshot_confirmed_at"] or snapshot.created_at
+    return time.time() - confirmed_at
+
+
+def ensure_snapshot():
+    """
+    Called by request handlers: serve the current snapshot as long as it is within MAX_STALENESS. A snapshot that
+    is too old is still served (marked stale by the API) while a background revalidation refreshes it, unless an
+    upstream circuit is open; only a process without any snapshot waits for a blocking refresh.
+    """
+    if shared_snapshot.SHARED_MODE and not shared_snapshot.is_leader():
+        sync_shared()
+        # follower 只在完全沒有快照時才自行向上游更新，其餘交給 leader
+        if rmob_version_query_service.current_snapshot is not None:
+            metrics.cache_result("snapshot", True)
+            return
+
+    age = staleness()
+    if age is not None and age <= MAX_STALENESS:
+        metrics.cache_result("snapshot", True)
+        return
+    metrics.cache_result("snapshot", False)
+    if age is not None:
+        # stale-while-revalidate：請求不等上游，斷路中也不觸發更新
+        metrics.inc("stale_snapshot_served_total")
+        if not upstream_guard.any_open() and _revalidate_lock.acquire(blocking=False):
+            threading.Thread(target=_revalidate, name="snapshot-revalidate", daemon=True).start()
+        return
+
+    with REFRESH_LOCK:
+        # 另一個執行緒可能已經完成更新
+        if staleness() is not None:
+            return
+        refresh()
+
+
+def _revalidate():
+    """
+    Background refresh started by ensure_snapshot for a stale snapshot; at most one runs at a time.
+    """
+    try:
+        with REFRESH_LOCK:
+            # 背景輪詢可能剛更新完
+            if staleness() > MAX_STALENESS:
+                refresh()
+    except Exception as e:
+        print(f"[WARN] Revalidation failed, serving snapshot {staleness():.0f}s old: {e}")
+    finally:
+        _revalidate_lock.release()
+
+
+def get_latest_version(catalog_hrn):
+    """
+    Latest known version of a tracked catalog, fetched on demand only if the tracker has not seen it yet.
+    """
+    version = rmob_version_query_service.latest_catalog_versions.get(catalog_hrn)
+    if version is None:
+        version = TRACKED_CATALOGS[catalog_hrn](api_request_handler.get_oauth_token())
+    return version
+
+
+def _run():
+    while True:
+        if shared_snapshot.SHARED_MODE and not shared_snapshot.try_become_leader():
+            try:
+                sync_shared()
+            except Exception as e:
+                print(f"[WARN] Shared snapshot sync failed: {e}")
+            time.sleep(SHARED_POLL_INTERVAL)
+            continue
+        try:
+            refresh()
+        except Exception as e:
+            print(f"[WARN] Background snapshot refresh failed: {e}")
+        # 斷路中時在斷路期滿後就再試，作為 half-open 探測
+        time.sleep(min(REFRESH_INTERVAL, upstream_guard.BREAKER_OPEN_SECONDS) if upstream_guard.any_open()
+                   else REFRESH_INTERVAL)
+
+
+def start():
+    """
+    Start the background refresher thread once per process, serving the disk-cached snapshot until it revalidates.
+    """
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            if shared_snapshot.SHARED_MODE:
+                sync_shared()
+            # shared mode 已映射 leader 的快照時，不再從磁碟另外複製一份
+            if rmob_version_query_service.current_snapshot is None:
+                rmob_version_query_service.load_cached_snapshot()
+            _thread = threading.Thread(target=_run, name="snapshot-refresher", daemon=True)
+            _thread.start()
+
+
+def status():
+    age = staleness()
+    snapshot = rmob_version_query_service.current_snapshot
+    return {
+        "snapshot_version": snapshot.version if snapshot is not None else None,
+        "snapshot_age_seconds": round(age, 1) if age is not None else None,
+        "latest_versions": dict(rmob_version_query_service.latest_catalog_versions),
+        "refresh_interval_seconds": REFRESH_INTERVAL,
+        "max_staleness_seconds": MAX_STALENESS,
+        "last_attempt_at": epoch_to_iso(REFRESH_STATUS["last_attempt_at"]),
+        "last_success_at": epoch_to_iso(REFRESH_STATUS["last_success_at"]),
+        "snapshot_confirmed_at": epoch_to_iso(REFRESH_STATUS["snapshot_confirmed_at"]),
+        "last_duration_ms": REFRESH_STATUS["last_duration_ms"],
+        "last_error": REFRESH_STATUS["last_error"],
+        "upstream": upstream_guard.status(),
+    }